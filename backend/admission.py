@@ -0,0 +1,128 @@
+import asyncio
+import os
+import re
+from collections import deque
+from starlette.responses import JSONResponse
+
+# Admission control. Expensive routes get a class with its own concurrency limit and a bounded
+# queue, so a burst of logins or uploads waits its turn (or is turned away with a 503) instead of
+# filling the threadpool that streaming and ordinary reads run in. Classes without a limit,
+# including everything unlisted, are never held. Limits are per API worker process.
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", 10))   # seconds a request may wait for a slot
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", 5))
+
+# (class, method or None for any, path pattern), first match wins
+ROUTE_CLASSES = [
+    ("stream", None, re.compile(r"^/api/recordings/\d+/(stream|hls/.+)$|^/api/setlists/\d+/rehearsal$")),
+    ("auth", "POST", re.compile(r"^/api/(login|register)$")),   # bcrypt
+    ("upload", "POST", re.compile(r"^/api/tunes/\d+/recordings$|^/api/import$")),
+    ("heavy", "GET", re.compile(r"^/api/(sessions|export|practice/rollups|practice/next)$")),
+]
+# class -> (concurrency, queue depth) defaults; 0 concurrency for no limit.
+# The limited classes together stay well under the threadpool's 40 threads.
+DEFAULT_LIMITS = {"stream": (0, 0), "auth": (4, 32), "upload": (4, 8), "heavy": (8, 32), "default": (0, 0)}
+
+
+class Shed(Exception):
+    pass
+
+class Gate:
+    def __init__(self, name: str, limit: int, queue: int):
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.running = 0
+        self.waiters = deque()
+        self.admitted = 0
+        self.shed = 0
+        self.timed_out = 0
+
+    async def acquire(self):
+        if not self.limit:
+            self.admitted += 1
+            return
+        if self.running < self.limit and not self.waiters:
+            self.running += 1
+            self.admitted += 1
+            return
+        if len(self.waiters) >= self.queue:
+            self.shed += 1
+            raise Shed()
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), ADMISSION_QUEUE_TIMEOUT)
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                self.release()   # a slot was handed over just as the wait ended
+            else:
+                waiter.cancel()
+                self.waiters.remove(waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                self.timed_out += 1
+                raise Shed() from None
+            raise
+        self.admitted += 1
+
+    def release(self):
+        if not self.limit:
+            return
+        # The slot passes straight to the longest waiting request, running stays the same
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.running -= 1
+
+    def metrics(self) -> dict:
+        return {
+            "concurrency": self.limit or None,
+            "queue_depth": self.queue if self.limit else None,
+            "running": self.running,
+            "waiting": len(self.waiters),
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "timed_out": self.timed_out,
+        }
+
+def _limits(name: str) -> tuple[int, int]:
+    limit, queue = DEFAULT_LIMITS[name]
+    return (
+        int(os.getenv(f"ADMISSION_{name.upper()}_CONCURRENCY", limit)),
+        int(os.getenv(f"ADMISSION_{name.upper()}_QUEUE", queue)),
+    )
+
+gates = {name: Gate(name, *_limits(name)) for name in DEFAULT_LIMITS}
+
+def route_class(method: str, path: str) -> str:
+    for name, route_method, pattern in ROUTE_CLASSES:
+        if route_method in (None, method) and pattern.match(path):
+            return name
+    return "default"
+
+def metrics() -> dict:
+    return {name: gate.metrics() for name, gate in gates.items()}
+
+
+class AdmissionControl:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        gate = gates[route_class(scope["method"], scope["path"])]
+        try:
+            await gate.acquire()
+        except Shed:
+            response = JSONResponse(
+                status_code=503,
+                content={"detail": "Server busy, try again shortly"},
+                headers={"Retry-After": str(ADMISSION_RETRY_AFTER)},
+            )
+            return await response(scope, receive, send)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            gate.release()
@@ -0,0 +1,488 @@
+import hashlib
+import os
+from collections import defaultdict
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from sqlalchemy import select, delete, insert, and_, func
+from sqlalchemy.orm import Session, aliased
+from database import SessionLocal
+from models import Recording, Segment, Tune, Fingerprint
+import pcm
+
+ANALYSIS_SAMPLE_RATE = 11025
+N_FFT = 1024
+HOP = 256
+FRAME_RATE = ANALYSIS_SAMPLE_RATE / HOP   # onset envelope frames per second
+BLOCK_FRAMES = 4096   # STFT frames per block, bounds memory on hour-long recordings
+MIN_BPM = 40
+MAX_BPM = 240
+MIN_TEMPO_SECONDS = 4   # too few beats to trust below this
+
+N_MELS = 26
+N_MFCC = 13
+FEATURE_SECONDS = 0.5   # pooled feature resolution for structure analysis
+MAX_FEATURE_FRAMES = 2000   # caps the self-similarity matrix at 2000x2000 for long recordings
+NOVELTY_KERNEL_SECONDS = 8
+
+LOUDNESS_SAMPLE_RATE = 48000
+LOUDNESS_STEP_SECONDS = 0.1   # gating blocks are 400 ms, built from four steps for 75% overlap
+LOUDNESS_TARGET_LUFS = float(os.getenv("LOUDNESS_TARGET_LUFS", -23))   # EBU R128
+PEAK_CEILING_DB = -1.0   # gain never pushes the peak above this
+ABSOLUTE_GATE_LUFS = -70
+RELATIVE_GATE_LU = -10
+
+# Landmark fingerprints: pairs of spectrogram peaks hashed as (anchor bin, target bin, frame gap)
+PEAK_NEIGHBORHOOD = (15, 9)    # frames x bins a peak must dominate, about 350 ms by 100 Hz
+PEAKS_PER_SECOND = 20
+FAN_OUT = 5                    # targets paired with each anchor
+MAX_PAIR_FRAMES = 63           # 6 bits, about 1.5 s
+MIN_MATCHING_HASHES = 20       # aligned hashes needed before two recordings count as sharing material
+DUPLICATE_COVERAGE = 0.5       # both recordings mostly made of the same material
+
+# BS.1770 K-weighting at 48 kHz: high shelf (head effects) then high-pass (RLB curve)
+K_WEIGHTING = [
+    ([1.53512485958697, -2.69169618940638, 1.19839281085285], [1.0, -1.69065929318241, 0.73248077421585]),
+    ([1.0, -2.0, 1.0], [1.0, -1.99004745483398, 0.99007225036621]),
+]
+
+
+def stft_blocks(samples: np.ndarray):
+    # Magnitude spectrogram in blocks of frames, so hour-long recordings never hold the whole STFT
+    n_frames = 1 + (len(samples) - N_FFT) // HOP
+    window = np.hanning(N_FFT).astype(np.float32)
+    for start in range(0, max(n_frames, 0), BLOCK_FRAMES):
+        stop = min(start + BLOCK_FRAMES, n_frames)
+        block = samples[start * HOP:(stop - 1) * HOP + N_FFT]
+        frames = sliding_window_view(block, N_FFT)[::HOP] * window
+        yield np.abs(np.fft.rfft(frames, axis=1)).astype(np.float32)
+
+def onset_envelope(samples: np.ndarray) -> np.ndarray:
+    # Spectral flux: summed positive change in log-magnitude between consecutive frames
+    envelope = []
+    previous = None
+    for magnitude in stft_blocks(samples):
+        magnitude = np.log1p(100 * magnitude)
+        if previous is None:
+            previous = magnitude[:1]
+        flux = np.diff(np.vstack([previous, magnitude]), axis=0)
+        envelope.append(np.maximum(flux, 0).sum(axis=1))
+        previous = magnitude[-1:]
+    return np.concatenate(envelope) if envelope else np.zeros(0, dtype=np.float32)
+
+def estimate_tempo(envelope: np.ndarray, frame_rate: float = FRAME_RATE) -> float | None:
+    if len(envelope) < MIN_TEMPO_SECONDS * frame_rate:
+        return None
+    # Remove the slowly varying loudness trend so the autocorrelation follows the pulse
+    trend_width = int(frame_rate)
+    trend = np.convolve(envelope, np.ones(trend_width) / trend_width, mode="same")
+    onsets = np.maximum(envelope - trend, 0)
+    onsets -= onsets.mean()
+
+    n = len(onsets)
+    n_fft = 1 << (2 * n - 1).bit_length()
+    spectrum = np.fft.rfft(onsets, n_fft)
+    autocorr = np.fft.irfft(spectrum * np.conj(spectrum), n_fft)[:n]
+    if autocorr[0] <= 0:
+        return None
+    autocorr /= autocorr[0]
+
+    min_lag = int(np.ceil(60 * frame_rate / MAX_BPM))
+    max_lag = min(int(60 * frame_rate / MIN_BPM), n - 2)
+    if max_lag <= min_lag:
+        return None
+    lags = np.arange(min_lag, max_lag + 1)
+    # Log-normal prior centered on 120 BPM resolves half/double tempo ambiguity
+    prior = np.exp(-0.5 * np.log2(60 * frame_rate / lags / 120) ** 2)
+    best = int(np.argmax(autocorr[lags] * prior)) + min_lag
+
+    # Parabolic interpolation for a sub-frame lag
+    left, center, right = autocorr[best - 1], autocorr[best], autocorr[best + 1]
+    denominator = left - 2 * center + right
+    offset = 0.5 * (left - right) / denominator if denominator else 0.0
+    return round(60 * frame_rate / (best + offset), 1)
+
+def _chroma_matrix() -> np.ndarray:
+    # Maps each FFT bin between A1 and ~5 kHz onto its pitch class
+    freqs = np.fft.rfftfreq(N_FFT, 1 / ANALYSIS_SAMPLE_RATE)
+    matrix = np.zeros((len(freqs), 12), dtype=np.float32)
+    audible = (freqs >= 55) & (freqs <= 5000)
+    pitch_class = np.round(12 * np.log2(freqs[audible] / 440) + 69).astype(int) % 12
+    matrix[np.flatnonzero(audible), pitch_class] = 1
+    return matrix
+
+def _mel_matrix() -> np.ndarray:
+    freqs = np.fft.rfftfreq(N_FFT, 1 / ANALYSIS_SAMPLE_RATE)
+    mel = lambda f: 2595 * np.log10(1 + f / 700)
+    edges = 700 * (10 ** (np.linspace(mel(30), mel(ANALYSIS_SAMPLE_RATE / 2), N_MELS + 2) / 2595) - 1)
+    lower, center, upper = edges[:-2, None], edges[1:-1, None], edges[2:, None]
+    rising = (freqs - lower) / (center - lower)
+    falling = (upper - freqs) / (upper - center)
+    return np.maximum(0, np.minimum(rising, falling)).T.astype(np.float32)
+
+def _dct_matrix() -> np.ndarray:
+    n = np.arange(N_MELS)
+    return np.cos(np.pi / N_MELS * (n[:, None] + 0.5) * np.arange(N_MFCC)[None, :]).astype(np.float32)
+
+def extract_features(samples: np.ndarray) -> dict:
+    chroma_map, mel_map, dct = _chroma_matrix(), _mel_matrix(), _dct_matrix()
+    chroma, mfcc = [], []
+    for magnitude in stft_blocks(samples):
+        power = magnitude ** 2
+        chroma.append(power @ chroma_map)
+        mfcc.append(np.log(power @ mel_map + 1e-10) @ dct)
+    if not chroma:
+        return {"chroma": np.zeros((0, 12), np.float32), "mfcc": np.zeros((0, N_MFCC - 1), np.float32), "frame_seconds": FEATURE_SECONDS}
+    chroma, mfcc = np.concatenate(chroma), np.concatenate(mfcc)[:, 1:]   # c0 is overall loudness
+
+    # Average STFT frames into coarse feature frames
+    duration = len(chroma) / FRAME_RATE
+    frame_seconds = max(FEATURE_SECONDS, duration / MAX_FEATURE_FRAMES)
+    pool = max(1, int(round(frame_seconds * FRAME_RATE)))
+    usable = len(chroma) // pool * pool or len(chroma)
+    pool = min(pool, usable)
+    pooled = lambda x: x[:usable].reshape(-1, pool, x.shape[1]).mean(axis=1)
+    return {"chroma": pooled(chroma), "mfcc": pooled(mfcc), "frame_seconds": pool / FRAME_RATE}
+
+def features_path(upload_dir: str, recording: Recording) -> str:
+    return os.path.join(upload_dir, "features", os.path.splitext(recording.filename)[0] + ".npz")
+
+def load_features(upload_dir: str, recording: Recording) -> dict | None:
+    path = features_path(upload_dir, recording)
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        return {"chroma": data["chroma"], "mfcc": data["mfcc"], "frame_seconds": float(data["frame_seconds"])}
+
+def save_features(upload_dir: str, recording: Recording, features: dict):
+    path = features_path(upload_dir, recording)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".part.npz"
+    np.savez(tmp, **features)
+    os.replace(tmp, path)
+
+def delete_features(upload_dir: str, recording: Recording):
+    for path in (features_path(upload_dir, recording), loudness_path(upload_dir, recording)):
+        if os.path.exists(path):
+            os.remove(path)
+
+def _k_weighting_power(n: int) -> np.ndarray:
+    # Power response of the K-weighting filter at each rfft bin of an n-sample step
+    z = np.exp(-2j * np.pi * np.arange(n // 2 + 1) / n)
+    response = np.ones_like(z)
+    for b, a in K_WEIGHTING:
+        response *= (b[0] + b[1] * z + b[2] * z ** 2) / (a[0] + a[1] * z + a[2] * z ** 2)
+    # Parseval weights: bins other than DC and Nyquist stand for a conjugate pair
+    pairs = np.full(len(z), 2.0)
+    pairs[0] = 1.0
+    if n % 2 == 0:
+        pairs[-1] = 1.0
+    return (np.abs(response) ** 2 * pairs / n ** 2).astype(np.float32)
+
+def loudness_steps(frames: np.ndarray) -> dict:
+    # K-weighted mean square (summed over channels) and sample peak per 100 ms step.
+    # Filtering in the frequency domain per step keeps it vectorized, at the cost of edge
+    # effects that are negligible over 400 ms blocks. Mono files count as dual mono.
+    step = int(LOUDNESS_SAMPLE_RATE * LOUDNESS_STEP_SECONDS)
+    weighting = _k_weighting_power(step)
+    power, peak = [], []
+    for offset in range(0, len(frames), step * 600):
+        chunk = frames[offset:offset + step * 600]
+        n = len(chunk) // step
+        if not n:
+            continue   # a trailing partial step
+        steps = chunk[:n * step].reshape(n, step, 2)
+        spectrum = np.abs(np.fft.rfft(steps, axis=1)) ** 2
+        power.append(np.einsum("nfc,f->n", spectrum, weighting))
+        peak.append(np.abs(steps).max(axis=(1, 2)))
+    if not power:
+        return {"power": np.zeros(0, np.float32), "peak": np.zeros(0, np.float32)}
+    return {"power": np.concatenate(power).astype(np.float32), "peak": np.concatenate(peak)}
+
+def integrated_loudness(power: np.ndarray) -> float | None:
+    if len(power) < 4:
+        return None
+    blocks = sliding_window_view(power, 4).mean(axis=1)
+    loudness = -0.691 + 10 * np.log10(np.maximum(blocks, 1e-20))
+    gated = loudness > ABSOLUTE_GATE_LUFS
+    if not gated.any():
+        return None
+    relative_gate = -0.691 + 10 * np.log10(blocks[gated].mean()) + RELATIVE_GATE_LU
+    gated &= loudness > relative_gate
+    return round(float(-0.691 + 10 * np.log10(blocks[gated].mean())), 2)
+
+def measure_loudness(target, steps: dict, start: float | None = None, end: float | None = None):
+    # Sets loudness_lufs, peak_db and gain_db on a Recording or Segment from cached steps
+    first = int(start / LOUDNESS_STEP_SECONDS) if start else 0
+    last = int(np.ceil(end / LOUDNESS_STEP_SECONDS)) if end else len(steps["power"])
+    power, peak = steps["power"][first:last], steps["peak"][first:last]
+    loudness = integrated_loudness(power)
+    peak = float(peak.max()) if len(peak) else 0.0
+    target.loudness_lufs = loudness
+    target.peak_db = round(float(20 * np.log10(peak)), 2) if peak > 0 else None
+    if loudness is None:
+        target.gain_db = None
+        return
+    gain = LOUDNESS_TARGET_LUFS - loudness
+    if target.peak_db is not None:
+        gain = min(gain, PEAK_CEILING_DB - target.peak_db)
+    target.gain_db = round(gain, 2)
+
+def loudness_path(upload_dir: str, recording: Recording) -> str:
+    return os.path.join(upload_dir, "features", os.path.splitext(recording.filename)[0] + ".loudness.npz")
+
+def load_loudness(upload_dir: str, recording: Recording) -> dict | None:
+    path = loudness_path(upload_dir, recording)
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        return {"power": data["power"], "peak": data["peak"]}
+
+def measure_segment_loudness(segment: Segment, upload_dir: str):
+    # Cheap enough to run inline, but only once the recording's loudness has been analyzed
+    steps = load_loudness(upload_dir, segment.recording)
+    if steps is None:
+        segment.loudness_lufs = segment.peak_db = segment.gain_db = None
+        return
+    measure_loudness(segment, steps, segment.start_time, segment.end_time)
+
+def _unit_rows(x: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    return x / np.where(norms > 0, norms, 1)
+
+def self_similarity(features: dict) -> np.ndarray:
+    # Cosine similarity, averaging harmony (chroma) and timbre (standardized MFCC)
+    chroma = _unit_rows(features["chroma"])
+    mfcc = features["mfcc"]
+    mfcc = _unit_rows((mfcc - mfcc.mean(axis=0)) / (mfcc.std(axis=0) + 1e-6))
+    return 0.5 * (chroma @ chroma.T + mfcc @ mfcc.T)
+
+def novelty_curve(similarity: np.ndarray, kernel_frames: int) -> np.ndarray:
+    # Foote novelty: correlate a Gaussian-tapered checkerboard kernel along the diagonal
+    half = max(1, kernel_frames // 2)
+    axis = np.arange(-half, half) + 0.5
+    taper = np.exp(-0.5 * (axis[:, None] ** 2 + axis[None, :] ** 2) / (half / 2) ** 2)
+    kernel = np.sign(axis[:, None]) * np.sign(axis[None, :]) * taper
+    n = len(similarity)
+    padded = np.pad(similarity, half, mode="edge")
+    windows = sliding_window_view(padded, (2 * half, 2 * half))
+    diagonal = windows[np.arange(n), np.arange(n)]
+    return np.einsum("ijk,jk->i", diagonal, kernel)
+
+def suggest_segments(features: dict, sensitivity: float = 0.5, min_length: float = 8.0) -> list[dict]:
+    frame_seconds = features["frame_seconds"]
+    n = len(features["chroma"])
+    if n < 4:
+        return []
+    similarity = self_similarity(features)
+    novelty = novelty_curve(similarity, int(round(NOVELTY_KERNEL_SECONDS / frame_seconds)))
+    novelty = np.maximum(novelty, 0)
+    if novelty.max() > 0:
+        novelty /= novelty.max()
+
+    # Local maxima above a threshold that drops as sensitivity rises
+    peaks = np.flatnonzero((novelty[1:-1] > novelty[:-2]) & (novelty[1:-1] >= novelty[2:])) + 1
+    peaks = peaks[novelty[peaks] >= 1 - sensitivity]
+    min_gap = max(1, int(round(min_length / frame_seconds)))
+    boundaries = [0]
+    for peak in peaks[np.argsort(-novelty[peaks])]:   # strongest first
+        if all(abs(peak - b) >= min_gap for b in boundaries) and n - peak >= min_gap:
+            boundaries.append(int(peak))
+    boundaries = sorted(boundaries) + [n]
+
+    # Letter sections by similarity to earlier sections, so a returning head gets the same letter
+    chroma = features["chroma"]
+    centroids, suggestions = [], []
+    for start, end in zip(boundaries[:-1], boundaries[1:]):
+        centroid = _unit_rows(chroma[start:end].mean(axis=0, keepdims=True))[0]
+        scores = [float(centroid @ c) for c in centroids]
+        if scores and max(scores) >= 0.95:
+            letter = int(np.argmax(scores))
+        else:
+            letter = len(centroids)
+            centroids.append(centroid)
+        suggestions.append({
+            "label": chr(ord("A") + letter % 26),
+            "start_time": round(start * frame_seconds, 2),
+            "end_time": round(end * frame_seconds, 2),
+            "confidence": round(float(novelty[start]) if start else 1.0, 3),
+        })
+    return suggestions
+
+def spectral_peaks(samples: np.ndarray) -> np.ndarray:
+    # (frame, bin) of the strongest local maxima, oldest first. Maxima are found with a separable
+    # max filter per STFT block; peaks at block edges see a truncated neighbourhood, which is harmless.
+    t, f = PEAK_NEIGHBORHOOD
+    peaks, offset = [], 0
+    for magnitude in stft_blocks(samples):
+        magnitude = magnitude[:, :-1]   # drop the Nyquist bin so bins fit in 9 bits
+        padded = np.pad(magnitude, ((t // 2, t // 2), (f // 2, f // 2)), constant_values=-1)
+        neighbourhood = sliding_window_view(padded, t, axis=0).max(axis=-1)
+        neighbourhood = sliding_window_view(neighbourhood, f, axis=1).max(axis=-1)
+        frames, bins = np.nonzero((magnitude == neighbourhood) & (magnitude > magnitude.mean()))
+        keep = int(PEAKS_PER_SECOND * len(magnitude) / FRAME_RATE) + 1
+        if len(frames) > keep:
+            strongest = np.argpartition(-magnitude[frames, bins], keep)[:keep]
+            frames, bins = frames[strongest], bins[strongest]
+        peaks.append(np.stack([frames + offset, bins], axis=1))
+        offset += len(magnitude)
+    if not peaks:
+        return np.zeros((0, 2), dtype=np.int64)
+    peaks = np.concatenate(peaks)
+    return peaks[np.lexsort((peaks[:, 1], peaks[:, 0]))]
+
+def landmark_hashes(peaks: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # Pairs each peak with the next FAN_OUT peaks within MAX_PAIR_FRAMES.
+    # Returns 24-bit hashes and their anchor frames.
+    frames, bins = peaks[:, 0], peaks[:, 1]
+    hashes, anchors = [], []
+    for k in range(1, FAN_OUT + 1):
+        gap = frames[k:] - frames[:-k]
+        pair = (gap > 0) & (gap <= MAX_PAIR_FRAMES)
+        hashes.append((bins[:-k][pair] << 15) | (bins[k:][pair] << 6) | gap[pair])
+        anchors.append(frames[:-k][pair])
+    if not hashes:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(hashes), np.concatenate(anchors)
+
+def find_matches(db: Session, recording: Recording, limit: int = 20) -> list[dict]:
+    # Votes per (other recording, frame difference) for equal hashes. Each hash is an index
+    # lookup, so the cost grows with this recording's length rather than the library's size.
+    mine, theirs = aliased(Fingerprint), aliased(Fingerprint)
+    delta = theirs.frame - mine.frame
+    votes = db.execute(
+        select(theirs.recording_id, delta, func.count())
+        .select_from(mine)
+        .join(theirs, and_(
+            theirs.user_id == mine.user_id, theirs.hash == mine.hash, theirs.recording_id != mine.recording_id,
+        ))
+        .where(mine.recording_id == recording.id)
+        .group_by(theirs.recording_id, delta)
+        .having(func.count() >= MIN_MATCHING_HASHES // 4)
+    ).all()
+
+    # Peaks can land a frame apart between encodings, so neighbouring differences add up
+    by_delta = defaultdict(dict)
+    for recording_id, frames, hits in votes:
+        by_delta[recording_id][frames] = hits
+    best = {}
+    for recording_id, deltas in by_delta.items():
+        hits, frames = max((sum(deltas.get(d + i, 0) for i in (-1, 0, 1)), d) for d in deltas)
+        if hits >= MIN_MATCHING_HASHES:
+            best[recording_id] = (hits, frames)
+    if not best:
+        return []
+
+    counts = dict(db.execute(
+        select(Fingerprint.recording_id, func.count())
+        .where(Fingerprint.recording_id.in_([recording.id, *best]))
+        .group_by(Fingerprint.recording_id)
+    ).all())
+    others = db.execute(
+        select(Recording, Tune.title)
+        .join(Tune, Recording.tune_id == Tune.id)
+        .where(Recording.id.in_(best), Recording.user_id == recording.user_id)
+    ).all()
+    matches = []
+    for other, title in others:
+        hits, frames = best[other.id]
+        coverage = min(hits / max(counts.get(recording.id, 1), 1), 1.0)
+        their_coverage = min(hits / max(counts.get(other.id, 1), 1), 1.0)
+        same_file = recording.content_hash is not None and other.content_hash == recording.content_hash
+        matches.append({
+            "recording_id": other.id,
+            "tune_id": other.tune_id,
+            "tune_title": title,
+            "original_name": other.original_name,
+            "offset_seconds": round(frames / FRAME_RATE, 2),
+            "matching_hashes": hits,
+            "coverage": round(coverage, 3),
+            "duplicate": same_file or min(coverage, their_coverage) >= DUPLICATE_COVERAGE,
+        })
+    matches.sort(key=lambda m: (-m["duplicate"], -m["matching_hashes"]))
+    return matches[:limit]
+
+def content_hash(filepath: str) -> str:
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def analysis_samples(upload_dir: str, recording: Recording) -> np.ndarray:
+    # Mono samples at the analysis rate, shared with other jobs through the PCM cache
+    return pcm.open_pcm(upload_dir, recording, ANALYSIS_SAMPLE_RATE)[:, 0]
+
+def analyze_recording(recording_id: int, upload_dir: str):
+    # Job handler. Decodes once for tempo and the cached structure features.
+    db = SessionLocal()
+    try:
+        recording = db.query(Recording).filter(Recording.id == recording_id).first()
+        if not recording:
+            return
+        samples = analysis_samples(upload_dir, recording)
+        save_features(upload_dir, recording, extract_features(samples))
+        recording.tempo_bpm = estimate_tempo(onset_envelope(samples))
+        db.commit()
+    finally:
+        db.close()
+
+def analyze_segment_tempo(segment_id: int, upload_dir: str):
+    # Job handler
+    db = SessionLocal()
+    try:
+        segment = db.query(Segment).filter(Segment.id == segment_id).first()
+        if not segment:
+            return
+        samples = pcm.window(
+            analysis_samples(upload_dir, segment.recording), ANALYSIS_SAMPLE_RATE,
+            segment.start_time, segment.end_time - segment.start_time,
+        )
+        segment.tempo_bpm = estimate_tempo(onset_envelope(samples))
+        db.commit()
+    finally:
+        db.close()
+
+def analyze_loudness(recording_id: int, upload_dir: str):
+    # Job handler. Measures the full-rate decode once; segments are measured from the cached steps.
+    db = SessionLocal()
+    try:
+        recording = db.query(Recording).filter(Recording.id == recording_id).first()
+        if not recording:
+            return
+        steps = load_loudness(upload_dir, recording)
+        if steps is None:
+            steps = loudness_steps(pcm.open_pcm(upload_dir, recording, LOUDNESS_SAMPLE_RATE, 2))
+            path = loudness_path(upload_dir, recording)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = path + ".part.npz"
+            np.savez(tmp, **steps)
+            os.replace(tmp, path)
+        measure_loudness(recording, steps)
+        for segment in recording.segments:
+            measure_loudness(segment, steps, segment.start_time, segment.end_time)
+        db.commit()
+    finally:
+        db.close()
+
+def fingerprint_recording(recording_id: int, upload_dir: str):
+    # Job handler
+    db = SessionLocal()
+    try:
+        recording = db.query(Recording).filter(Recording.id == recording_id).first()
+        if not recording or recording.fingerprinted:
+            return
+        if recording.content_hash is None:
+            recording.content_hash = content_hash(os.path.join(upload_dir, recording.filename))   # uploaded before hashing
+        hashes, anchors = landmark_hashes(spectral_peaks(analysis_samples(upload_dir, recording)))
+        # Each landmark once per position, repeats within a frame add nothing
+        rows = np.unique(np.stack([hashes, anchors], axis=1), axis=0)
+        db.execute(delete(Fingerprint).where(Fingerprint.recording_id == recording.id))
+        if len(rows):
+            db.execute(insert(Fingerprint), [
+                {"user_id": recording.user_id, "recording_id": recording.id, "hash": int(h), "frame": int(f)}
+                for h, f in rows
+            ])
+        recording.fingerprinted = True
+        db.commit()
+    finally:
+        db.close()
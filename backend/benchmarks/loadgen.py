@@ -0,0 +1,97 @@
+import asyncio
+import os
+import random
+import signal
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+import httpx
+
+# Shared by the HTTP benchmarks: a serve.py to measure, accounts with a practice library, and a
+# closed-loop load generator (each client sends its next request when the last one returns).
+PORT = 8731
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def start_server(env: dict) -> subprocess.Popen:
+    # serve.py as in production, jobs left queued so they don't compete with the measured requests
+    env = {**os.environ, "PORT": str(PORT), "JOB_WORKER": "external", "MAX_REQUESTS": "0", **env}
+    process = subprocess.Popen(
+        [sys.executable, "serve.py"], env=env, cwd=BACKEND, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{PORT}/api/health/admission", timeout=1).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("serve.py did not start")
+
+def stop_server(process: subprocess.Popen):
+    process.send_signal(signal.SIGINT)
+    process.wait(timeout=60)
+
+
+def seed_account(client: httpx.Client, tunes: int = 200, sessions: int = 100) -> dict:
+    username = f"bench-{uuid.uuid4().hex[:12]}"
+    client.post("/api/register", json={"username": username, "password": "benchmark"}).raise_for_status()
+    token = client.post("/api/login", json={"username": username, "password": "benchmark"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    tune_ids = []
+    for n in range(tunes):
+        response = client.post("/api/tunes", headers=headers, json={"title": f"Tune {n:04d}", "tempo": 90 + n % 60})
+        tune_ids.append(response.raise_for_status().json()["id"])
+    for n in range(sessions):
+        entries = [{"tune_id": random.choice(tune_ids), "rating": 1 + n % 5, "duration_minutes": 10} for _ in range(3)]
+        client.post(
+            "/api/sessions", headers=headers,
+            json={"date": f"2026-{1 + n % 12:02d}-{1 + n % 28:02d}", "duration_minutes": 30, "entries": entries},
+        ).raise_for_status()
+    return {"token": token, "headers": headers, "tune_ids": tune_ids}
+
+async def run_load(base_url: str, headers: dict, paths: list[str], concurrency: int, seconds: float) -> dict:
+    latencies, errors = [], 0
+    deadline = time.monotonic() + seconds
+
+    async def client_loop(client: httpx.AsyncClient):
+        nonlocal errors
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                response = await client.get(random.choice(paths), headers=headers)
+                ok = response.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        started = time.monotonic()
+        await asyncio.gather(*(client_loop(client) for _ in range(concurrency)))
+        elapsed = time.monotonic() - started
+    return summarize(latencies, errors, elapsed)
+
+def summarize(latencies: list[float], errors: int, elapsed: float) -> dict:
+    latencies = sorted(latencies)
+    quantile = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000 if latencies else float("nan")
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed,
+        "mean_ms": statistics.fmean(latencies) * 1000 if latencies else float("nan"),
+        "p50_ms": quantile(0.5),
+        "p99_ms": quantile(0.99),
+    }
+
+def print_table(rows: list[dict], columns: list[str]):
+    cells = [[f"{row[c]:.1f}" if isinstance(row[c], float) else str(row[c]) for c in columns] for row in rows]
+    widths = [max(len(c), *(len(line[n]) for line in cells)) for n, c in enumerate(columns)]
+    for line in [columns, *cells]:
+        print("  ".join(cell.rjust(width) for cell, width in zip(line, widths)))
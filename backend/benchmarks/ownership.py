@@ -0,0 +1,73 @@
+import argparse
+import random
+import statistics
+import time
+import seed
+from database import SessionLocal
+from models import Tune, Recording, Segment
+
+# Segment editing with the ownership check it used to have (segment -> recording -> tune join)
+# against the one it has now (segments.user_id). Each edit looks the segment up, changes it and
+# commits, like PATCH /api/segments/{id}; "lookup" times the ownership query alone.
+#
+#   python benchmarks/ownership.py [--users 50] [--edits 2000]     (DATABASE_URL for Postgres)
+
+
+def joined(db, segment_id: int, user_id: int):
+    return (
+        db.query(Segment).join(Recording).join(Tune)
+        .filter(Segment.id == segment_id, Tune.user_id == user_id)
+        .first()
+    )
+
+def direct(db, segment_id: int, user_id: int):
+    return db.query(Segment).filter(Segment.id == segment_id, Segment.user_id == user_id).first()
+
+def edit(lookup, user_id: int, segment_ids: list[int], edits: int) -> tuple[list[float], list[float]]:
+    lookups, totals = [], []
+    db = SessionLocal()
+    try:
+        for n in range(edits):
+            start = time.perf_counter()
+            segment = lookup(db, random.choice(segment_ids), user_id)
+            looked_up = time.perf_counter()
+            segment.notes = f"edit {n}"
+            db.commit()
+            db.expunge_all()
+            lookups.append(looked_up - start)
+            totals.append(time.perf_counter() - start)
+    finally:
+        db.close()
+    return lookups, totals
+
+def _stats(samples: list[float]) -> str:
+    samples = sorted(samples)
+    us = lambda s: s * 1e6
+    return (
+        f"mean {us(statistics.fmean(samples)):8.1f}us  p50 {us(samples[len(samples) // 2]):8.1f}us  "
+        f"p99 {us(samples[int(len(samples) * 0.99)]):8.1f}us"
+    )
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--tunes", type=int, default=200)
+    parser.add_argument("--edits", type=int, default=2000)
+    args = parser.parse_args()
+
+    with SessionLocal() as db:
+        user_ids = seed.users(db, args.users)
+        libraries = [seed.library(db, u, tunes=args.tunes, sessions=0, setlists=0) for u in user_ids]
+    seed.analyze()
+    user_id, segment_ids = user_ids[0], libraries[0]["segments"]
+    print(f"{seed.database.engine.dialect.name}: {args.users * len(segment_ids)} segments over {args.users} users, {args.edits} edits")
+
+    for name, lookup in (("joined", joined), ("direct", direct)):
+        edit(lookup, user_id, segment_ids, args.edits // 10)   # warm up
+        lookups, totals = edit(lookup, user_id, segment_ids, args.edits)
+        print(f"{name:>7} lookup  {_stats(lookups)}")
+        print(f"{name:>7} edit    {_stats(totals)}")
+
+
+if __name__ == "__main__":
+    main()
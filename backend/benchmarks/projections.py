@@ -0,0 +1,101 @@
+import argparse
+import statistics
+import time
+import tracemalloc
+from pydantic import TypeAdapter
+import seed
+from database import SessionLocal
+from models import Tune, PracticeSession, Setlist
+from schemas import TuneResponse, PracticeSessionResponse, SetlistResponse
+import projections
+
+# The list endpoints as they were (ORM instances and lazy loads) against the Core projections
+# they use now, each including the response validation and JSON encoding FastAPI does. CPU time
+# is measured with tracemalloc off, then one more run per path records peak traced memory.
+#
+#   python benchmarks/projections.py [--tunes 10000] [--sessions 2000]     (DATABASE_URL for Postgres)
+
+
+def orm_tunes(db, user_id: int) -> list:
+    return [
+        {
+            "id": tune.id, "title": tune.title, "composer": tune.composer, "key": tune.key, "tempo": tune.tempo,
+            "form": tune.form, "status": tune.status, "notes": tune.notes, "created_at": tune.created_at,
+            "updated_at": tune.updated_at, "recording_count": len(tune.recordings),
+        }
+        for tune in db.query(Tune).filter(Tune.user_id == user_id).order_by(Tune.title).all()
+    ]
+
+def orm_sessions(db, user_id: int) -> list:
+    sessions = db.query(PracticeSession).filter(PracticeSession.user_id == user_id).order_by(PracticeSession.date.desc()).all()
+    return [
+        {**session.__dict__, "entries": [{**e.__dict__, "tune_title": e.tune.title if e.tune else ""} for e in session.entries]}
+        for session in sessions
+    ]
+
+def orm_setlists(db, user_id: int) -> list:
+    setlists = db.query(Setlist).filter(Setlist.user_id == user_id).order_by(Setlist.id).all()
+    return [
+        {**setlist.__dict__, "entries": [{**e.__dict__, "tune_title": e.tune.title if e.tune else ""} for e in setlist.entries]}
+        for setlist in setlists
+    ]
+
+ENDPOINTS = {
+    "/api/tunes": (TypeAdapter(list[TuneResponse]), orm_tunes, lambda db, user_id: projections.tunes(db, user_id)),
+    "/api/sessions": (TypeAdapter(list[PracticeSessionResponse]), orm_sessions, projections.sessions),
+    "/api/setlists": (TypeAdapter(list[SetlistResponse]), orm_setlists, projections.setlists),
+}
+
+
+def respond(adapter: TypeAdapter, read, user_id: int) -> bytes:
+    # A fresh session per call, like a request
+    with SessionLocal() as db:
+        return adapter.dump_json(adapter.validate_python(read(db, user_id), from_attributes=True))
+
+def measure(adapter: TypeAdapter, read, user_id: int, repeat: int) -> dict:
+    respond(adapter, read, user_id)   # warm up
+    cpu = []
+    for _ in range(repeat):
+        start = time.process_time()
+        body = respond(adapter, read, user_id)
+        cpu.append(time.process_time() - start)
+    tracemalloc.start()
+    respond(adapter, read, user_id)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"cpu_ms": statistics.median(cpu) * 1000, "peak_mb": peak / 2**20, "body": body}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tunes", type=int, default=10000)
+    parser.add_argument("--sessions", type=int, default=2000)
+    parser.add_argument("--entries", type=int, default=5, help="entries per session")
+    parser.add_argument("--setlists", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with SessionLocal() as db:
+        user_id = seed.users(db, 1)[0]
+        seed.library(
+            db, user_id, tunes=args.tunes, segments_per_recording=0, sessions=args.sessions,
+            entries_per_session=args.entries, setlists=args.setlists, entries_per_setlist=20,
+        )
+    seed.analyze()
+    print(
+        f"{seed.database.engine.dialect.name}: {args.tunes} tunes, {args.sessions} sessions of {args.entries} entries, "
+        f"{args.setlists} setlists, median CPU of {args.repeat} runs"
+    )
+
+    print(f"{'endpoint':<14} {'path':<11} {'cpu_ms':>9} {'peak_mb':>8} {'bytes':>10}")
+    for path, (adapter, orm, projected) in ENDPOINTS.items():
+        bodies = set()
+        for name, read in (("orm", orm), ("projection", projected)):
+            result = measure(adapter, read, user_id, args.repeat)
+            bodies.add(result["body"])
+            print(f"{path:<14} {name:<11} {result['cpu_ms']:9.1f} {result['peak_mb']:8.1f} {len(result['body']):10d}")
+        if len(bodies) > 1:
+            raise SystemExit(f"{path}: the projection's response differs from the ORM's")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import argparse
+import asyncio
+import os
+import sys
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from loadgen import PORT, seed_account, run_load, print_table, start_server, stop_server
+import serve
+
+# Throughput against the number of API workers: starts `serve.py` with each WEB_CONCURRENCY in
+# turn and drives the read routes with a fixed number of concurrent clients. Run from backend/
+# against a scratch database, ideally Postgres on another machine so the server gets the cores:
+#
+#   DATABASE_URL=postgresql://... python benchmarks/scaling.py --workers 1,2,4,8
+#
+# Throughput should rise close to linearly until the workers outnumber the cores (or the
+# database saturates); flat throughput from 1 worker up means something is still serialized.
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", default=",".join(str(n) for n in sorted({1, 2, serve.available_cpus()})))
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--seconds", type=float, default=20)
+    args = parser.parse_args()
+    base_url = f"http://127.0.0.1:{PORT}"
+
+    server = start_server({"WEB_CONCURRENCY": "1"})
+    try:
+        with httpx.Client(base_url=base_url, timeout=60) as client:
+            account = seed_account(client)
+    finally:
+        stop_server(server)
+    paths = ["/api/tunes", "/api/sessions", "/api/setlists", *(f"/api/tunes/{t}" for t in account["tune_ids"][:20])]
+
+    rows = []
+    for workers in [int(n) for n in args.workers.split(",")]:
+        server = start_server({"WEB_CONCURRENCY": str(workers)})
+        try:
+            asyncio.run(run_load(base_url, account["headers"], paths, args.concurrency, 2))   # warm up
+            result = asyncio.run(run_load(base_url, account["headers"], paths, args.concurrency, args.seconds))
+        finally:
+            stop_server(server)
+        result["workers"] = workers
+        result["speedup"] = result["rps"] / rows[0]["rps"] if rows else 1.0
+        rows.append(result)
+    print(f"{serve.available_cpus()} CPUs available, {args.concurrency} clients")
+    print_table(rows, ["workers", "rps", "speedup", "p50_ms", "p99_ms", "errors"])
+
+
+if __name__ == "__main__":
+    main()
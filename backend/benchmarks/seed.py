@@ -0,0 +1,66 @@
+import os
+import sys
+import tempfile
+import uuid
+from datetime import date, timedelta
+
+# Database setup for the in-process benchmarks. Import this before any backend module: without
+# DATABASE_URL it points the app at a fresh SQLite file, then migrates whichever database it got.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if not os.getenv("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp(prefix='woodshed-bench-')}/benchmark.db"
+os.environ.setdefault("SECRET_KEY", "woodshed-benchmark-secret-key-32b")
+os.environ.setdefault("JOB_WORKER", "external")
+os.environ.setdefault("SCHEMA_MIGRATION", "external")
+
+from sqlalchemy import insert, text
+import database
+from models import User, Tune, Recording, Segment, PracticeSession, PracticeEntry, Setlist, SetlistEntry
+
+database.migrate()
+
+
+def users(db, count: int) -> list[int]:
+    return db.scalars(insert(User).returning(User.id), [
+        {"username": f"bench-{uuid.uuid4().hex[:12]}", "password_hash": "x"} for _ in range(count)
+    ]).all()
+
+def library(
+    db, user_id: int, tunes: int = 100, recordings_per_tune: int = 1, segments_per_recording: int = 4,
+    sessions: int = 50, entries_per_session: int = 3, setlists: int = 5, entries_per_setlist: int = 10,
+) -> dict:
+    # Core inserts, a library of tens of thousands of rows takes seconds rather than minutes
+    tune_ids = db.scalars(insert(Tune).returning(Tune.id), [
+        {"user_id": user_id, "title": f"Tune {n:05d}", "composer": "Trad.", "status": "learning", "tempo": 90 + n % 60}
+        for n in range(tunes)
+    ]).all()
+    recording_ids = db.scalars(insert(Recording).returning(Recording.id), [
+        {"user_id": user_id, "tune_id": t, "filename": f"{uuid.uuid4().hex}.mp3", "original_name": "take.mp3", "file_size": 1}
+        for t in tune_ids for _ in range(recordings_per_tune)
+    ]).all() if tune_ids and recordings_per_tune else []
+    segment_ids = db.scalars(insert(Segment).returning(Segment.id), [
+        {"user_id": user_id, "recording_id": r, "label": f"Part {n}", "start_time": n * 10.0, "end_time": n * 10.0 + 10}
+        for r in recording_ids for n in range(segments_per_recording)
+    ]).all() if recording_ids and segments_per_recording else []
+    session_ids = db.scalars(insert(PracticeSession).returning(PracticeSession.id), [
+        {"user_id": user_id, "date": date(2020, 1, 1) + timedelta(days=n), "duration_minutes": 30} for n in range(sessions)
+    ]).all() if sessions else []
+    if session_ids and tune_ids:
+        db.execute(insert(PracticeEntry), [
+            {"session_id": s, "tune_id": tune_ids[(n * entries_per_session + k) % len(tune_ids)], "rating": 1 + k % 5, "duration_minutes": 10}
+            for n, s in enumerate(session_ids) for k in range(entries_per_session)
+        ])
+    setlist_ids = db.scalars(insert(Setlist).returning(Setlist.id), [
+        {"user_id": user_id, "title": f"Set {n}"} for n in range(setlists)
+    ]).all() if setlists else []
+    if setlist_ids and tune_ids:
+        db.execute(insert(SetlistEntry), [
+            {"setlist_id": s, "tune_id": tune_ids[(n * entries_per_setlist + k) % len(tune_ids)], "position": k}
+            for n, s in enumerate(setlist_ids) for k in range(entries_per_setlist)
+        ])
+    db.commit()
+    return {"tunes": tune_ids, "recordings": recording_ids, "segments": segment_ids, "sessions": session_ids, "setlists": setlist_ids}
+
+def analyze():
+    with database.engine.begin() as conn:
+        conn.execute(text("ANALYZE"))
@@ -0,0 +1,250 @@
+import asyncio
+import json
+import os
+import select as selectors
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from sqlalchemy import event, select, func
+from sqlalchemy.orm import Session
+import anyio
+from database import engine, SessionLocal
+from schemas import ChangeBatch
+import sync
+
+# "local" fans out to subscribers in this process, "postgres" uses LISTEN/NOTIFY so
+# changes made in one API worker (or a job process) reach devices connected to another
+CHANGEFEED_BROKER = os.getenv("CHANGEFEED_BROKER", "local")
+CHANGEFEED_CHANNEL = "woodshed_changes"
+HEARTBEAT_SECONDS = 15              # keeps proxies from closing an idle stream
+SUBSCRIBER_QUEUE_SIZE = 256
+NOTIFY_PAYLOAD_LIMIT = 7000         # Postgres rejects NOTIFY payloads of 8000 bytes or more
+
+RESYNC = None   # queued when a subscriber fell behind and changes were dropped
+
+
+class LocalBroker:
+    transactional = False   # publishes after the commit, see publish_changes
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)   # user id -> {(event loop, queue)}
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def subscribe(self, user_id: int) -> asyncio.Queue:
+        # Called on the event loop serving the stream
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers[user_id].add((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, user_id: int, queue: asyncio.Queue):
+        with self._lock:
+            subscribers = self._subscribers.get(user_id, set())
+            subscribers.difference_update({s for s in subscribers if s[1] is queue})
+            if not subscribers:
+                self._subscribers.pop(user_id, None)
+
+    def publish(self, user_id: int, changes: list[dict]):
+        self.dispatch(user_id, changes)
+
+    def dispatch(self, user_id: int, changes: list[dict]):
+        # Publishers run in request threads and job processes, so queues are fed through their own loop
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(_offer, queue, changes)
+            except RuntimeError:
+                pass   # loop already closed, the subscriber is going away
+
+class PostgresBroker(LocalBroker):
+    transactional = True    # notifies inside the commit, see notify_changes
+
+    def __init__(self):
+        super().__init__()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._listen, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def notify(self, conn, user_id: int, changes: list[dict]):
+        # On the connection of the transaction that made the changes: Postgres delivers the NOTIFY
+        # when (and only if) it commits, to every process with subscribers, including this one
+        for chunk in _chunks(changes):
+            payload = json.dumps({"user_id": user_id, "changes": chunk}, separators=(",", ":"))
+            conn.execute(select(func.pg_notify(CHANGEFEED_CHANNEL, payload)))
+
+    def _listen(self):
+        while not self._stop.is_set():
+            raw = None
+            try:
+                raw = engine.raw_connection()
+                conn = raw.driver_connection
+                conn.autocommit = True
+                conn.cursor().execute(f"LISTEN {CHANGEFEED_CHANNEL}")
+                while not self._stop.is_set():
+                    if selectors.select([conn], [], [], 1)[0]:
+                        conn.poll()
+                        while conn.notifies:
+                            message = json.loads(conn.notifies.pop(0).payload)
+                            self.dispatch(message["user_id"], message["changes"])
+            except Exception:
+                # Notifications sent while reconnecting are lost, tell everyone to catch up with /api/sync
+                with self._lock:
+                    user_ids = list(self._subscribers)
+                for user_id in user_ids:
+                    self.dispatch(user_id, RESYNC)
+                time.sleep(1)
+            finally:
+                if raw is not None:
+                    raw.invalidate()   # LISTEN state shouldn't go back into the pool
+
+class Recorder:
+    # Stands in for the local broker while a job runs in a pool process, which has no subscribers of
+    # its own. The worker that ran the job publishes what was recorded, see recording and publish_recorded.
+    transactional = False
+
+    def __init__(self):
+        self.published = []
+
+    def publish(self, user_id: int, changes: list[dict]):
+        self.published.append((user_id, changes))
+
+broker = PostgresBroker() if CHANGEFEED_BROKER == "postgres" else LocalBroker()
+
+@contextmanager
+def recording():
+    global broker
+    if broker.transactional:
+        yield []   # notifications go out with the job's own commits, whichever process runs it
+        return
+    real, broker = broker, Recorder()
+    try:
+        yield broker.published
+    finally:
+        broker = real
+
+def publish_recorded(published: list[tuple[int, list[dict]]]):
+    for user_id, changes in published:
+        try:
+            broker.publish(user_id, changes)
+        except Exception:
+            pass   # devices pick the change up on their next sync
+
+
+def _offer(queue: asyncio.Queue, changes: list[dict] | None):
+    try:
+        queue.put_nowait(changes)
+    except asyncio.QueueFull:
+        # Slow client: drop its backlog, it has to resync anyway
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(RESYNC)
+
+def _chunks(changes: list[dict]):
+    chunk, size = [], 0
+    for change in changes:
+        length = len(json.dumps(change)) + 1
+        if chunk and size + length > NOTIFY_PAYLOAD_LIMIT:
+            yield chunk
+            chunk, size = [], 0
+        chunk.append(change)
+        size += length
+    if chunk:
+        yield chunk
+
+
+# --- Change tracking ---
+
+@event.listens_for(Session, "after_flush")
+def collect_changes(session, flush_context):
+    # new/dirty/deleted still describe what was just flushed, and new rows have their ids by now.
+    # Parents bumped by sync.track_changes show up as dirty, so entry changes reach their session or setlist.
+    pending = session.info.setdefault("changefeed", {})
+    for objects, op in ((session.new, "upsert"), (session.dirty, "upsert"), (session.deleted, "delete")):
+        for obj in objects:
+            entity = sync.SYNCED_MODELS.get(type(obj))
+            if not entity or (op == "upsert" and obj in session.dirty and not session.is_modified(obj)):
+                continue
+            pending.setdefault(sync.owner_id(obj), {})[(entity, obj.id)] = op
+
+def track_upserts(session, user_id: int, entity: str, ids):
+    # For rows written with Core statements, which the flush hooks don't see. Published on commit.
+    pending = session.info.setdefault("changefeed", {}).setdefault(user_id, {})
+    for entity_id in ids:
+        pending[(entity, entity_id)] = "upsert"
+
+def _payload(changes: dict) -> list[dict]:
+    return [{"entity": e, "id": i, "op": op} for (e, i), op in changes.items()]
+
+@event.listens_for(Session, "before_commit")
+def notify_changes(session):
+    if not broker.transactional:
+        return
+    session.flush()   # the commit's own flush comes after this hook, its changes are needed now
+    pending = session.info.pop("changefeed", None)
+    if not pending:
+        return
+    conn = session.connection()
+    for user_id, changes in pending.items():
+        broker.notify(conn, user_id, _payload(changes))
+
+@event.listens_for(Session, "after_commit")
+def publish_changes(session):
+    for user_id, changes in session.info.pop("changefeed", {}).items():
+        try:
+            broker.publish(user_id, _payload(changes))
+        except Exception:
+            pass   # the commit stands, devices pick the change up on their next sync
+
+@event.listens_for(Session, "after_rollback")
+def discard_changes(session):
+    session.info.pop("changefeed", None)
+
+
+# --- Streaming ---
+
+def _load(user_id: int, changes: list[dict]) -> str:
+    db = SessionLocal()
+    try:
+        return ChangeBatch.model_validate(sync.load_changes(db, user_id, changes)).model_dump_json()
+    finally:
+        db.close()
+
+async def stream(user_id: int):
+    # Server-sent events. A client (re)connecting calls /api/sync with its cursor first,
+    # then applies "changes" events as they arrive and syncs again on "resync".
+    queue = broker.subscribe(user_id)
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            try:
+                batch = [await asyncio.wait_for(queue.get(), HEARTBEAT_SECONDS)]
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+                continue
+            # Coalesce whatever queued up meanwhile into one event, the last op per row wins
+            while not queue.empty():
+                batch.append(queue.get_nowait())
+            if RESYNC in batch:
+                yield "event: resync\ndata: {}\n\n"
+                continue
+            merged = {(c["entity"], c["id"]): c for changes in batch for c in changes}
+            payload = await anyio.to_thread.run_sync(_load, user_id, list(merged.values()))
+            yield f"event: changes\ndata: {payload}\n\n"
+    finally:
+        broker.unsubscribe(user_id, queue)
@@ -1,18 +1,196 @@
+import itertools
 import os
+import re
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
+from fastapi import Request
+from sqlalchemy import Column, DateTime, create_engine, event, inspect, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.schema import CreateColumn, CreateIndex
+from sqlalchemy.sql.functions import FunctionElement
 from sqlalchemy.orm import sessionmaker, declarative_base
 
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Per process. serve.py sizes these so all of its workers together stay under max_connections.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+# Comma separated. Read-only routes are spread over these, see get_read_db.
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+# A client that just wrote reads from the primary for this long, so it sees its own changes despite replication lag
+REPLICA_STICKY_SECONDS = int(os.getenv("REPLICA_STICKY_SECONDS", 10))
+READ_PRIMARY_COOKIE = "woodshed_read_primary"
+# SQLite mode, for single-node installs: DATABASE_URL=sqlite:///path/to/woodshed.db
+SQLITE_BUSY_SECONDS = int(os.getenv("SQLITE_BUSY_SECONDS", 30))   # how long a writer waits for the one before it
+SQLITE_MMAP_MB = int(os.getenv("SQLITE_MMAP_MB", 256))
+SQLITE_CACHE_MB = int(os.getenv("SQLITE_CACHE_MB", 64))   # per connection
+SQLITE_READ_VERBS = {"SELECT", "VALUES", "PRAGMA", "EXPLAIN"}
+SQLITE_DML_VERBS = {"SELECT", "VALUES", "INSERT", "REPLACE", "UPDATE", "DELETE"}
+# Words, brackets, and quoted names, strings and comments (which never start with a word character)
+_SQL_TOKEN = re.compile(r"""'(?:[^']|'')*'|"(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\]|--[^\n]*|/\*.*?(?:\*/|$)|[()]|\w+""", re.S)
 
-engine = create_engine(DATABASE_URL)
+def _create_engine(url: str):
+    sqlite = url.startswith("sqlite")
+    engine = create_engine(
+        url,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=True,   # drops connections the server closed, e.g. after a failover
+        connect_args={"timeout": SQLITE_BUSY_SECONDS} if sqlite else {},
+    )
+    if sqlite:
+        event.listen(engine, "connect", _sqlite_connect)
+        event.listen(engine, "before_cursor_execute", _sqlite_begin_write)
+    return engine
+
+def _sqlite_connect(dbapi_connection, connection_record):
+    # WAL lets readers carry on while one connection writes. NORMAL sync is durable in WAL mode
+    # except for the last commits before a power loss.
+    dbapi_connection.isolation_level = None   # transactions are started by _sqlite_begin_write
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode = WAL")
+    cursor.execute("PRAGMA synchronous = NORMAL")
+    cursor.execute("PRAGMA foreign_keys = ON")   # ON DELETE CASCADE, as on Postgres
+    cursor.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_MB * 1024 * 1024}")
+    cursor.execute(f"PRAGMA cache_size = {-SQLITE_CACHE_MB * 1024}")
+    cursor.execute("PRAGMA temp_store = MEMORY")
+    cursor.close()
+
+def _sqlite_begin_write(conn, cursor, statement, parameters, context, executemany):
+    # Single writer: reads run outside a transaction, each statement on a fresh snapshot like
+    # Postgres READ COMMITTED, and the first write takes the database's write lock with
+    # BEGIN IMMEDIATE, waiting up to SQLITE_BUSY_SECONDS for the current writer to finish.
+    # A deferred transaction would instead fail with "database is locked" when its read
+    # snapshot went stale before it could write.
+    dbapi_connection = conn.connection.driver_connection
+    if dbapi_connection.in_transaction:
+        return
+    verb = _sql_verb(statement)
+    if verb is not None and verb not in SQLITE_READ_VERBS:
+        cursor.execute("BEGIN IMMEDIATE")
+
+def _sql_verb(statement: str) -> str | None:
+    # The statement's leading keyword, or for WITH the one after its CTEs, which can be a
+    # plain SELECT as well as a write. None for an empty statement.
+    depth, cte = 0, False
+    for match in _SQL_TOKEN.finditer(statement):
+        token = match.group()
+        if token in ("(", ")"):
+            depth += 1 if token == "(" else -1
+            continue
+        if not (token[0].isalnum() or token[0] == "_"):
+            continue
+        word = token.upper()
+        if not cte:
+            if word != "WITH":
+                return word   # also inside a leading bracket, as in (SELECT ...) UNION ...
+            cte = True
+        elif depth == 0 and word in SQLITE_DML_VERBS:
+            return word
+    return "WITH" if cte else None   # unparsed, treated as a write
+
+class statement_now(FunctionElement):
+    # When the statement runs. Postgres' now() is when the transaction began, which can be long
+    # before its changes are committed and visible; SQLite's CURRENT_TIMESTAMP is per statement already.
+    type = DateTime(timezone=True)
+    inherit_cache = True
+
+@compiles(statement_now)
+def _statement_now(element, compiler, **kw):
+    return "CURRENT_TIMESTAMP"
+
+@compiles(statement_now, "postgresql")
+def _statement_now_postgresql(element, compiler, **kw):
+    return "statement_timestamp()"
+
+engine = _create_engine(DATABASE_URL)
+replica_engines = [_create_engine(url) for url in DATABASE_REPLICA_URLS]
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReplicaSessionLocal = sessionmaker(autocommit=False, autoflush=False)
 Base = declarative_base()
+_replica_turn = itertools.count()
+
+@event.listens_for(ReplicaSessionLocal, "before_flush")
+def _refuse_replica_writes(session, flush_context, instances):
+    raise RuntimeError("Replica sessions are read-only, use get_db for routes that write")
+
+def sync_schema():
+    Base.metadata.create_all(bind=engine)
+    # create_all skips tables that already exist, so columns and indexes added
+    # to an existing model have to be created on their own. New columns must be
+    # nullable or carry a server_default for this to work on populated tables.
+    # A column can fill itself in from existing data with info={"backfill": <SQL>}. Backfills
+    # run once every new column exists, in table order, so they may read each other's tables.
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        backfills = []
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    backfill, trigger = column.info.get("backfill"), None
+                    if engine.dialect.name == "sqlite" and isinstance(getattr(column.server_default, "arg", None), FunctionElement):
+                        # SQLite only adds columns with constant defaults. Add it without one, fill in
+                        # existing rows and let a trigger supply the default for new rows.
+                        default = column.server_default.arg.compile(dialect=engine.dialect)
+                        backfill = backfill or f"UPDATE {table.name} SET {column.name} = {default}"
+                        trigger = (
+                            f"CREATE TRIGGER IF NOT EXISTS {table.name}_{column.name}_default AFTER INSERT ON {table.name} "
+                            f"WHEN NEW.{column.name} IS NULL BEGIN "
+                            f"UPDATE {table.name} SET {column.name} = {default} WHERE rowid = NEW.rowid; END"
+                        )
+                        column = Column(column.name, column.type)
+                    ddl = CreateColumn(column).compile(dialect=engine.dialect)
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {ddl}"))
+                    if trigger:
+                        conn.execute(text(trigger))
+                    if backfill:
+                        backfills.append(backfill)
+        for backfill in backfills:
+            conn.execute(text(backfill))
+    # IF NOT EXISTS rather than checkfirst, which can't see expression indexes on every database.
+    # info={"prepare": <SQL>} on an index fixes up rows that would stop it being created, e.g. duplicates.
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                if index.info.get("prepare"):
+                    conn.execute(text(index.info["prepare"]))
+                conn.execute(CreateIndex(index, if_not_exists=True))
+
+def migrate():
+    # Schema changes and the event partitions they write into. serve.py runs this once before
+    # starting any workers (SCHEMA_MIGRATION=external tells them it has), so concurrent
+    # processes don't race each other's DDL on a fresh database.
+    import events   # imports this module
+    sync_schema()
+    events.maintain_partitions()
 
 def get_db():
     db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+def replica_session():
+    # Round-robin over the replicas, skipping any that can't be reached. The primary when there are none.
+    for _ in replica_engines:
+        db = ReplicaSessionLocal(bind=replica_engines[next(_replica_turn) % len(replica_engines)])
+        try:
+            db.connection()
+            return db
+        except OperationalError:
+            db.close()
+    return SessionLocal()
+
+def get_read_db(request: Request):
+    # For routes that only read. Clients that wrote in the last REPLICA_STICKY_SECONDS stay on the primary.
+    db = SessionLocal() if request.cookies.get(READ_PRIMARY_COOKIE) else replica_session()
     try:
         yield db
     finally:
@@ -0,0 +1,201 @@
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+from sqlalchemy import insert, update, and_, case, text
+from sqlalchemy.exc import IntegrityError
+from database import engine
+from models import PlaybackEvent, PracticeRollup
+
+EVENT_FLUSH_SECONDS = float(os.getenv("EVENT_FLUSH_SECONDS", 2))
+EVENT_FLUSH_SIZE = 5000              # flush early once this many events are waiting
+EVENT_BUFFER_MAX = 200000            # while the database is unreachable, the oldest events beyond this are dropped
+EVENT_RETENTION_DAYS = int(os.getenv("EVENT_RETENTION_DAYS", 180))
+EVENT_PARTITION_MONTHS_AHEAD = 2
+EVENT_MAX_SKEW_SECONDS = 86400       # how far ahead of the server's clock a player's may be
+
+log = logging.getLogger("woodshed.events")
+
+
+class EventBuffer:
+    # Events are acknowledged once buffered, so a crash loses at most the last flush interval.
+    # Each API worker has its own buffer and flush thread.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._events = []
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add(self, rows: list[dict]):
+        with self._lock:
+            self._events.extend(rows)
+            self._trim()
+            full = len(self._events) >= EVENT_FLUSH_SIZE
+        if full:
+            self._wake.set()
+
+    def _trim(self):
+        if len(self._events) > EVENT_BUFFER_MAX:
+            del self._events[:len(self._events) - EVENT_BUFFER_MAX]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join()
+        self.flush()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(EVENT_FLUSH_SECONDS)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                time.sleep(EVENT_FLUSH_SECONDS)   # events stay buffered until the database is back
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                events, self._events = self._events, []
+            if not events:
+                return
+            try:
+                write_events(events)
+            except Exception:
+                with self._lock:
+                    self._events[:0] = events
+                    self._trim()
+                raise
+
+buffer = EventBuffer()
+
+
+def rollup(events: list[dict]) -> dict:
+    # (user, day, recording, segment) -> totals
+    totals = defaultdict(lambda: {"seconds": 0.0, "loops": 0, "max_speed": 0.0})
+    for event in events:
+        key = (event["user_id"], event["day"], event["recording_id"], event["segment_id"])
+        total = totals[key]
+        total["seconds"] += event["played_seconds"]
+        total["loops"] += event["kind"] == "loop"
+        total["max_speed"] = max(total["max_speed"], event["speed"])
+    return totals
+
+def _add_rollup(conn, key: tuple, total: dict):
+    user_id, day, recording_id, segment_id = key
+    table = PracticeRollup.__table__
+    match = and_(
+        table.c.user_id == user_id,
+        table.c.date == day,
+        table.c.recording_id == recording_id,
+        table.c.segment_id.is_(None) if segment_id is None else table.c.segment_id == segment_id,
+    )
+    values = {
+        "seconds": table.c.seconds + total["seconds"],
+        "loops": table.c.loops + total["loops"],
+        "max_speed": case((table.c.max_speed < total["max_speed"], total["max_speed"]), else_=table.c.max_speed),
+    }
+    # Update first, insert when the row is new. Another worker may insert the same row
+    # concurrently, in which case the unique index rejects ours and the update is retried.
+    for _ in range(2):
+        if conn.execute(update(table).where(match).values(**values)).rowcount:
+            return
+        try:
+            with conn.begin_nested():
+                conn.execute(insert(table).values(
+                    user_id=user_id, date=day, recording_id=recording_id, segment_id=segment_id, **total
+                ))
+            return
+        except IntegrityError:
+            continue
+
+def accepted(occurred_at: datetime) -> bool:
+    # Events from before the retention period would only be dropped, and ones far in the future
+    # would sit in the default partition, in the way of the month they belong to being created
+    if occurred_at.tzinfo is None:
+        occurred_at = occurred_at.replace(tzinfo=timezone.utc)
+    now = datetime.now(timezone.utc)
+    return now - timedelta(days=EVENT_RETENTION_DAYS) <= occurred_at <= now + timedelta(seconds=EVENT_MAX_SKEW_SECONDS)
+
+def write_events(events: list[dict]):
+    with engine.begin() as conn:
+        # executemany, which SQLAlchemy sends as batched multi-row INSERTs
+        conn.execute(insert(PlaybackEvent.__table__), [
+            {key: value for key, value in event.items() if key != "day"} for event in events
+        ])
+        # Same row order in every worker, so concurrent flushes can't deadlock
+        for key, total in sorted(rollup(events).items(), key=lambda item: str(item[0])):
+            _add_rollup(conn, key, total)
+
+
+# --- Partitions (Postgres only) ---
+
+def _month(day: date, offset: int) -> date:
+    month = day.month - 1 + offset
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+def _partitions(table: str) -> set[str]:
+    with engine.connect() as conn:
+        return set(conn.execute(text(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE parent.relname = :table"
+        ), {"table": table}).scalars())
+
+def _create_partition(table: str, name: str, start: date, end: date):
+    # Rows already in the default partition for this month would make ATTACH fail, so the
+    # partition is built on its own, they are moved into it and it is attached in one transaction
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+        conn.execute(text(
+            f"WITH moved AS (DELETE FROM {table}_default WHERE occurred_at >= :start AND occurred_at < :end RETURNING *) "
+            f"INSERT INTO {name} SELECT * FROM moved"
+        ), {"start": start, "end": end})
+        conn.execute(text(f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM ('{start}') TO ('{end}')"))
+
+def maintain_partitions():
+    # Creates the coming months' partitions and drops those past the retention period.
+    # The default partition catches events outside that range. Each step is its own
+    # transaction, so one that fails doesn't hold up the rest.
+    if engine.dialect.name != "postgresql":
+        return
+    table = PlaybackEvent.__tablename__
+    today = datetime.now(timezone.utc).date()
+    cutoff = today - timedelta(days=EVENT_RETENTION_DAYS)
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT"))
+    partitions = _partitions(table)
+    for offset in range(-1, EVENT_PARTITION_MONTHS_AHEAD + 1):
+        start, end = _month(today, offset), _month(today, offset + 1)
+        name = f"{table}_{start:%Y_%m}"
+        if name not in partitions:
+            try:
+                _create_partition(table, name, start, end)
+            except Exception:
+                log.exception("Could not create partition %s", name)
+    for name in partitions:
+        try:
+            year, month = map(int, name.removeprefix(f"{table}_").split("_"))
+        except ValueError:
+            continue   # the default partition
+        if _month(date(year, month, 1), 1) <= cutoff:
+            try:
+                with engine.begin() as conn:
+                    conn.execute(text(f"DROP TABLE {name}"))
+            except Exception:
+                log.exception("Could not drop partition %s", name)
+    try:
+        with engine.begin() as conn:
+            conn.execute(text(f"DELETE FROM {table}_default WHERE occurred_at < :cutoff"), {"cutoff": cutoff})
+    except Exception:
+        log.exception("Could not prune %s_default", table)
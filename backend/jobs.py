@@ -0,0 +1,175 @@
+import json
+import os
+import random
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from database import SessionLocal
+from models import Job, Recording
+import analysis
+import changefeed
+import media
+import rehearsal
+import scheduler
+
+JOB_RETRY_BASE_SECONDS = int(os.getenv("JOB_RETRY_BASE_SECONDS", 30))
+JOB_RETRY_MAX_SECONDS = 3600
+JOB_TIMEOUT_SECONDS = int(os.getenv("JOB_TIMEOUT_SECONDS", 3600))   # running longer than this means the worker died
+
+# Job priorities, higher runs first
+PRIORITY_BACKGROUND = 0
+PRIORITY_ON_DEMAND = 10   # someone is waiting on the result
+
+ACTIVE_STATUSES = ("queued", "running")   # at most one job per dedupe_key in these
+
+
+def process_recording(recording_id: int, upload_dir: str):
+    # Post-upload pipeline. Every stage skips work already done, so a retry resumes where it failed.
+    media.transcode_recording(recording_id, upload_dir)
+    db = SessionLocal()
+    try:
+        duration = db.query(Recording.duration).filter(Recording.id == recording_id).scalar()
+    finally:
+        db.close()
+    if duration and duration >= media.HLS_MIN_DURATION:
+        media.package_hls(recording_id, upload_dir)
+    analysis.analyze_recording(recording_id, upload_dir)
+    analysis.analyze_loudness(recording_id, upload_dir)
+    analysis.fingerprint_recording(recording_id, upload_dir)
+
+# kind -> handler. Handlers get the payload as keyword arguments plus upload_dir,
+# run in a worker process and raise to request a retry.
+HANDLERS = {
+    "process_recording": process_recording,
+    "analyze_recording": analysis.analyze_recording,
+    "analyze_loudness": analysis.analyze_loudness,
+    "analyze_segment_tempo": analysis.analyze_segment_tempo,
+    "fingerprint_recording": analysis.fingerprint_recording,
+    "package_hls": media.package_hls,
+    "build_rehearsal": rehearsal.build_rehearsal,
+    "score_priorities": scheduler.score_priorities,
+}
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+def enqueue(
+    db: Session,
+    kind: str,
+    user_id: int | None = None,
+    priority: int = PRIORITY_BACKGROUND,
+    max_attempts: int = 3,
+    **payload,
+) -> Job:
+    # Joins the caller's transaction, so the job only exists once the caller commits
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    dedupe_key = f"{kind}:{json.dumps(payload, sort_keys=True)}"
+    existing = _active(db, dedupe_key)
+    if existing is None:
+        job = Job(
+            user_id=user_id,
+            kind=kind,
+            payload=payload,
+            dedupe_key=dedupe_key,
+            status="queued",
+            priority=priority,
+            attempts=0,
+            max_attempts=max_attempts,
+            run_at=_now(),
+        )
+        try:
+            # ix_jobs_dedupe_active turns away a second active copy enqueued concurrently,
+            # the savepoint keeps the caller's transaction usable when it does
+            with db.begin_nested():
+                db.add(job)
+            return job
+        except IntegrityError:
+            existing = _active(db, dedupe_key)
+            if existing is None:
+                raise
+    if priority > existing.priority:
+        existing.priority = priority
+    return existing
+
+def _active(db: Session, dedupe_key: str) -> Job | None:
+    return db.query(Job).filter(Job.dedupe_key == dedupe_key, Job.status.in_(ACTIVE_STATUSES)).first()
+
+def claim(worker_id: str) -> tuple[int, str, dict] | None:
+    db = SessionLocal()
+    try:
+        while True:
+            # SKIP LOCKED lets concurrent workers pass over rows another worker is claiming
+            job = db.execute(
+                select(Job.id, Job.kind, Job.payload)
+                .where(Job.status == "queued", Job.run_at <= _now())
+                .order_by(Job.priority.desc(), Job.run_at, Job.id)
+                .limit(1)
+                .with_for_update(skip_locked=True)
+            ).first()
+            if job is None:
+                return None
+            # Conditional update keeps the claim atomic on databases without row locks
+            claimed = db.execute(
+                update(Job)
+                .where(Job.id == job.id, Job.status == "queued")
+                .values(status="running", attempts=Job.attempts + 1, started_at=_now(), locked_by=worker_id)
+            ).rowcount
+            db.commit()
+            if claimed:
+                return job.id, job.kind, job.payload
+    finally:
+        db.close()
+
+def run(kind: str, payload: dict, upload_dir: str) -> list:
+    # Executed in a worker process. The change feed notifications for what the handler commits are
+    # returned for the worker to publish, where the subscribers can be reached.
+    with changefeed.recording() as published:
+        HANDLERS[kind](**payload, upload_dir=upload_dir)
+    return published
+
+def finish(job_id: int, error: BaseException | None = None):
+    db = SessionLocal()
+    try:
+        job = db.query(Job).filter(Job.id == job_id).first()
+        if not job:
+            return
+        job.locked_by = None
+        if error is None:
+            job.status = "succeeded"
+            job.last_error = None
+            job.finished_at = _now()
+        elif job.attempts < job.max_attempts:
+            # Exponential backoff with jitter so a failing batch doesn't retry in lockstep
+            delay = min(JOB_RETRY_BASE_SECONDS * 2 ** (job.attempts - 1), JOB_RETRY_MAX_SECONDS)
+            job.status = "queued"
+            job.run_at = _now() + timedelta(seconds=delay * random.uniform(0.9, 1.1))
+            job.last_error = f"{type(error).__name__}: {error}"
+        else:
+            job.status = "failed"
+            job.last_error = f"{type(error).__name__}: {error}"
+            job.finished_at = _now()
+        db.commit()
+    finally:
+        db.close()
+
+def requeue_stale():
+    # Jobs left running by a worker that was killed go back in the queue, unless that was their last attempt
+    db = SessionLocal()
+    try:
+        stale = (Job.status == "running", Job.started_at < _now() - timedelta(seconds=JOB_TIMEOUT_SECONDS))
+        db.execute(
+            update(Job)
+            .where(*stale, Job.attempts >= Job.max_attempts)
+            .values(status="failed", locked_by=None, finished_at=_now(), last_error="Worker timed out")
+        )
+        db.execute(
+            update(Job)
+            .where(*stale)
+            .values(status="queued", locked_by=None, run_at=_now(), last_error="Worker timed out")
+        )
+        db.commit()
+    finally:
+        db.close()
@@ -0,0 +1,393 @@
+import csv
+import io
+import json
+import os
+import zipfile
+from datetime import date, datetime
+from pydantic import ValidationError
+from sqlalchemy import select, insert, update, func
+from sqlalchemy.orm import Session
+from database import SessionLocal, statement_now
+import changefeed
+import scheduler
+import sync
+from models import Tune, Recording, Segment, PracticeSession, PracticeEntry, Performance, Setlist, SetlistEntry
+from schemas import (
+    TuneCreate, PracticeSessionCreate, PracticeEntryCreate, PerformanceCreate, SetlistCreate, SetlistEntryCreate
+)
+
+EXPORT_BATCH_SIZE = 500
+ZIP_FLUSH_BYTES = 256 * 1024
+IMPORT_BATCH_SIZE = 1000
+IMPORT_MAX_ERRORS = 1000
+
+
+def _json_default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+def _export_queries(user_id: int):
+    # Parents come before children so an importer can resolve references in a single pass
+    yield "tune", select(Tune.__table__).where(Tune.user_id == user_id).order_by(Tune.id)
+    yield "recording", select(Recording.__table__).where(Recording.user_id == user_id).order_by(Recording.id)
+    yield "segment", select(Segment.__table__).where(Segment.user_id == user_id).order_by(Segment.id)
+    yield "session", select(PracticeSession.__table__).where(PracticeSession.user_id == user_id).order_by(PracticeSession.id)
+    yield "entry", (
+        select(PracticeEntry.__table__)
+        .join(PracticeSession, PracticeEntry.session_id == PracticeSession.id)
+        .where(PracticeSession.user_id == user_id)
+        .order_by(PracticeEntry.id)
+    )
+    yield "performance", select(Performance.__table__).where(Performance.user_id == user_id).order_by(Performance.id)
+    yield "setlist", select(Setlist.__table__).where(Setlist.user_id == user_id).order_by(Setlist.id)
+    yield "setlist_entry", (
+        select(SetlistEntry.__table__)
+        .join(Setlist, SetlistEntry.setlist_id == Setlist.id)
+        .where(Setlist.user_id == user_id)
+        .order_by(SetlistEntry.id)
+    )
+
+def _export_lines(db, user_id: int):
+    for record_type, query in _export_queries(user_id):
+        # yield_per streams rows through a server-side cursor instead of buffering the whole result
+        rows = db.execute(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        for row in rows:
+            record = {"type": record_type, **row._mapping}
+            record.pop("user_id", None)
+            yield json.dumps(record, default=_json_default).encode("utf-8") + b"\n"
+
+def export_ndjson(user_id: int):
+    db = SessionLocal()
+    try:
+        yield from _export_lines(db, user_id)
+    finally:
+        db.close()
+
+
+class _ChunkBuffer(io.RawIOBase):
+    # Write-only sink that zipfile treats as unseekable, so entries are written with data descriptors
+    def __init__(self):
+        self._chunks = []
+        self.size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        self.size += len(b)
+        return len(b)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        self.size = 0
+        return data
+
+def export_zip(user_id: int, upload_dir: str):
+    db = SessionLocal()
+    buffer = _ChunkBuffer()
+    try:
+        with zipfile.ZipFile(buffer, "w") as archive:
+            info = zipfile.ZipInfo("library.ndjson", date_time=datetime.now().timetuple()[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            with archive.open(info, "w") as out:
+                for line in _export_lines(db, user_id):
+                    out.write(line)
+                    if buffer.size >= ZIP_FLUSH_BYTES:
+                        yield buffer.drain()
+
+            # Duplicate uploads share one file, which goes in once
+            recordings = db.execute(
+                select(Recording.filename)
+                .where(Recording.user_id == user_id)
+                .group_by(Recording.filename)
+                .order_by(func.min(Recording.id))
+                .execution_options(yield_per=EXPORT_BATCH_SIZE)
+            )
+            for (filename,) in recordings:
+                filepath = os.path.join(upload_dir, filename)
+                if not os.path.exists(filepath):
+                    continue
+                # Audio is already compressed, so store it as-is
+                info = zipfile.ZipInfo(f"audio/{filename}", date_time=datetime.now().timetuple()[:6])
+                info.compress_type = zipfile.ZIP_STORED
+                with open(filepath, "rb") as src, archive.open(info, "w") as out:
+                    while chunk := src.read(ZIP_FLUSH_BYTES):
+                        out.write(chunk)
+                        yield buffer.drain()
+        yield buffer.drain()
+    finally:
+        db.close()
+
+
+# --- Import ---
+
+# record type -> (model, schema, {reference field: referenced record type})
+IMPORT_TYPES = {
+    "tune": (Tune, TuneCreate, {}),
+    "session": (PracticeSession, PracticeSessionCreate, {}),
+    "entry": (PracticeEntry, PracticeEntryCreate, {"session_id": "session", "tune_id": "tune", "segment_id": "segment"}),
+    "performance": (Performance, PerformanceCreate, {}),
+    "setlist": (Setlist, SetlistCreate, {"performance_id": "performance"}),
+    "setlist_entry": (SetlistEntry, SetlistEntryCreate, {
+        "setlist_id": "setlist", "tune_id": "tune", "recording_id": "recording", "segment_id": "segment",
+    }),
+}
+# Audio files are not part of an NDJSON/CSV upload, so these rows are counted but not imported
+SKIPPED_TYPES = {"recording", "segment"}
+# References that may be dropped when they cannot be resolved, matching the ON DELETE SET NULL columns
+OPTIONAL_REFERENCES = {"segment_id", "performance_id", "recording_id"}
+
+# Entries sync as part of their parent, record type -> (parent model, parent id field)
+ENTRY_PARENTS = {"entry": (PracticeSession, "session_id"), "setlist_entry": (Setlist, "setlist_id")}
+
+REFERENCED_TYPES = {target for _, _, references in IMPORT_TYPES.values() for target in references.values()}
+
+def _as_id(value) -> int | None:
+    if value is None or value == "":
+        return None
+    if isinstance(value, bool) or isinstance(value, float) and not value.is_integer():
+        raise ValueError(f"Invalid id: {value!r}")
+    return int(value)
+
+def _owned_ids_query(record_type: str, ids: set[int], user_id: int):
+    model = {"segment": Segment, "recording": Recording}.get(record_type) or IMPORT_TYPES[record_type][0]
+    return select(model.id).where(model.id.in_(ids), model.user_id == user_id)
+
+
+class LibraryImporter:
+    def __init__(self, db: Session, user_id: int):
+        self.db = db
+        self.user_id = user_id
+        self.id_maps = {record_type: {} for record_type in REFERENCED_TYPES}   # ids in the upload -> ids in the database
+        self.owned = {record_type: set() for record_type in [*IMPORT_TYPES, *SKIPPED_TYPES]}   # existing rows already checked
+        self.batch_type = None
+        self.batch = []
+        self.processed = 0
+        self.batches = 0
+        self.imported = {record_type: 0 for record_type in IMPORT_TYPES}
+        self.skipped = 0
+        self.error_count = 0
+        self.errors = []
+
+    def error(self, line: int, message: str):
+        self.error_count += 1
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append({"line": line, "error": message})
+
+    def add(self, line: int, record: dict):
+        self.processed += 1
+        record_type = record.pop("type", None)
+        if record_type in SKIPPED_TYPES:
+            self.skipped += 1
+            return
+        if record_type not in IMPORT_TYPES:
+            self.error(line, f"Unknown record type: {record_type!r}")
+            return
+        # Batches hold a single type so parents are written before the children that reference them
+        if record_type != self.batch_type or len(self.batch) >= IMPORT_BATCH_SIZE:
+            self.flush()
+            self.batch_type = record_type
+        self.batch.append((line, record))
+
+    def _check_owned(self, references: dict[str, str]):
+        # One query per referenced type for the whole batch, skipping ids created by this import
+        wanted = {target: set() for target in references.values()}
+        for _, record in self.batch:
+            for field, target in references.items():
+                try:
+                    old_id = _as_id(record.get(field))
+                except (TypeError, ValueError):
+                    continue   # reported when the row is resolved
+                if old_id is not None and old_id not in self.id_maps.get(target, {}):
+                    wanted[target].add(old_id)
+        for target, ids in wanted.items():
+            ids -= self.owned[target]
+            if ids:
+                self.owned[target].update(self.db.scalars(_owned_ids_query(target, ids, self.user_id)))
+
+    def _resolve(self, field: str, target: str, value) -> int | None:
+        old_id = _as_id(value)
+        if old_id is None:
+            return None
+        if old_id in self.id_maps.get(target, {}):
+            return self.id_maps[target][old_id]
+        if old_id in self.owned[target]:
+            return old_id
+        if field in OPTIONAL_REFERENCES:
+            return None
+        raise ValueError(f"{field} {old_id} not found")
+
+    def _check_setlist_entries(self, accepted: list[tuple]):
+        # As check_setlist_entry in main.py: a segment or recording to rehearse with must be one of the tune's
+        segment_ids = {values["segment_id"] for _, values, _ in accepted if values["segment_id"] is not None}
+        segments = dict(self.db.execute(
+            select(Segment.id, Segment.recording_id).where(Segment.id.in_(segment_ids))
+        ).all()) if segment_ids else {}
+        recording_ids = {values["recording_id"] for _, values, _ in accepted if values["recording_id"] is not None}
+        recording_ids |= set(segments.values())
+        tunes = dict(self.db.execute(
+            select(Recording.id, Recording.tune_id).where(Recording.id.in_(recording_ids))
+        ).all()) if recording_ids else {}
+        for line, values, source_id in accepted:
+            tune_id, recording_id, segment_id = values["tune_id"], values["recording_id"], values["segment_id"]
+            if segment_id is not None:
+                recording_of_segment = segments.get(segment_id)
+                if tunes.get(recording_of_segment) != tune_id or recording_id not in (None, recording_of_segment):
+                    self.error(line, f"Segment {segment_id} not found for tune {tune_id}")
+                    continue
+            elif recording_id is not None and tunes.get(recording_id) != tune_id:
+                self.error(line, f"Recording {recording_id} not found for tune {tune_id}")
+                continue
+            yield line, values, source_id
+
+    def flush(self):
+        if not self.batch:
+            return
+        model, schema, references = IMPORT_TYPES[self.batch_type]
+        self._check_owned(references)
+
+        accepted = []
+        for line, record in self.batch:
+            try:
+                resolved = {field: self._resolve(field, target, record.get(field)) for field, target in references.items()}
+                fields = {k: v for k, v in record.items() if v != ""}   # empty CSV cells fall back to defaults
+                values = schema.model_validate({**fields, **resolved}).model_dump(exclude={"entries"})
+                values.update(resolved)
+            except ValidationError as e:
+                self.error(line, "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()))
+                continue
+            except (TypeError, ValueError) as e:
+                self.error(line, str(e))
+                continue
+            if "user_id" in model.__table__.c:
+                values["user_id"] = self.user_id
+            accepted.append((line, values, record.get("id")))
+        if self.batch_type == "setlist_entry":
+            accepted = list(self._check_setlist_entries(accepted))
+        rows = [values for _, values, _ in accepted]
+        source_ids = [source_id for _, _, source_id in accepted]
+
+        if rows:
+            if self.batch_type in REFERENCED_TYPES:
+                # insertmanyvalues batches these into multi-row INSERT ... RETURNING statements
+                new_ids = self.db.scalars(
+                    insert(model).returning(model.id, sort_by_parameter_order=True), rows
+                ).all()
+                for source_id, new_id in zip(source_ids, new_ids):
+                    try:
+                        source_id = _as_id(source_id)
+                    except (TypeError, ValueError):
+                        continue
+                    if source_id is not None:
+                        self.id_maps[self.batch_type][source_id] = new_id
+                if model in sync.SYNCED_MODELS:
+                    changefeed.track_upserts(self.db, self.user_id, sync.SYNCED_MODELS[model], new_ids)
+            else:
+                self.db.execute(insert(model), rows)
+            # Core inserts skip the flush hooks (sync.track_changes, scheduler.mark_stale), so their work is done here:
+            # new tunes get priorities to score, and entries bump their parent and flag their tunes for rescoring
+            if self.batch_type == "tune":
+                scheduler.invalidate(self.db, {self.user_id: new_ids})
+            elif self.batch_type in ENTRY_PARENTS:
+                parent, field = ENTRY_PARENTS[self.batch_type]
+                parent_ids = {row[field] for row in rows}
+                self.db.execute(update(parent).where(parent.id.in_(parent_ids)).values(updated_at=statement_now()))
+                changefeed.track_upserts(self.db, self.user_id, sync.SYNCED_MODELS[parent], parent_ids)
+                scheduler.invalidate(self.db, {self.user_id: {row["tune_id"] for row in rows}})
+            self.db.commit()
+            self.imported[self.batch_type] += len(rows)
+        self.batches += 1
+        self.batch = []
+
+    def progress(self) -> dict:
+        return {
+            "processed": self.processed,
+            "batches": self.batches,
+            "imported": dict(self.imported),
+            "skipped": self.skipped,
+            "error_count": self.error_count,
+        }
+
+    def summary(self) -> dict:
+        return {**self.progress(), "errors": sorted(self.errors, key=lambda e: e["line"])}
+
+class InvalidEncoding(ValueError):
+    pass
+
+def _decode(line: bytes, line_number: int) -> str:
+    try:
+        return line.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise InvalidEncoding(f"Line {line_number} is not valid UTF-8") from None
+
+def _iter_lines(chunks):
+    pending = b""
+    line_number = 0
+    for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            line_number += 1
+            yield _decode(line, line_number) + "\n"
+    if pending:
+        yield _decode(pending, line_number + 1)
+
+def import_records(db: Session, user_id: int, chunks, format: str) -> dict:
+    # Raises InvalidEncoding at the first line that isn't UTF-8, once the lines before it are imported
+    importer = LibraryImporter(db, user_id)
+    try:
+        for _ in _import_batches(importer, _iter_lines(chunks), format):
+            pass
+    except InvalidEncoding:
+        importer.flush()
+        raise
+    importer.flush()
+    return importer.summary()
+
+def import_progress(user_id: int, chunks, format: str):
+    # The same import as NDJSON status lines: one per committed batch, then the summary.
+    # A bad encoding can't turn into a 400 once lines went out, so it ends the stream instead.
+    with SessionLocal() as db:
+        importer = LibraryImporter(db, user_id)
+        try:
+            for progress in _import_batches(importer, _iter_lines(chunks), format):
+                yield json.dumps({"status": "importing", **progress}).encode("utf-8") + b"\n"
+        except InvalidEncoding as e:
+            importer.flush()
+            done = {"status": "failed", "detail": f"{e}, the lines before it were imported"}
+        else:
+            importer.flush()
+            done = {"status": "done"}
+        yield json.dumps({**done, **importer.summary()}).encode("utf-8") + b"\n"
+
+def _import_batches(importer: LibraryImporter, lines, format: str):
+    # Yields the importer's progress each time a batch is committed
+    batches = importer.batches
+    for line, record in _read_records(importer, lines, format):
+        importer.add(line, record)
+        if importer.batches != batches:
+            batches = importer.batches
+            yield importer.progress()
+
+def _read_records(importer: LibraryImporter, lines, format: str):
+    # (line, record) pairs, lines that aren't records are reported to the importer
+    if format == "csv":
+        reader = csv.DictReader(lines)
+        for record in reader:
+            yield reader.line_num, record
+    else:
+        for line_number, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                importer.error(line_number, f"Invalid JSON: {e.msg}")
+                continue
+            if not isinstance(record, dict):
+                importer.error(line_number, "Each line must be a JSON object")
+                continue
+            yield line_number, record
@@ -1,31 +1,51 @@
 import os
 import uuid
+import hashlib
 import pathlib
-from datetime import date
+from datetime import date, datetime
 import mimetypes
+import threading
+from contextlib import asynccontextmanager
+import anyio
 from dotenv import load_dotenv
 from fastapi import FastAPI, Depends, HTTPException, Request, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse, Response, JSONResponse
 from fastapi.staticfiles import StaticFiles
-from sqlalchemy.orm import Session
-from database import engine, get_db, Base
-from models import User, Tune, Recording, Segment, PracticeSession, PracticeEntry, Performance, SetlistEntry, Setlist
+from sqlalchemy.orm import Session, selectinload
+from database import SessionLocal, get_db, get_read_db, migrate, replica_engines, statement_now, READ_PRIMARY_COOKIE, REPLICA_STICKY_SECONDS
+from models import User, Tune, Recording, Rendition, Segment, PracticeSession, PracticeEntry, Performance, SetlistEntry, Setlist, Job, PracticeRollup, PracticePriority
 from schemas import (
-    UserCreate, UserResponse, TokenResponse,
-    TuneCreate, TuneUpdate, TuneResponse,
-    RecordingResponse,
-    SegmentCreate, SegmentUpdate, SegmentResponse,
+    UserCreate, UserResponse, TokenResponse, StorageUsage,
+    TuneCreate, TuneUpdate, TuneResponse, TuneDetailResponse,
+    RecordingResponse, RecordingMatch, JobResponse,
+    SegmentCreate, SegmentUpdate, SegmentResponse, SegmentSuggestion,
     PracticeSessionCreate, PracticeSessionResponse,
-    PracticeEntryCreate, PracticeEntryResponse, PracticeSessionUpdate, PracticeEntryUpdate, PerformanceCreate, PerformanceUpdate, PerformanceResponse, SetlistCreate, SetlistResponse, SetlistUpdate, SetlistEntryCreate, SetlistEntryResponse
+    PracticeEntryCreate, PracticeEntryResponse, PracticeSessionUpdate, PracticeEntryUpdate, PerformanceCreate, PerformanceUpdate, PerformanceResponse, SetlistCreate, SetlistResponse, SetlistUpdate, SetlistEntryCreate, SetlistEntryResponse,
+    PlaybackEventBatch, PracticeRollupResponse, PracticeSuggestion,
+    SyncResponse,
 )
+import admission
+import analysis
+import changefeed
+import events
+import jobs
+import library
+import media
+import pcm
+import profiler
+import projections
+import rehearsal
+import scheduler   # registers the priority invalidation hooks
+import storage
+import sync
+import worker
 from auth import hash_password, verify_password, create_access_token, decode_access_token
 from fastapi.security import HTTPBearer
+from starlette.datastructures import MutableHeaders
 
 load_dotenv()
 
-Base.metadata.create_all(bind=engine)
-
 UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
@@ -36,9 +56,56 @@ ALLOWED_MIME_TYPES = {
     "audio/mp4", "video/mp4", "audio/x-m4a",
 }
 
-app = FastAPI()
+# "embedded" runs the job worker inside this process, "external" expects `python worker.py` to be running
+JOB_WORKER = os.getenv("JOB_WORKER", "embedded")
+# "startup" migrates the database when the app starts, "external" when serve.py already has
+SCHEMA_MIGRATION = os.getenv("SCHEMA_MIGRATION", "startup")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    stop = threading.Event()
+    job_thread = None
+    if SCHEMA_MIGRATION == "startup":
+        await anyio.to_thread.run_sync(migrate)
+    changefeed.broker.start()
+    events.buffer.start()
+    if JOB_WORKER == "embedded":
+        job_thread = threading.Thread(target=worker.run_worker, args=(stop,), kwargs={"upload_dir": UPLOAD_DIR}, daemon=True)
+        job_thread.start()
+    yield
+    stop.set()
+    if job_thread:
+        await anyio.to_thread.run_sync(job_thread.join)
+    await anyio.to_thread.run_sync(changefeed.broker.stop)
+    await anyio.to_thread.run_sync(events.buffer.stop)
+
+app = FastAPI(lifespan=lifespan)
+app.router.route_class = profiler.ProfiledRoute   # sync endpoints' threadpool time shows in their profiles
 security = HTTPBearer()
 
+class ReadPrimaryAfterWrite:
+    # Read-your-writes for replica routing: a successful write sets a short-lived cookie
+    # that sends the client's reads to the primary (see database.get_read_db)
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in ("GET", "HEAD", "OPTIONS") or not replica_engines:
+            return await self.app(scope, receive, send)
+
+        async def send_with_cookie(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                MutableHeaders(scope=message).append(
+                    "set-cookie",
+                    f"{READ_PRIMARY_COOKIE}=1; Max-Age={REPLICA_STICKY_SECONDS}; Path=/; HttpOnly; SameSite=Lax",
+                )
+            await send(message)
+        await self.app(scope, receive, send_with_cookie)
+
+app.add_middleware(ReadPrimaryAfterWrite)
+app.add_middleware(profiler.RequestProfiler)   # profiles cover the other middleware too
+app.add_middleware(admission.AdmissionControl)  # early, so shed requests cost next to nothing
+# Outermost, so preflights skip admission and its 503s carry CORS headers the browser can read
 app.add_middleware(
     CORSMiddleware,
     allow_origins=[
@@ -66,12 +133,32 @@ def get_current_user(
         raise HTTPException(status_code=401, detail="User not found")
     return user
 
+def get_read_user(
+    credentials = Depends(security),
+    db: Session = Depends(get_read_db),
+) -> User:
+    # Same as get_current_user, sharing the read-only route's session
+    return get_token_user(credentials.credentials, db)
+
 def get_user_tune(tune_id: int, user_id: int, db: Session) -> Tune:
     tune = db.query(Tune).filter(Tune.id == tune_id, Tune.user_id == user_id).first()
     if not tune:
         raise HTTPException(status_code=404, detail="Tune not found")
     return tune
 
+# Recordings and segments carry their owner's user_id, so these are a primary key lookup
+def get_user_recording(recording_id: int, user_id: int, db: Session) -> Recording:
+    recording = db.query(Recording).filter(Recording.id == recording_id, Recording.user_id == user_id).first()
+    if not recording:
+        raise HTTPException(status_code=404, detail="Recording not found")
+    return recording
+
+def get_user_segment(segment_id: int, user_id: int, db: Session) -> Segment:
+    segment = db.query(Segment).filter(Segment.id == segment_id, Segment.user_id == user_id).first()
+    if not segment:
+        raise HTTPException(status_code=404, detail="Segment not found")
+    return segment
+
 @app.post("/api/register", response_model=UserResponse, status_code=201)
 def register(user: UserCreate, db: Session = Depends(get_db)):
     existing = db.query(User).filter(User.username == user.username).first()
@@ -91,6 +178,31 @@ def login(user: UserCreate, db: Session = Depends(get_db)):
     token = create_access_token(db_user.id)
     return {"access_token": token, "token_type": "bearer"}
 
+@app.get("/api/storage", response_model=StorageUsage)
+def get_storage_usage(current_user: User = Depends(get_current_user)):
+    # Read from the counter storage.py keeps, nothing is summed here
+    return {"used_bytes": current_user.storage_bytes, "quota_bytes": storage.quota_bytes()}
+
+
+# --- Profiles ---
+# Authorized by the same signed token that turns profiling on, not by a user login
+
+def require_profile_token(request: Request):
+    token = request.headers.get("x-profile") or request.query_params.get("profile", "")
+    if not profiler.verify(token):
+        raise HTTPException(status_code=403, detail="Profile token required")
+
+@app.get("/api/profiles", dependencies=[Depends(require_profile_token)])
+def list_profiles():
+    return profiler.list_profiles()
+
+@app.get("/api/profiles/{name}", dependencies=[Depends(require_profile_token)])
+def get_profile(name: str):
+    path = profiler.profile_path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="application/json", filename=name)
+
 
 # --- Health check ---
 
@@ -98,36 +210,21 @@ def login(user: UserCreate, db: Session = Depends(get_db)):
 def health_check():
     return {"status": "ok"}
 
+@app.get("/api/health/admission")
+def admission_metrics():
+    # This worker's per-class limits and counters, see admission.py
+    return admission.metrics()
+
 
 # --- Tunes ---
 
 @app.get("/api/tunes", response_model=list[TuneResponse])
 def get_tunes(
     status: str | None = None,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    current_user: User = Depends(get_read_user),
+    db: Session = Depends(get_read_db),
 ):
-    query = db.query(Tune).filter(Tune.user_id == current_user.id)
-    if status:
-        query = query.filter(Tune.status == status)
-    tunes = query.order_by(Tune.title).all()
-
-    results = []
-    for tune in tunes:
-        tune_dict = {
-            "id": tune.id,
-            "title": tune.title,
-            "composer": tune.composer,
-            "key": tune.key,
-            "tempo": tune.tempo,
-            "form": tune.form,
-            "status": tune.status,
-            "notes": tune.notes,
-            "created_at": tune.created_at,
-            "recording_count": len(tune.recordings),
-        }
-        results.append(tune_dict)
-    return results
+    return projections.tunes(db, current_user.id, status)
 
 @app.post("/api/tunes", response_model=TuneResponse, status_code=201)
 def create_tune(
@@ -144,12 +241,30 @@ def create_tune(
 @app.get("/api/tunes/{tune_id}", response_model=TuneResponse)
 def get_tune(
     tune_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    current_user: User = Depends(get_read_user),
+    db: Session = Depends(get_read_db),
 ):
     tune = get_user_tune(tune_id, current_user.id, db)
     return {**tune.__dict__, "recording_count": len(tune.recordings)}
 
+@app.get("/api/tunes/{tune_id}/full", response_model=TuneDetailResponse)
+def get_tune_detail(
+    tune_id: int,
+    current_user: User = Depends(get_read_user),
+    db: Session = Depends(get_read_db),
+):
+    # Everything the tune page shows in one request: recordings, their renditions and segments
+    recordings = selectinload(Tune.recordings)
+    tune = (
+        db.query(Tune)
+        .options(recordings.selectinload(Recording.segments), recordings.selectinload(Recording.renditions))
+        .filter(Tune.id == tune_id, Tune.user_id == current_user.id)
+        .first()
+    )
+    if not tune:
+        raise HTTPException(status_code=404, detail="Tune not found")
+    return {**tune.__dict__, "recording_count": len(tune.recordings)}
+
 @app.patch("/api/tunes/{tune_id}", response_model=TuneResponse)
 def update_tune(
     tune_id: int,
@@ -179,6 +294,7 @@ def delete_tune(
             detail="Cannot delete a tune with practice history. Set its status to 'retired' instead.",
         )
 
+    storage.delete_recording_files(db, tune.recordings, UPLOAD_DIR)
     db.delete(tune)
     db.commit()
 
@@ -188,8 +304,8 @@ def delete_tune(
 @app.get("/api/tunes/{tune_id}/recordings", response_model=list[RecordingResponse])
 def get_recordings(
     tune_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    current_user: User = Depends(get_read_user),
+    db: Session = Depends(get_read_db),
 ):
     tune = get_user_tune(tune_id, current_user.id, db)
     return tune.recordings
@@ -201,6 +317,7 @@ async def upload_recording(
     artist: str = Form(default=None),
     key: str = Form(default=None),
     description: str = Form(default=None),
+    duplicate: bool = Form(default=False),   # store it even if the same file was uploaded before
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
@@ -214,10 +331,16 @@ async def upload_recording(
     if not (mime_ok or ext_ok):
         raise HTTPException(status_code=400, detail="File must be an audio file")
     
+    # Quick check against the counter, the exact one happens when the upload is charged
+    quota = storage.quota_bytes()
+    if quota is not None and current_user.storage_bytes >= quota:
+        raise HTTPException(status_code=413, detail="Storage quota exceeded")
+
     stored_filename = f"{uuid.uuid4().hex}{ext}"
     filepath = os.path.join(UPLOAD_DIR, stored_filename)
 
     # Write the file to disk
+    digest = hashlib.sha256()
     with open(filepath, "wb") as f:
         file_size = 0
         while chunk := await file.read(8192):
@@ -226,29 +349,55 @@ async def upload_recording(
                 f.close()
                 os.remove(filepath)
                 raise HTTPException(status_code=400, detail="File too large (max 50MB)")
+            digest.update(chunk)
             f.write(chunk)
 
     db_recording = Recording(
         tune_id=tune_id,
+        user_id=current_user.id,
         filename=stored_filename,
         original_name=file.filename,
         artist=artist,
         key=key,
         description=description,
         file_size=file_size,
+        content_hash=digest.hexdigest(),
     )
+
+    # The same file again: ask first, then share the stored copy and everything derived from it
+    original = db.query(Recording).filter(
+        Recording.user_id == current_user.id, Recording.content_hash == db_recording.content_hash
+    ).first()
+    if original:
+        os.remove(filepath)
+        if not duplicate:
+            raise HTTPException(status_code=409, detail={
+                "message": "This file has already been uploaded",
+                "recording_id": original.id,
+                "tune_id": original.tune_id,
+                "tune_title": original.tune.title,
+            })
+        db_recording.filename = original.filename
+        for field in ("duration", "tempo_bpm", "loudness_lufs", "peak_db", "gain_db", "hls_ready"):
+            setattr(db_recording, field, getattr(original, field))
+        db_recording.renditions = [
+            Rendition(profile=r.profile, filename=r.filename, bitrate=r.bitrate, duration=r.duration, file_size=r.file_size)
+            for r in original.renditions
+        ]
+    elif not storage.charge(db, current_user.id, file_size):
+        os.remove(filepath)
+        raise HTTPException(status_code=413, detail="Storage quota exceeded")
+
     db.add(db_recording)
+    db.flush()
+    # Renditions, HLS chunks for long recordings and analysis are built in the background
+    jobs.enqueue(db, "process_recording", user_id=current_user.id, recording_id=db_recording.id)
     db.commit()
     db.refresh(db_recording)
     return db_recording
 
-@app.get("/api/recordings/{recording_id}/stream")
-def stream_recording(
-    recording_id: int,
-    token: str = None,
-    db: Session = Depends(get_db),
-):
-    # Auth from query param since <audio> can't set headers
+def get_token_user(token: str | None, db: Session) -> User:
+    # Auth from query param for <audio> and EventSource, which can't set headers
     if not token:
         raise HTTPException(status_code=401, detail="Token required")
     user_id = decode_access_token(token)
@@ -257,15 +406,36 @@ def stream_recording(
     user = db.query(User).filter(User.id == user_id).first()
     if not user:
         raise HTTPException(status_code=401, detail="User not found")
+    return user
 
-    recording = (
-        db.query(Recording)
-        .join(Tune)
-        .filter(Recording.id == recording_id, Tune.user_id == user.id)
-        .first()
-    )
-    if not recording:
-        raise HTTPException(status_code=404, detail="Recording not found")
+def get_stream_recording(recording_id: int, token: str | None, db: Session) -> Recording:
+    user = get_token_user(token, db)
+    return get_user_recording(recording_id, user.id, db)
+
+@app.get("/api/recordings/{recording_id}/stream")
+def stream_recording(
+    recording_id: int,
+    request: Request,
+    token: str = None,
+    rendition: str | None = None,
+    quality: str | None = None,
+    db: Session = Depends(get_read_db),
+):
+    recording = get_stream_recording(recording_id, token, db)
+
+    # Serve a transcoded rendition when the client asks for one by name, or asks for
+    # low bandwidth via ?quality=low or the Save-Data header; otherwise the original
+    low_bandwidth = quality == "low" or request.headers.get("save-data", "").lower() == "on"
+    selected = None if rendition == "original" else media.pick_rendition(recording.renditions, rendition, low_bandwidth)
+    if selected:
+        filepath = media.rendition_path(UPLOAD_DIR, selected.filename)
+        if os.path.exists(filepath):
+            stem = os.path.splitext(recording.original_name)[0]
+            return FileResponse(
+                filepath,
+                media_type=mimetypes.guess_type(filepath)[0] or "application/octet-stream",
+                filename=stem + os.path.splitext(selected.filename)[1],
+            )
 
     filepath = os.path.join(UPLOAD_DIR, recording.filename)
     if not os.path.exists(filepath):
@@ -279,25 +449,100 @@ def stream_recording(
         filename=recording.original_name,
     )
 
+@app.post("/api/recordings/{recording_id}/analysis", status_code=202)
+def analyze_recording(
+    recording_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    recording = get_user_recording(recording_id, current_user.id, db)
+    # Refreshes tempo_bpm and the cached structure features
+    job = jobs.enqueue(db, "analyze_recording", user_id=current_user.id, priority=jobs.PRIORITY_ON_DEMAND, recording_id=recording.id)
+    db.commit()
+    return {"status": "queued", "job_id": job.id}
+
+@app.get("/api/recordings/{recording_id}/segment-suggestions", response_model=list[SegmentSuggestion])
+def get_segment_suggestions(
+    recording_id: int,
+    sensitivity: float = 0.5,
+    min_length: float = 8.0,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    recording = get_user_recording(recording_id, current_user.id, db)
+    if not 0 <= sensitivity <= 1:
+        raise HTTPException(status_code=400, detail="Sensitivity must be between 0 and 1")
+
+    # Features are cached on disk, so trying other sensitivities only redoes the cheap boundary search
+    features = analysis.load_features(UPLOAD_DIR, recording)
+    if features is None:
+        job = jobs.enqueue(db, "analyze_recording", user_id=current_user.id, priority=jobs.PRIORITY_ON_DEMAND, recording_id=recording.id)
+        db.commit()
+        return JSONResponse(status_code=202, content={"status": "pending", "job_id": job.id}, headers={"Retry-After": "10"})
+    return analysis.suggest_segments(features, sensitivity, max(min_length, 1.0))
+
+@app.get("/api/recordings/{recording_id}/matches", response_model=list[RecordingMatch])
+def get_recording_matches(
+    recording_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    # Other recordings of this user that contain the same material: duplicates, other edits, excerpts
+    recording = get_user_recording(recording_id, current_user.id, db)
+    if not recording.fingerprinted:
+        job = jobs.enqueue(db, "fingerprint_recording", user_id=current_user.id, priority=jobs.PRIORITY_ON_DEMAND, recording_id=recording.id)
+        db.commit()
+        return JSONResponse(status_code=202, content={"status": "pending", "job_id": job.id}, headers={"Retry-After": "10"})
+    return analysis.find_matches(db, recording)
+
+@app.get("/api/recordings/{recording_id}/hls/playlist.m3u8")
+def get_hls_playlist(
+    recording_id: int,
+    token: str = None,
+    db: Session = Depends(get_read_db),
+):
+    recording = get_stream_recording(recording_id, token, db)
+    if not recording.hls_ready:
+        # Packaged on first request for recordings that were below the size threshold at upload.
+        # The lookup may have come from a replica, the job goes to the primary.
+        with SessionLocal() as primary:
+            jobs.enqueue(primary, "package_hls", user_id=recording.user_id, priority=jobs.PRIORITY_ON_DEMAND, recording_id=recording.id)
+            primary.commit()
+        raise HTTPException(status_code=404, detail="Playlist not ready", headers={"Retry-After": "30"})
+    return Response(
+        content=media.hls_playlist(UPLOAD_DIR, recording, token),
+        media_type="application/vnd.apple.mpegurl",
+        headers={"Cache-Control": "no-store"},   # carries the token
+    )
+
+@app.get("/api/recordings/{recording_id}/hls/{chunk}")
+def get_hls_chunk(
+    recording_id: int,
+    chunk: str,
+    token: str = None,
+    db: Session = Depends(get_read_db),
+):
+    recording = get_stream_recording(recording_id, token, db)
+    filepath = os.path.join(media.hls_dir(UPLOAD_DIR, recording), chunk)
+    if not recording.hls_ready or not media.HLS_CHUNK_PATTERN.match(chunk) or not os.path.exists(filepath):
+        raise HTTPException(status_code=404, detail="Chunk not found")
+    # Chunks never change for a given stored file, so the player can keep them for good
+    return FileResponse(
+        filepath,
+        media_type="video/iso.segment" if chunk.endswith(".m4s") else "audio/mp4",
+        headers={"Cache-Control": "private, max-age=31536000, immutable"},
+    )
+
 @app.delete("/api/recordings/{recording_id}", status_code=204)
 def delete_recording(
     recording_id: int,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
-    recording = (
-        db.query(Recording)
-        .join(Tune)
-        .filter(Recording.id == recording_id, Tune.user_id == current_user.id)
-        .first()
-    )
-    if not recording:
-        raise HTTPException(status_code=404, detail="Recording not found")
+    recording = get_user_recording(recording_id, current_user.id, db)
 
-    # Delete the file from disk
-    filepath = os.path.join(UPLOAD_DIR, recording.filename)
-    if os.path.exists(filepath):
-        os.remove(filepath)
+    # Delete the file, its renditions and HLS chunks from disk, unless a duplicate upload still uses them
+    storage.delete_recording_files(db, [recording], UPLOAD_DIR)
 
     db.delete(recording)
     db.commit()
@@ -308,17 +553,10 @@ def delete_recording(
 @app.get("/api/recordings/{recording_id}/segments", response_model=list[SegmentResponse])
 def get_segments(
     recording_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    current_user: User = Depends(get_read_user),
+    db: Session = Depends(get_read_db),
 ):
-    recording = (
-        db.query(Recording)
-        .join(Tune)
-        .filter(Recording.id == recording_id, Tune.user_id == current_user.id)
-        .first()
-    )
-    if not recording:
-        raise HTTPException(status_code=404, detail="Recording not found")
+    recording = get_user_recording(recording_id, current_user.id, db)
     return recording.segments
 
 @app.post("/api/recordings/{recording_id}/segments", response_model=SegmentResponse, status_code=201)
@@ -328,16 +566,10 @@ def create_segment(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
-    recording = (
-        db.query(Recording)
-        .join(Tune)
-        .filter(Recording.id == recording_id, Tune.user_id == current_user.id)
-        .first()
-    )
-    if not recording:
-        raise HTTPException(status_code=404, detail="Recording not found")
+    recording = get_user_recording(recording_id, current_user.id, db)
 
-    db_segment = Segment(recording_id=recording_id, **segment.model_dump())
+    db_segment = Segment(recording=recording, user_id=current_user.id, **segment.model_dump())
+    analysis.measure_segment_loudness(db_segment, UPLOAD_DIR)
     db.add(db_segment)
     db.commit()
     db.refresh(db_segment)
@@ -350,36 +582,36 @@ def update_segment(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
-    segment = (
-        db.query(Segment)
-        .join(Recording)
-        .join(Tune)
-        .filter(Segment.id == segment_id, Tune.user_id == current_user.id)
-        .first()
-    )
-    if not segment:
-        raise HTTPException(status_code=404, detail="Segment not found")
-    for key, value in updates.model_dump(exclude_unset=True).items():
+    segment = get_user_segment(segment_id, current_user.id, db)
+    changes = updates.model_dump(exclude_unset=True)
+    for key, value in changes.items():
         setattr(segment, key, value)
+    if "start_time" in changes or "end_time" in changes:
+        segment.tempo_bpm = None   # estimated for the old boundaries
+        analysis.measure_segment_loudness(segment, UPLOAD_DIR)
     db.commit()
     db.refresh(segment)
     return segment
 
+@app.post("/api/segments/{segment_id}/tempo", status_code=202)
+def analyze_segment_tempo(
+    segment_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    segment = get_user_segment(segment_id, current_user.id, db)
+    # Result lands in the segment's tempo_bpm
+    job = jobs.enqueue(db, "analyze_segment_tempo", user_id=current_user.id, priority=jobs.PRIORITY_ON_DEMAND, segment_id=segment.id)
+    db.commit()
+    return {"status": "queued", "job_id": job.id}
+
 @app.delete("/api/segments/{segment_id}", status_code=204)
 def delete_segment(
     segment_id: int,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
-    segment = (
-        db.query(Segment)
-        .join(Recording)
-        .join(Tune)
-        .filter(Segment.id == segment_id, Tune.user_id == current_user.id)
-        .first()
-    )
-    if not segment:
-        raise HTTPException(status_code=404, detail="Segment not found")
+    segment = get_user_segment(segment_id, current_user.id, db)
     db.delete(segment)
     db.commit()
 
@@ -388,28 +620,10 @@ def delete_segment(
 
 @app.get("/api/sessions", response_model=list[PracticeSessionResponse])
 def get_sessions(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    current_user: User = Depends(get_read_user),
+    db: Session = Depends(get_read_db),
 ):
-    sessions = (
-        db.query(PracticeSession)
-        .filter(PracticeSession.user_id == current_user.id)
-        .order_by(PracticeSession.date.desc())
-        .all()
-    )
-    results = []
-    for session in sessions:
-        entry_responses = []
-        for entry in session.entries:
-            entry_responses.append({
-                **entry.__dict__,
-                "tune_title": entry.tune.title if entry.tune else "",
-            })
-        results.append({
-            **session.__dict__,
-            "entries": entry_responses,
-        })
-    return results
+    return projections.sessions(db, current_user.id)
 
 @app.post("/api/sessions", response_model=PracticeSessionResponse, status_code=201)
 def create_session(
@@ -565,12 +779,85 @@ def delete_entry(
     db.commit()
 
 
+# --- Playback events ---
+
+@app.post("/api/events", status_code=202)
+def record_events(
+    batch: PlaybackEventBatch,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    # Players send these in batches. They are buffered and written in bulk by events.py,
+    # so the only query here is the ownership check.
+    recording_ids = {e.recording_id for e in batch.events}
+    segment_ids = {e.segment_id for e in batch.events if e.segment_id is not None}
+    owned_recordings = {row.id for row in db.query(Recording.id).filter(
+        Recording.id.in_(recording_ids), Recording.user_id == current_user.id
+    )} if recording_ids else set()
+    owned_segments = {row.id for row in db.query(Segment.id).filter(
+        Segment.id.in_(segment_ids), Segment.user_id == current_user.id
+    )} if segment_ids else set()
+    if owned_recordings != recording_ids or owned_segments != segment_ids:
+        raise HTTPException(status_code=404, detail="Recording or segment not found")
+    if not all(events.accepted(e.occurred_at) for e in batch.events):
+        raise HTTPException(
+            status_code=422,
+            detail=f"occurred_at must be within the last {events.EVENT_RETENTION_DAYS} days and not in the future",
+        )
+
+    events.buffer.add([
+        {**e.model_dump(), "user_id": current_user.id, "day": e.occurred_at.date()}
+        for e in batch.events
+    ])
+    return {"accepted": len(batch.events)}
+
+@app.get("/api/practice/rollups", response_model=list[PracticeRollupResponse])
+def get_practice_rollups(
+    since: date | None = None,
+    recording_id: int | None = None,
+    current_user: User = Depends(get_read_user),
+    db: Session = Depends(get_read_db),
+):
+    # Time, loops and top speed per day, recording and looped segment, from playback events
+    query = db.query(PracticeRollup).filter(PracticeRollup.user_id == current_user.id)
+    if since:
+        query = query.filter(PracticeRollup.date >= since)
+    if recording_id is not None:
+        query = query.filter(PracticeRollup.recording_id == recording_id)
+    return query.order_by(PracticeRollup.date.desc(), PracticeRollup.id).all()
+
+
+@app.get("/api/practice/next", response_model=list[PracticeSuggestion])
+def get_practice_next(
+    limit: int = 10,
+    current_user: User = Depends(get_read_user),
+    db: Session = Depends(get_read_db),
+):
+    # What to practice now, read from the priority index that scheduler.py keeps up to date in
+    # jobs. Tunes changed moments ago keep their previous score until their rescore job has run.
+    rows = (
+        db.query(PracticePriority, Tune.title, Segment.label)
+        .join(Tune, PracticePriority.tune_id == Tune.id)
+        .outerjoin(Segment, PracticePriority.segment_id == Segment.id)
+        .filter(PracticePriority.user_id == current_user.id)
+        .order_by(PracticePriority.score.desc(), PracticePriority.id)
+        .limit(max(1, min(limit, 100)))
+        .all()
+    )
+    return [
+        PracticeSuggestion(
+            tune_id=p.tune_id, tune_title=title, segment_id=p.segment_id, segment_label=label,
+            score=p.score, reasons=p.reasons or [],
+        )
+        for p, title, label in rows
+    ]
+
 # --- Performances ---
 
 @app.get("/api/performances", response_model=list[PerformanceResponse])
 def get_performances(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    current_user: User = Depends(get_read_user),
+    db: Session = Depends(get_read_db),
 ):
     return db.query(Performance).filter(Performance.user_id == current_user.id).all()
 
@@ -621,25 +908,26 @@ def delete_performance(
 
 # --- Setlists ---
 
+def check_setlist_entry(entry: SetlistEntryCreate, user_id: int, db: Session):
+    # The tune, and the recording or segment to rehearse with, must be the user's and belong together
+    tune = db.query(Tune).filter(Tune.id == entry.tune_id, Tune.user_id == user_id).first()
+    if not tune:
+        raise HTTPException(status_code=400, detail=f"Tune {entry.tune_id} not found")
+    if entry.segment_id is not None:
+        segment = db.query(Segment).filter(Segment.id == entry.segment_id, Segment.user_id == user_id).first()
+        if not segment or segment.recording.tune_id != tune.id or entry.recording_id not in (None, segment.recording_id):
+            raise HTTPException(status_code=400, detail=f"Segment {entry.segment_id} not found for tune {tune.id}")
+    elif entry.recording_id is not None:
+        recording = db.query(Recording).filter(Recording.id == entry.recording_id, Recording.user_id == user_id).first()
+        if not recording or recording.tune_id != tune.id:
+            raise HTTPException(status_code=400, detail=f"Recording {entry.recording_id} not found for tune {tune.id}")
+
 @app.get("/api/setlists", response_model=list[SetlistResponse])
 def get_setlists(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    current_user: User = Depends(get_read_user),
+    db: Session = Depends(get_read_db),
 ):
-    setlists = db.query(Setlist).filter(Setlist.user_id == current_user.id).all()
-    results = []
-    for setlist in setlists:
-        entry_responses = []
-        for entry in setlist.entries:
-            entry_responses.append({
-                **entry.__dict__,
-                "tune_title": entry.tune.title if entry.tune else "",
-            })
-        results.append({
-            **setlist.__dict__,
-            "entries": entry_responses,
-        })
-    return results
+    return projections.setlists(db, current_user.id)
 
 @app.post("/api/setlists", response_model=SetlistResponse, status_code=201)
 def create_setlist(
@@ -657,13 +945,7 @@ def create_setlist(
     db.flush()
 
     for entry_data in setlist.entries:
-        # Verify the tune belongs to this user
-        tune = db.query(Tune).filter(
-            Tune.id == entry_data.tune_id, Tune.user_id == current_user.id
-        ).first()
-        if not tune:
-            raise HTTPException(status_code=400, detail=f"Tune {entry_data.tune_id} not found")
-
+        check_setlist_entry(entry_data, current_user.id, db)
         db_entry = SetlistEntry(
             setlist_id=db_setlist.id,
             **entry_data.model_dump(),
@@ -739,6 +1021,7 @@ def delete_setlist(
         raise HTTPException(status_code=404, detail="Setlist not found")
     db.delete(setlist)
     db.commit()
+    rehearsal.delete_rehearsals(UPLOAD_DIR, setlist_id)
 
 @app.put("/api/setlists/{setlist_id}/entries", response_model=SetlistResponse)
 def update_setlist_entries(
@@ -755,15 +1038,11 @@ def update_setlist_entries(
 
     # Clear existing entries
     db.query(SetlistEntry).filter(SetlistEntry.setlist_id == setlist_id).delete()
+    setlist.updated_at = statement_now()   # bulk delete skips the ORM hooks that bump it
 
     # Add new entries
     for entry_data in entries:
-        tune = db.query(Tune).filter(
-            Tune.id == entry_data.tune_id, Tune.user_id == current_user.id
-        ).first()
-        if not tune:
-            raise HTTPException(status_code=400, detail=f"Tune {entry_data.tune_id} not found")
-
+        check_setlist_entry(entry_data, current_user.id, db)
         db_entry = SetlistEntry(
             setlist_id=setlist_id,
             **entry_data.model_dump(),
@@ -781,7 +1060,155 @@ def update_setlist_entries(
         })
     return {**setlist.__dict__, "entries": entry_responses}
 
-    
+
+@app.get("/api/setlists/{setlist_id}/rehearsal")
+def get_setlist_rehearsal(
+    setlist_id: int,
+    token: str = None,
+    db: Session = Depends(get_read_db),
+):
+    # The setlist as one continuous track. Built by a job on first request and after
+    # the entries or their segments change, served from the cache until then.
+    user = get_token_user(token, db)
+    setlist = db.query(Setlist).filter(Setlist.id == setlist_id, Setlist.user_id == user.id).first()
+    if not setlist:
+        raise HTTPException(status_code=404, detail="Setlist not found")
+    items = rehearsal.plan(db, setlist.id, UPLOAD_DIR)
+    if not items:
+        raise HTTPException(status_code=404, detail="No recordings to play in this setlist")
+    key = rehearsal.cache_key(items)
+    filepath = rehearsal.rehearsal_path(UPLOAD_DIR, setlist.id, key)
+    if not os.path.exists(filepath):
+        with SessionLocal() as primary:
+            job = jobs.enqueue(primary, "build_rehearsal", user_id=user.id, priority=jobs.PRIORITY_ON_DEMAND, setlist_id=setlist.id)
+            primary.commit()
+            job_id = job.id
+        return JSONResponse(status_code=202, content={"status": "pending", "job_id": job_id}, headers={"Retry-After": "10"})
+    return FileResponse(
+        filepath,
+        media_type="audio/mp4",
+        filename=f"{setlist.title}.m4a",
+        headers={"ETag": f'"{key}"', "Cache-Control": "no-cache"},   # the URL carries the token and stays the same across rebuilds
+    )
+
+
+# --- Sync ---
+
+@app.get("/api/sync", response_model=SyncResponse)
+def get_sync(
+    since: datetime | None = None,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    # Rows changed after `since` plus deletions, or everything when `since` is omitted
+    return sync.changes_since(db, current_user.id, since)
+
+@app.get("/api/changes")
+def get_changes(token: str = None, db: Session = Depends(get_db)):
+    # Live feed of the same rows /api/sync returns, pushed as server-sent events after each commit
+    user = get_token_user(token, db)
+    db.close()   # the stream stays open for as long as the device is connected
+    return StreamingResponse(
+        changefeed.stream(user.id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# --- Jobs ---
+
+@app.get("/api/jobs", response_model=list[JobResponse])
+def get_jobs(
+    status: str | None = None,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    query = db.query(Job).filter(Job.user_id == current_user.id)
+    if status:
+        query = query.filter(Job.status == status)
+    return query.order_by(Job.id.desc()).limit(50).all()
+
+@app.get("/api/jobs/{job_id}", response_model=JobResponse)
+def get_job(
+    job_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    job = db.query(Job).filter(Job.id == job_id, Job.user_id == current_user.id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+# --- Export ---
+
+@app.get("/api/export")
+def export_library(
+    format: str = "ndjson",
+    current_user: User = Depends(get_current_user),
+):
+    if format == "ndjson":
+        return StreamingResponse(
+            library.export_ndjson(current_user.id),
+            media_type="application/x-ndjson",
+            headers={"Content-Disposition": 'attachment; filename="woodshed-library.ndjson"'},
+        )
+    if format == "zip":
+        return StreamingResponse(
+            library.export_zip(current_user.id, UPLOAD_DIR),
+            media_type="application/zip",
+            headers={"Content-Disposition": 'attachment; filename="woodshed-library.zip"'},
+        )
+    raise HTTPException(status_code=400, detail="Format must be 'ndjson' or 'zip'")
+
+
+# --- Import ---
+
+def iter_request_body(request: Request):
+    # Pulls the upload chunk by chunk from a sync route running in the threadpool
+    stream = request.stream()
+
+    async def next_chunk():
+        try:
+            return await stream.__anext__()
+        except StopAsyncIteration:
+            return None
+
+    while (chunk := anyio.from_thread.run(next_chunk)) is not None:
+        if chunk:
+            yield chunk
+
+class UploadProgressResponse(StreamingResponse):
+    # Streams while the request body is still being read. StreamingResponse would also call
+    # receive() to watch for a disconnect (servers before ASGI 2.4) and swallow body chunks;
+    # here a disconnect surfaces through the body stream instead.
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+
+@app.post("/api/import")
+def import_library(
+    request: Request,
+    format: str | None = None,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    if format is None:
+        content_type = request.headers.get("content-type", "")
+        format = "csv" if content_type.startswith("text/csv") else "ndjson"
+    if format not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="Format must be 'ndjson' or 'csv'")
+    if "application/x-ndjson" in request.headers.get("accept", ""):
+        # Progress per committed batch, for clients uploading large libraries
+        return UploadProgressResponse(
+            library.import_progress(current_user.id, iter_request_body(request), format),
+            media_type="application/x-ndjson",
+        )
+    try:
+        return library.import_records(db, current_user.id, iter_request_body(request), format)
+    except library.InvalidEncoding as e:
+        raise HTTPException(status_code=400, detail=f"{e}, the lines before it were imported")
+
+
 # --- Server built frontend ---
 
 STATIC_DIR = pathlib.Path(__file__).parent / "static"
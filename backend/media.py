@@ -0,0 +1,238 @@
+import logging
+import os
+import re
+import shutil
+import subprocess
+import time
+import numpy as np
+from database import SessionLocal, statement_now
+from models import Recording, Rendition
+
+FFMPEG = os.getenv("FFMPEG_PATH", "ffmpeg")
+FFPROBE = os.getenv("FFPROBE_PATH", "ffprobe")
+
+HLS_SEGMENT_SECONDS = int(os.getenv("HLS_SEGMENT_SECONDS", 6))
+HLS_MIN_DURATION = float(os.getenv("HLS_MIN_DURATION", 600))   # shorter recordings stream fine as a single file
+HLS_PLAYLIST = "playlist.m3u8"
+HLS_CHUNK_PATTERN = re.compile(r"^(init\.mp4|chunk_\d{5}\.m4s)$")
+# A job holding the packaging lock longer than a job may run has died with it
+HLS_STALE_SECONDS = int(os.getenv("JOB_TIMEOUT_SECONDS", 3600))
+
+# Ordered by preference when a client asks for a low-bandwidth stream without naming a codec.
+# AAC plays everywhere, Opus is smaller but not every mobile browser handles Ogg.
+RENDITION_PROFILES = {
+    "aac": {"codec": "aac", "bitrate": "96k", "ext": ".m4a", "args": ["-movflags", "+faststart"]},
+    "opus": {"codec": "libopus", "bitrate": "64k", "ext": ".opus", "args": ["-f", "ogg"]},
+}
+
+log = logging.getLogger("woodshed.media")
+
+
+def _failure(error: Exception) -> str:
+    # The last line ffmpeg wrote to stderr says what went wrong, the exception itself rarely does
+    stderr = getattr(error, "stderr", None)
+    lines = stderr.decode(errors="replace").strip().splitlines() if isinstance(stderr, bytes) else []
+    return lines[-1] if lines else str(error)
+
+
+def rendition_dir(upload_dir: str) -> str:
+    return os.path.join(upload_dir, "renditions")
+
+def rendition_path(upload_dir: str, filename: str) -> str:
+    return os.path.join(rendition_dir(upload_dir), filename)
+
+def probe_duration(filepath: str) -> float | None:
+    try:
+        result = subprocess.run(
+            [FFPROBE, "-v", "error", "-show_entries", "format=duration", "-of", "default=nw=1:nk=1", filepath],
+            capture_output=True, text=True,
+        )
+        return float(result.stdout.strip())
+    except (OSError, ValueError):
+        return None
+
+def probe_audio(filepath: str) -> tuple[str, int, int] | None:
+    # (codec, sample rate, channels) of the first audio stream
+    try:
+        result = subprocess.run(
+            [FFPROBE, "-v", "error", "-select_streams", "a:0", "-show_entries", "stream=codec_name,sample_rate,channels", "-of", "csv=p=0", filepath],
+            capture_output=True, text=True,
+        )
+        codec, sample_rate, channels = result.stdout.strip().split(",")[:3]
+        return codec, int(sample_rate), int(channels)
+    except (OSError, ValueError):
+        return None
+
+def encode_rendition(source: str, target: str, profile: str):
+    settings = RENDITION_PROFILES[profile]
+    tmp = target + ".part"
+    # Opus pre-skip and the MP4 edit list both record the encoder priming delay,
+    # so decoders trim it and segment start/end times line up with the original
+    subprocess.run(
+        [
+            FFMPEG, "-nostdin", "-v", "error", "-y", "-i", source,
+            "-vn", "-map_metadata", "-1",
+            "-c:a", settings["codec"], "-b:a", settings["bitrate"],
+            *settings["args"], tmp,
+        ],
+        check=True, capture_output=True,
+    )
+    os.replace(tmp, target)
+
+def transcode_recording(recording_id: int, upload_dir: str):
+    # Runs in the post-upload job
+    db = SessionLocal()
+    try:
+        recording = db.query(Recording).filter(Recording.id == recording_id).first()
+        if not recording:
+            return
+        source = os.path.join(upload_dir, recording.filename)
+        if not os.path.exists(source):
+            return
+        if recording.duration is None:
+            recording.duration = probe_duration(source)
+
+        os.makedirs(rendition_dir(upload_dir), exist_ok=True)
+        existing = {r.profile for r in recording.renditions}
+        stem = os.path.splitext(recording.filename)[0]
+        failures = {}
+        for profile, settings in RENDITION_PROFILES.items():
+            if profile in existing:
+                continue
+            filename = f"{stem}.{profile}{settings['ext']}"
+            target = rendition_path(upload_dir, filename)
+            try:
+                encode_rendition(source, target, profile)
+            except (OSError, subprocess.CalledProcessError) as e:
+                failures[profile] = _failure(e)
+                log.warning("Could not encode the %s rendition of recording %s: %s", profile, recording_id, failures[profile])
+                continue   # the original stays playable, the other renditions are still worth having
+            db.add(Rendition(
+                recording_id=recording.id,
+                profile=profile,
+                filename=filename,
+                bitrate=settings["bitrate"],
+                duration=probe_duration(target),
+                file_size=os.path.getsize(target),
+            ))
+            recording.updated_at = statement_now()   # renditions are part of the synced recording
+        db.commit()
+        if failures and not recording.renditions:
+            # Nothing to serve low-bandwidth clients, fail the job so it is retried (and shows up as failed)
+            raise RuntimeError(f"No rendition could be encoded for recording {recording_id}: " + "; ".join(
+                f"{profile}: {failure}" for profile, failure in failures.items()
+            ))
+    finally:
+        db.close()
+
+def iter_pcm(filepath: str, sample_rate: int, channels: int, block_frames: int):
+    # Float32 frames of shape (n, channels), streamed in blocks so long files never sit in memory at full rate
+    cmd = [
+        FFMPEG, "-nostdin", "-v", "error", "-i", filepath,
+        "-vn", "-ac", str(channels), "-ar", str(sample_rate), "-f", "f32le", "-",
+    ]
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    frame_bytes = 4 * channels
+    try:
+        while True:
+            data = process.stdout.read(block_frames * frame_bytes)
+            if not data:
+                break
+            data = data[:len(data) // frame_bytes * frame_bytes]
+            yield np.frombuffer(data, dtype=np.float32).reshape(-1, channels)
+    finally:
+        process.stdout.close()
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, cmd)
+
+class PackagingInProgress(RuntimeError):
+    pass
+
+def hls_dir(upload_dir: str, recording: Recording) -> str:
+    # Keyed by the stored filename, which never changes, so chunks can be cached forever
+    return os.path.join(upload_dir, "hls", os.path.splitext(recording.filename)[0])
+
+def package_hls(recording_id: int, upload_dir: str):
+    # Job handler
+    db = SessionLocal()
+    try:
+        recording = db.query(Recording).filter(Recording.id == recording_id).first()
+        if not recording or recording.hls_ready:
+            return
+        source = os.path.join(upload_dir, recording.filename)
+        if not os.path.exists(source):
+            return
+
+        target = hls_dir(upload_dir, recording)
+        if os.path.exists(os.path.join(target, HLS_PLAYLIST)):
+            # Packaged by another recording of the same stored file
+            recording.hls_ready = True
+            db.commit()
+            return
+        tmp = target + ".part"
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            os.mkdir(tmp)   # doubles as a lock against a second job packaging the same file
+        except FileExistsError:
+            try:
+                age = time.time() - os.path.getmtime(tmp)
+            except FileNotFoundError:
+                age = None   # the other job just finished or gave up
+            if age is None or age < HLS_STALE_SECONDS:
+                # Raise rather than return so the job is retried and marks this recording once the chunks exist
+                raise PackagingInProgress(f"{os.path.basename(target)} is being packaged by another job")
+            shutil.rmtree(tmp, ignore_errors=True)
+            os.mkdir(tmp)
+
+        try:
+            subprocess.run(
+                [
+                    FFMPEG, "-nostdin", "-v", "error", "-y", "-i", source,
+                    "-vn", "-map_metadata", "-1", "-c:a", "aac", "-b:a", "128k",
+                    "-f", "hls", "-hls_time", str(HLS_SEGMENT_SECONDS), "-hls_playlist_type", "vod",
+                    "-hls_segment_type", "fmp4", "-hls_flags", "independent_segments",
+                    "-hls_fmp4_init_filename", "init.mp4",
+                    "-hls_segment_filename", os.path.join(tmp, "chunk_%05d.m4s"),
+                    os.path.join(tmp, HLS_PLAYLIST),
+                ],
+                check=True, capture_output=True,
+            )
+        except (OSError, subprocess.CalledProcessError):
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        shutil.rmtree(target, ignore_errors=True)
+        os.replace(tmp, target)
+        recording.hls_ready = True
+        db.commit()
+    finally:
+        db.close()
+
+def hls_playlist(upload_dir: str, recording: Recording, token: str) -> str:
+    # <audio> can't send headers, so every chunk URI carries the stream token like /stream does
+    with open(os.path.join(hls_dir(upload_dir, recording), HLS_PLAYLIST)) as f:
+        playlist = f.read()
+    playlist = re.sub(r'URI="([^"]+)"', lambda m: f'URI="{m.group(1)}?token={token}"', playlist)
+    return "\n".join(
+        line if not line or line.startswith("#") else f"{line}?token={token}"
+        for line in playlist.splitlines()
+    ) + "\n"
+
+def pick_rendition(renditions: list[Rendition], requested: str | None, low_bandwidth: bool) -> Rendition | None:
+    by_profile = {r.profile: r for r in renditions}
+    if requested:
+        return by_profile.get(requested)
+    if low_bandwidth:
+        for profile in RENDITION_PROFILES:
+            if profile in by_profile:
+                return by_profile[profile]
+    return None
+
+def delete_derived_files(recording: Recording, upload_dir: str):
+    for rendition in recording.renditions:
+        filepath = rendition_path(upload_dir, rendition.filename)
+        if os.path.exists(filepath):
+            os.remove(filepath)
+    shutil.rmtree(hls_dir(upload_dir, recording), ignore_errors=True)
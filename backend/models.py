@@ -1,9 +1,9 @@
 from sqlalchemy import (
-    Column, Integer, String, Float, Text, DateTime, ForeignKey, Date
+    Column, Integer, BigInteger, String, Float, Text, DateTime, ForeignKey, Date, Index, Boolean, JSON
 )
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, false, true, text
 from sqlalchemy.orm import relationship
-from database import Base
+from database import Base, statement_now
 
 
 class User(Base):
@@ -12,6 +12,18 @@ class User(Base):
     id = Column(Integer, primary_key=True, index=True)
     username = Column(String(50), unique=True, nullable=False, index=True)
     password_hash = Column(String(255), nullable=False)
+    # Bytes of uploaded files, kept by storage.py in the same transaction as the upload or delete
+    storage_bytes = Column(
+        BigInteger, nullable=False, default=0, server_default="0",
+        # through tunes, recordings.user_id may be added in the same upgrade
+        info={"backfill": (
+            "UPDATE users SET storage_bytes = (SELECT coalesce(sum(file_size), 0) FROM recordings"
+            " JOIN tunes ON tunes.id = recordings.tune_id WHERE tunes.user_id = users.id"
+            " AND recordings.id = (SELECT min(r.id) FROM recordings r WHERE r.filename = recordings.filename))"
+        )},
+    )   # duplicate uploads share one file, counted once
+    # Last full rescore of the practice priorities, which the worker redoes daily (see scheduler.py)
+    priorities_scored_on = Column(Date, nullable=True, index=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
    
     tunes = relationship("Tune", back_populates="user")
@@ -22,6 +34,10 @@ class User(Base):
 
 class Tune(Base):
     __tablename__ = "tunes"
+    __table_args__ = (
+        Index("ix_tunes_user_id_title", "user_id", "title"),   # repertoire list filters by owner and sorts by title
+        Index("ix_tunes_user_id_updated_at", "user_id", "updated_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -33,6 +49,7 @@ class Tune(Base):
     status = Column(String, default="learning")
     notes = Column(Text, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), default=statement_now(), server_default=func.now(), onupdate=statement_now())  # change cursor for /api/sync
 
     user = relationship("User", back_populates="tunes")
     recordings = relationship("Recording", back_populates="tune", cascade="all, delete-orphan") # deleting a tune also deletes its associated recordings
@@ -42,36 +59,79 @@ class Recording(Base):
     __tablename__ = "recordings"
 
     id = Column(Integer, primary_key=True, index=True)
-    tune_id = Column(Integer, ForeignKey("tunes.id"), nullable=False)   # a tune can exist without recordings, but a recording must be associated with a tune
-    filename = Column(String, nullable=False)     # stored filename on disk
+    tune_id = Column(Integer, ForeignKey("tunes.id"), nullable=False, index=True)   # a tune can exist without recordings, but a recording must be associated with a tune
+    # Copied from the tune so ownership checks don't need a join. Nullable only so it can be added to existing tables.
+    user_id = Column(
+        Integer, ForeignKey("users.id"), nullable=True, index=True,
+        info={"backfill": "UPDATE recordings SET user_id = (SELECT user_id FROM tunes WHERE tunes.id = recordings.tune_id)"},
+    )
+    filename = Column(String, nullable=False, index=True)     # stored filename on disk, shared by duplicate uploads
     original_name = Column(String, nullable=False)   # what the user uploaded
     artist = Column(String, nullable=True)
     key = Column(String, nullable=True)
     description = Column(Text, nullable=True)
     duration = Column(Float, nullable=True)  # in seconds
     file_size = Column(Integer, nullable=True)  # in bytes
+    tempo_bpm = Column(Float, nullable=True)  # estimated by analysis.py
+    loudness_lufs = Column(Float, nullable=True)  # integrated loudness, BS.1770 gated
+    peak_db = Column(Float, nullable=True)        # sample peak in dBFS
+    gain_db = Column(Float, nullable=True)        # playback gain to reach analysis.LOUDNESS_TARGET_LUFS
+    hls_ready = Column(Boolean, nullable=False, default=False, server_default=false())  # chunked playlist packaged under UPLOAD_DIR/hls
+    content_hash = Column(String, nullable=True, index=True)   # sha256 of the uploaded file
+    fingerprinted = Column(Boolean, nullable=False, default=False, server_default=false())  # landmark hashes stored in fingerprints
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), default=statement_now(), server_default=func.now(), onupdate=statement_now())  # change cursor for /api/sync
 
     tune = relationship("Tune", back_populates="recordings")
     segments = relationship("Segment", back_populates="recording", cascade="all, delete-orphan") # deleting a recording also deletes its segments
+    setlist_entries = relationship("SetlistEntry", back_populates="recording")   # unset when the recording is deleted
+    renditions = relationship("Rendition", back_populates="recording", cascade="all, delete-orphan")
+
+class Rendition(Base):
+    __tablename__ = "renditions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    recording_id = Column(Integer, ForeignKey("recordings.id"), nullable=False, index=True)
+    profile = Column(String, nullable=False)    # key into media.RENDITION_PROFILES, e.g. "aac", "opus"
+    filename = Column(String, nullable=False)   # stored filename under UPLOAD_DIR/renditions
+    bitrate = Column(String, nullable=True)     # e.g. "96k"
+    duration = Column(Float, nullable=True)     # in seconds, should match the original
+    file_size = Column(Integer, nullable=True)  # in bytes
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    recording = relationship("Recording", back_populates="renditions")
 
 class Segment(Base):
     __tablename__ = "segments"
 
     id = Column(Integer, primary_key=True, index=True)
-    recording_id = Column(Integer, ForeignKey("recordings.id"), nullable=False)
+    recording_id = Column(Integer, ForeignKey("recordings.id"), nullable=False, index=True)
+    user_id = Column(
+        Integer, ForeignKey("users.id"), nullable=True, index=True,
+        info={"backfill": "UPDATE segments SET user_id = (SELECT user_id FROM recordings WHERE recordings.id = segments.recording_id)"},
+    )   # copied from the recording, see Recording.user_id
     label = Column(String, nullable=False)       # e.g. "Chorus", "Solo", etc.
     start_time = Column(Float, nullable=False)  # in seconds
     end_time = Column(Float, nullable=False)    # in seconds
     color = Column(String, nullable=True)       # for UI display, e.g. "#FF0000"
     notes = Column(Text, nullable=True)
+    tempo_bpm = Column(Float, nullable=True)    # estimated on demand by analysis.py
+    loudness_lufs = Column(Float, nullable=True)
+    peak_db = Column(Float, nullable=True)
+    gain_db = Column(Float, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), default=statement_now(), server_default=func.now(), onupdate=statement_now())  # change cursor for /api/sync
 
     recording = relationship("Recording", back_populates="segments")
     practice_entries = relationship("PracticeEntry", back_populates="segment")
+    setlist_entries = relationship("SetlistEntry", back_populates="segment")
 
 class PracticeSession(Base):
     __tablename__ = "practice_sessions"
+    __table_args__ = (
+        Index("ix_practice_sessions_user_id_date", "user_id", "date"),   # session history filters by owner and sorts by date
+        Index("ix_practice_sessions_user_id_updated_at", "user_id", "updated_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -79,6 +139,7 @@ class PracticeSession(Base):
     duration_minutes = Column(Integer, nullable=True)
     notes = Column(Text, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), default=statement_now(), server_default=func.now(), onupdate=statement_now())  # change cursor for /api/sync
 
     user = relationship("User", back_populates="sessions")
     entries = relationship("PracticeEntry", back_populates="session", cascade="all, delete-orphan")    #deleting a session also deletes its associated entries
@@ -87,9 +148,9 @@ class PracticeEntry(Base):
     __tablename__ = "practice_entries"
 
     id = Column(Integer, primary_key=True, index=True)
-    session_id = Column(Integer, ForeignKey("practice_sessions.id"), nullable=False)
-    tune_id = Column(Integer, ForeignKey("tunes.id"), nullable=False)
-    segment_id = Column(Integer, ForeignKey("segments.id", ondelete="SET NULL"), nullable=True)
+    session_id = Column(Integer, ForeignKey("practice_sessions.id"), nullable=False, index=True)
+    tune_id = Column(Integer, ForeignKey("tunes.id"), nullable=False, index=True)
+    segment_id = Column(Integer, ForeignKey("segments.id", ondelete="SET NULL"), nullable=True, index=True)
     focus = Column(String, nullable=True)  # transcription, technique, memorization, tempo
     tempo_practiced = Column(Integer, nullable=True)  # in BPM
     notes = Column(Text, nullable=True)
@@ -105,13 +166,14 @@ class Performance(Base):
     __tablename__ = "performances"
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
     title = Column(String, nullable=False)  # e.g. "Jazz Night at Blue Note"
     date = Column(Date, nullable=False)
     time = Column(String, nullable=True)  # e.g. "7:30 PM"
     venue = Column(String, nullable=True)
     notes = Column(Text, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), default=statement_now(), server_default=func.now(), onupdate=statement_now())  # change cursor for /api/sync
 
     user = relationship("User", back_populates="performances")
     setlist = relationship("Setlist", back_populates="performance", uselist=False)  # one-to-one relationship, a performance has one setlist and a setlist belongs to one performance
@@ -120,11 +182,12 @@ class Setlist(Base):
     __tablename__ = "setlists"
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
     title = Column(String, nullable=False)  # e.g. "Main Set", "Encore"
-    performance_id = Column(Integer, ForeignKey("performances.id", ondelete="SET NULL"), nullable=True)  # a setlist can exist without being assigned to a performance, but if the performance is deleted, the setlist's performance_id will be set to NULL
+    performance_id = Column(Integer, ForeignKey("performances.id", ondelete="SET NULL"), nullable=True, index=True)  # a setlist can exist without being assigned to a performance, but if the performance is deleted, the setlist's performance_id will be set to NULL
     notes = Column(Text, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), default=statement_now(), server_default=func.now(), onupdate=statement_now())  # change cursor for /api/sync
 
     user = relationship("User", back_populates="setlists")
     performance = relationship("Performance", back_populates="setlist")
@@ -132,11 +195,139 @@ class Setlist(Base):
 
 class SetlistEntry(Base):
     __tablename__ = "setlist_entries"
+    __table_args__ = (
+        Index("ix_setlist_entries_setlist_id_position", "setlist_id", "position"),   # entries are always loaded in setlist order
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     setlist_id = Column(Integer, ForeignKey("setlists.id"), nullable=False)
-    tune_id = Column(Integer, ForeignKey("tunes.id"), nullable=False)
+    tune_id = Column(Integer, ForeignKey("tunes.id"), nullable=False, index=True)
     position = Column(Integer, nullable=False)  # order of the tune in the setlist
+    # What the rehearsal stream plays for this tune: a segment, a whole recording, or when
+    # neither is set the tune's latest recording
+    recording_id = Column(Integer, ForeignKey("recordings.id", ondelete="SET NULL"), nullable=True)
+    segment_id = Column(Integer, ForeignKey("segments.id", ondelete="SET NULL"), nullable=True)
 
     setlist = relationship("Setlist", back_populates="entries")
-    tune = relationship("Tune")
\ No newline at end of file
+    tune = relationship("Tune")
+    recording = relationship("Recording", back_populates="setlist_entries")
+    segment = relationship("Segment", back_populates="setlist_entries")
+
+class Job(Base):
+    __tablename__ = "jobs"
+    __table_args__ = (
+        Index("ix_jobs_claim", "status", "priority", "run_at"),   # workers pick the next runnable job by this order
+        # One queued or running job per dedupe key, so concurrent enqueues can't both insert
+        Index(
+            "ix_jobs_dedupe_active", "dedupe_key", unique=True,
+            sqlite_where=text("status IN ('queued', 'running')"),
+            postgresql_where=text("status IN ('queued', 'running')"),
+            info={"prepare": (
+                "UPDATE jobs SET status = 'failed', locked_by = NULL, last_error = 'Duplicate of an earlier job'"
+                " WHERE status IN ('queued', 'running') AND EXISTS (SELECT 1 FROM jobs j WHERE j.dedupe_key = jobs.dedupe_key"
+                " AND j.status IN ('queued', 'running') AND j.id < jobs.id)"
+            )},
+        ),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=True, index=True)  # who the job is for, null for maintenance jobs
+    kind = Column(String, nullable=False)   # key into jobs.HANDLERS
+    payload = Column(JSON, nullable=False)  # keyword arguments for the handler
+    dedupe_key = Column(String, nullable=True, index=True)  # identical queued/running jobs are not enqueued twice
+    status = Column(String, nullable=False, default="queued")  # queued, running, succeeded, failed
+    priority = Column(Integer, nullable=False, default=0)   # higher runs first
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=3)
+    run_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())  # not picked up before this, pushed back on retry
+    locked_by = Column(String, nullable=True)   # worker that claimed it
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+
+class Tombstone(Base):
+    __tablename__ = "tombstones"
+    __table_args__ = (
+        Index("ix_tombstones_user_id_deleted_at", "user_id", "deleted_at"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    entity = Column(String, nullable=False)     # e.g. "tune", "segment", see sync.SYNCED_MODELS
+    entity_id = Column(Integer, nullable=False)
+    deleted_at = Column(DateTime(timezone=True), default=statement_now(), server_default=func.now())   # change cursor for /api/sync
+
+class Fingerprint(Base):
+    # Landmark hashes from analysis.fingerprint_recording. Recordings sharing material have
+    # many equal hashes at a constant frame difference, see analysis.find_matches.
+    __tablename__ = "fingerprints"
+    __table_args__ = (
+        Index("ix_fingerprints_user_id_hash", "user_id", "hash"),
+    )
+    __mapper_args__ = {"primary_key": ["recording_id", "frame", "hash"]}   # no key in the table, rows are replaced per recording
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    recording_id = Column(Integer, ForeignKey("recordings.id", ondelete="CASCADE"), nullable=False, index=True)
+    hash = Column(Integer, nullable=False)
+    frame = Column(Integer, nullable=False)   # anchor peak position in analysis frames
+
+class PlaybackEvent(Base):
+    # Append-only log written in bulk by events.py. On Postgres it is partitioned by month
+    # so old months can be dropped whole; there are no foreign keys for the same reason.
+    __tablename__ = "playback_events"
+    __table_args__ = (
+        Index("ix_playback_events_user_id_occurred_at", "user_id", "occurred_at"),
+        {"postgresql_partition_by": "RANGE (occurred_at)"},
+    )
+    __mapper_args__ = {"primary_key": ["user_id", "occurred_at"]}   # no key in the table, rows are never updated
+
+    user_id = Column(Integer, nullable=False)
+    recording_id = Column(Integer, nullable=False)
+    segment_id = Column(Integer, nullable=True)     # the segment being looped, if any
+    kind = Column(String, nullable=False)           # play, pause, seek, loop, speed, ramp, ended
+    position = Column(Float, nullable=False)        # seconds into the recording
+    speed = Column(Float, nullable=False)
+    played_seconds = Column(Float, nullable=False)  # playback time since the player's previous event
+    occurred_at = Column(DateTime(timezone=True), nullable=False)
+
+class PracticeRollup(Base):
+    # Per day totals rolled up from playback events, one row per recording and looped segment
+    __tablename__ = "practice_rollups"
+    __table_args__ = (
+        Index("ix_practice_rollups_key", "user_id", "date", "recording_id", text("coalesce(segment_id, 0)"), unique=True),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    date = Column(Date, nullable=False)     # in the player's time zone
+    recording_id = Column(Integer, ForeignKey("recordings.id", ondelete="CASCADE"), nullable=False, index=True)
+    segment_id = Column(Integer, ForeignKey("segments.id", ondelete="CASCADE"), nullable=True, index=True)   # null for free playback
+    seconds = Column(Float, nullable=False, default=0)
+    loops = Column(Integer, nullable=False, default=0)
+    max_speed = Column(Float, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class PracticePriority(Base):
+    # Precomputed practice scores maintained by scheduler.py, one row per tune (segment_id null)
+    # and per segment. Changes to the underlying data mark the tune's rows stale.
+    __tablename__ = "practice_priorities"
+    __table_args__ = (
+        Index("ix_practice_priorities_user_id_score", "user_id", "score"),
+        Index("ix_practice_priorities_key", "user_id", "tune_id", text("coalesce(segment_id, 0)"), unique=True),
+        # The few rows waiting to be rescored, found without reading the rest
+        Index(
+            "ix_practice_priorities_stale", "user_id", "tune_id",
+            sqlite_where=text("stale = 1"), postgresql_where=text("stale"),
+        ),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    tune_id = Column(Integer, ForeignKey("tunes.id", ondelete="CASCADE"), nullable=False, index=True)
+    segment_id = Column(Integer, ForeignKey("segments.id", ondelete="CASCADE"), nullable=True)
+    score = Column(Float, nullable=False, default=0)
+    reasons = Column(JSON, nullable=True)           # short explanations shown with the suggestion
+    scored_on = Column(Date, nullable=True)         # scores depend on the date, so they are redone daily
+    stale = Column(Boolean, nullable=False, default=True, server_default=true())
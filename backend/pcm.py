@@ -0,0 +1,116 @@
+import os
+import struct
+import numpy as np
+from models import Recording
+import media
+
+# Decoded audio cache. Each recording is decoded once per format into a raw file that analysis
+# maps read-only, so job processes working on the same recording share it through the page cache.
+PCM_CACHE_MB = int(os.getenv("PCM_CACHE_MB", 4096))   # least recently used files are evicted beyond this
+PCM_MAGIC = b"WSHDPCM1"
+PCM_HEADER = struct.Struct("<8sIIQ8s")   # magic, sample rate, channels, frames, dtype
+PCM_HEADER_SIZE = 64                     # padded so samples start aligned
+DECODE_BLOCK_FRAMES = 1 << 16
+
+
+def pcm_dir(upload_dir: str) -> str:
+    return os.path.join(upload_dir, "pcm")
+
+def pcm_path(upload_dir: str, recording: Recording, sample_rate: int, channels: int, dtype: str) -> str:
+    stem = os.path.splitext(recording.filename)[0]
+    return os.path.join(pcm_dir(upload_dir), f"{stem}.{sample_rate}x{channels}.{dtype}.pcm")
+
+def _map(path: str, sample_rate: int, channels: int, dtype: str) -> np.ndarray | None:
+    # None when the file is missing, truncated or not what was asked for
+    try:
+        with open(path, "rb") as f:
+            header = f.read(PCM_HEADER.size)
+            size = os.fstat(f.fileno()).st_size
+    except OSError:
+        return None
+    if len(header) < PCM_HEADER.size:
+        return None
+    magic, rate, chans, frames, kind = PCM_HEADER.unpack(header)
+    itemsize = np.dtype(dtype).itemsize
+    if (magic, rate, chans, kind.rstrip(b"\0").decode()) != (PCM_MAGIC, sample_rate, channels, dtype):
+        return None
+    if size != PCM_HEADER_SIZE + frames * channels * itemsize:
+        return None
+    if not frames:
+        return np.zeros((0, channels), dtype=dtype)   # mmap can't map zero bytes
+    return np.memmap(path, dtype=dtype, mode="r", offset=PCM_HEADER_SIZE, shape=(frames, channels))
+
+def _decode(source: str, path: str, sample_rate: int, channels: int, dtype: str):
+    # Streams ffmpeg's output straight to disk, then publishes the file in one rename.
+    # Two processes decoding the same file at once each write their own part file.
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.part"
+    frames = 0
+    try:
+        with open(tmp, "wb") as f:
+            f.write(b"\0" * PCM_HEADER_SIZE)
+            for block in media.iter_pcm(source, sample_rate, channels, DECODE_BLOCK_FRAMES):
+                if dtype == "int16":
+                    block = (np.clip(block, -1, 1) * 32767).astype(np.int16)
+                f.write(block.tobytes())
+                frames += len(block)
+            f.seek(0)
+            f.write(PCM_HEADER.pack(PCM_MAGIC, sample_rate, channels, frames, dtype.encode()))
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+def open_pcm(upload_dir: str, recording: Recording, sample_rate: int, channels: int = 1, dtype: str = "float32") -> np.ndarray:
+    # Read-only (frames, channels) view of the decoded recording, decoding it on first use.
+    # Slicing it copies nothing; pages are read in as the analysis touches them.
+    path = pcm_path(upload_dir, recording, sample_rate, channels, dtype)
+    samples = _map(path, sample_rate, channels, dtype)
+    if samples is not None:
+        os.utime(path)   # mtime is the LRU clock, atime is often disabled
+    else:
+        _decode(os.path.join(upload_dir, recording.filename), path, sample_rate, channels, dtype)
+        samples = _map(path, sample_rate, channels, dtype)
+    # On every open, not just after a decode, so a lowered PCM_CACHE_MB or files written by
+    # other processes are trimmed by whichever job touches the cache next
+    evict(upload_dir, keep=path)
+    return samples
+
+def window(samples: np.ndarray, sample_rate: int, start: float | None = None, duration: float | None = None) -> np.ndarray:
+    # Clamped to the file, a negative index would count from its end
+    first = int(start * sample_rate) if start is not None else 0
+    last = first + int(duration * sample_rate) if duration is not None else len(samples)
+    return samples[max(first, 0):max(last, 0)]
+
+def evict(upload_dir: str, keep: str | None = None):
+    # Removing a file another process still has mapped is safe, its mapping stays valid until released
+    entries = []
+    try:
+        with os.scandir(pcm_dir(upload_dir)) as it:
+            for entry in it:
+                if entry.name.endswith(".pcm") and entry.path != keep:
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+    except OSError:
+        return
+    total = sum(size for _, size, _ in entries) + (os.path.getsize(keep) if keep and os.path.exists(keep) else 0)
+    budget = PCM_CACHE_MB * 1024 * 1024
+    for _, size, path in sorted(entries):
+        if total <= budget:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+
+def delete_pcm(upload_dir: str, recording: Recording):
+    stem = os.path.splitext(recording.filename)[0] + "."
+    try:
+        with os.scandir(pcm_dir(upload_dir)) as it:
+            for entry in it:
+                if entry.name.startswith(stem) and entry.name.endswith(".pcm"):
+                    os.remove(entry.path)
+    except OSError:
+        pass
@@ -0,0 +1,266 @@
+import contextvars
+import functools
+import hashlib
+import hmac
+import inspect
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from urllib.parse import parse_qs
+import anyio
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from fastapi.routing import APIRoute
+from starlette.datastructures import MutableHeaders
+
+# Sampling profiler for single requests. A request is profiled when it carries a token signed
+# with PROFILE_SECRET (X-Profile header or ?profile=), or by chance at PROFILE_SAMPLE_RATE.
+# Each profile is written as a speedscope file (https://www.speedscope.app) to PROFILE_DIR.
+PROFILE_SECRET = os.getenv("PROFILE_SECRET", "")   # unset disables tokens
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", 200))   # oldest files are removed beyond this
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", 5))
+PROFILE_MAX_SECONDS = 60    # long-lived streams stop being sampled after this
+MAX_STACK_DEPTH = 200
+SQL_LABEL_LENGTH = 120
+
+_current = contextvars.ContextVar("profile", default=None)
+_threads = {}       # threadpool thread id -> Profile of the call it is running
+_running = set()
+
+
+def sign(expires: int) -> str:
+    digest = hmac.new(PROFILE_SECRET.encode(), f"profile:{expires}".encode(), hashlib.sha256).hexdigest()
+    return f"{expires}.{digest}"
+
+def verify(token: str) -> bool:
+    if not PROFILE_SECRET or "." not in token:
+        return False
+    expires, _ = token.split(".", 1)
+    if not expires.isdigit() or int(expires) < time.time():
+        return False
+    return hmac.compare_digest(token, sign(int(expires)))
+
+def profile_path(name: str) -> str | None:
+    # None for names that aren't profiles in PROFILE_DIR
+    if not re.fullmatch(r"[\w.-]+\.speedscope\.json", name):
+        return None
+    path = os.path.join(PROFILE_DIR, name)
+    return path if os.path.isfile(path) else None
+
+def list_profiles() -> list[str]:
+    try:
+        return sorted((n for n in os.listdir(PROFILE_DIR) if n.endswith(".speedscope.json")), reverse=True)
+    except FileNotFoundError:
+        return []
+
+
+class Profile:
+    def __init__(self, name: str):
+        self.name = name
+        self.start = time.perf_counter()
+        self.end = None
+        self.samples = []   # (seconds, thread id, stack root first)
+        self.queries = []   # (start, end, thread id, statement)
+        self._loop_thread = None
+        self._task_frame = None
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, name="profiler", daemon=True)
+
+    def __enter__(self):
+        # The event loop thread runs every request's coroutines, so it is only sampled while the
+        # one that entered the profile (or something it awaits) is on the stack
+        self._loop_thread = threading.get_ident()
+        self._task_frame = sys._getframe(1)
+        _running.add(self)
+        self._sampler.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.end = time.perf_counter()
+        self._stop.set()
+        self._sampler.join()
+        _running.discard(self)
+        self._task_frame = None
+
+    def _sample(self):
+        interval = PROFILE_INTERVAL_MS / 1000
+        deadline = self.start + PROFILE_MAX_SECONDS
+        while not self._stop.wait(interval) and time.perf_counter() < deadline:
+            at = time.perf_counter() - self.start
+            frames = sys._current_frames()
+            for thread_id, profile in list(_threads.items()):
+                if profile is self and thread_id in frames:
+                    self.samples.append((at, thread_id, _stack(frames[thread_id])))
+            frame = frames.get(self._loop_thread)
+            if _within(frame, self._task_frame):
+                self.samples.append((at, self._loop_thread, _stack(frame)))
+            del frames, frame
+
+    def speedscope(self) -> dict:
+        frames, index = [], {}
+
+        def frame_id(key):
+            if key not in index:
+                index[key] = len(frames)
+                name, filename, line = key
+                frames.append({"name": name, "file": filename, "line": line} if filename else {"name": name})
+            return index[key]
+
+        duration = (self.end or time.perf_counter()) - self.start
+        by_thread = {}
+        for at, thread_id, stack in self.samples:
+            by_thread.setdefault(thread_id, []).append((at, stack))
+        profiles = []
+        for thread_id, samples in by_thread.items():
+            weights = [b[0] - a[0] for a, b in zip(samples, samples[1:])] + [PROFILE_INTERVAL_MS / 1000]
+            profiles.append({
+                "type": "sampled", "name": f"{self.name} (thread {thread_id})", "unit": "seconds",
+                "startValue": 0, "endValue": duration,
+                "samples": [[frame_id(f) for f in stack] for _, stack in samples],
+                "weights": weights,
+            })
+        queries = {}
+        for start, end, thread_id, statement in self.queries:
+            queries.setdefault(thread_id, []).append((start, end, statement))
+        for thread_id, timings in queries.items():
+            events = []
+            for start, end, statement in sorted(timings):
+                frame = frame_id((_sql_label(statement), None, None))
+                events += [{"type": "O", "frame": frame, "at": start}, {"type": "C", "frame": frame, "at": end}]
+            profiles.append({
+                "type": "evented", "name": f"{self.name} SQL (thread {thread_id}, {len(timings)} queries)",
+                "unit": "seconds", "startValue": 0, "endValue": duration, "events": events,
+            })
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": self.name,
+            "exporter": "woodshed",
+            "shared": {"frames": frames},
+            "profiles": profiles,
+        }
+
+    def save(self, filename: str):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, filename)
+        with open(f"{path}.part", "w") as f:
+            json.dump(self.speedscope(), f)
+        os.replace(f"{path}.part", path)
+        for name in list_profiles()[PROFILE_KEEP:]:
+            try:
+                os.remove(os.path.join(PROFILE_DIR, name))
+            except OSError:
+                pass
+
+def _stack(frame) -> list[tuple]:
+    stack = []
+    while frame is not None and len(stack) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        stack.append((code.co_qualname, code.co_filename, code.co_firstlineno))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+def _within(frame, outer) -> bool:
+    while frame is not None:
+        if frame is outer:
+            return True
+        frame = frame.f_back
+    return False
+
+def _sql_label(statement: str) -> str:
+    label = " ".join(statement.split())
+    return label if len(label) <= SQL_LABEL_LENGTH else label[:SQL_LABEL_LENGTH - 3] + "..."
+
+
+# --- Threadpool ---
+# Sync endpoints run in the threadpool, which copies the request's context into the call. Routes
+# made with ProfiledRoute (main.py sets it as the app's route class) have the worker thread sampled
+# for the request's profile from when the endpoint starts until it returns.
+
+def attributed(func):
+    @functools.wraps(func)
+    def run(*args, **kwargs):
+        profile = _current.get()
+        if profile is None:
+            return func(*args, **kwargs)
+        thread_id = threading.get_ident()
+        _threads[thread_id] = profile
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _threads.pop(thread_id, None)
+    return run
+
+class ProfiledRoute(APIRoute):
+    def __init__(self, path: str, endpoint, **kwargs):
+        if not inspect.iscoroutinefunction(endpoint):
+            endpoint = attributed(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+
+# --- SQL timings ---
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    if _running and _current.get() is not None:
+        conn.info.setdefault("profile_started", []).append(time.perf_counter())
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    if not _running:
+        return
+    profile = _current.get()
+    started = conn.info.get("profile_started")
+    if profile is None or not started:
+        return
+    start = started.pop()
+    profile.queries.append((start - profile.start, time.perf_counter() - profile.start, threading.get_ident(), statement))
+
+
+# --- Middleware ---
+
+class RequestProfiler:
+    def __init__(self, app):
+        self.app = app
+
+    def _wanted(self, scope) -> bool:
+        if scope["path"].startswith("/api/profiles"):
+            return False   # fetching profiles with the token shouldn't add more
+        for key, value in scope["headers"]:
+            if key == b"x-profile":
+                return verify(value.decode("latin-1"))
+        if b"profile=" in scope["query_string"]:
+            token = parse_qs(scope["query_string"].decode("latin-1")).get("profile", [""])[0]
+            return verify(token)
+        return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._wanted(scope):
+            return await self.app(scope, receive, send)
+
+        path = re.sub(r"[^\w-]+", "_", scope["path"]).strip("_")[:80]
+        filename = f"{time.strftime('%Y%m%dT%H%M%S')}-{time.time_ns() % 10**9:09d}-{scope['method']}-{path}.speedscope.json"
+        status = None
+
+        async def send_with_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                MutableHeaders(scope=message).append("x-profile-id", filename)
+            await send(message)
+
+        profile = Profile(f"{scope['method']} {scope['path']}")
+        token = _current.set(profile)
+        try:
+            with profile:
+                await self.app(scope, receive, send_with_id)
+        finally:
+            _current.reset(token)
+            profile.name += f" {status}" if status else ""
+            await anyio.to_thread.run_sync(profile.save, filename)
@@ -0,0 +1,86 @@
+from collections import defaultdict
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session
+from models import Tune, Recording, PracticeSession, PracticeEntry, Setlist, SetlistEntry
+from schemas import TuneResponse, PracticeSessionResponse, PracticeEntryResponse, SetlistResponse, SetlistEntryResponse
+
+# Read paths for the list endpoints that skip the ORM. Each selects only the columns its response
+# schema has and returns Core rows, which the schemas read through from_attributes. No identity
+# map, instance state or lazy loads, and children come from one query per list instead of one per row.
+
+
+def _columns(model, schema) -> list:
+    return [column for name, column in model.__table__.c.items() if name in schema.model_fields]
+
+class Parent:
+    # A row and its child rows, for responses with nested lists
+    __slots__ = ("row", "entries")
+
+    def __init__(self, row, entries: list):
+        self.row = row
+        self.entries = entries
+
+    def __getattr__(self, name):
+        return getattr(self.row, name)
+
+def _with_entries(parents, children) -> list[Parent]:
+    by_parent = defaultdict(list)
+    for child in children:
+        by_parent[child.parent_id].append(child)
+    return [Parent(row, by_parent.get(row.id, [])) for row in parents]
+
+
+def tunes(db: Session, user_id: int, status: str | None = None) -> list:
+    counts = (
+        select(Recording.tune_id, func.count().label("recording_count"))
+        .where(Recording.user_id == user_id)
+        .group_by(Recording.tune_id)
+        .subquery()
+    )
+    query = (
+        select(*_columns(Tune, TuneResponse), func.coalesce(counts.c.recording_count, 0).label("recording_count"))
+        .outerjoin(counts, counts.c.tune_id == Tune.id)
+        .where(Tune.user_id == user_id)
+        .order_by(Tune.title)
+    )
+    if status:
+        query = query.where(Tune.status == status)
+    return db.execute(query).all()
+
+def sessions(db: Session, user_id: int) -> list[Parent]:
+    parents = db.execute(
+        select(*_columns(PracticeSession, PracticeSessionResponse))
+        .where(PracticeSession.user_id == user_id)
+        .order_by(PracticeSession.date.desc())
+    )
+    children = db.execute(
+        select(
+            *_columns(PracticeEntry, PracticeEntryResponse),
+            PracticeEntry.session_id.label("parent_id"),
+            func.coalesce(Tune.title, "").label("tune_title"),
+        )
+        .join(PracticeSession, PracticeEntry.session_id == PracticeSession.id)
+        .outerjoin(Tune, PracticeEntry.tune_id == Tune.id)
+        .where(PracticeSession.user_id == user_id)
+        .order_by(PracticeEntry.id)
+    )
+    return _with_entries(parents.all(), children)
+
+def setlists(db: Session, user_id: int) -> list[Parent]:
+    parents = db.execute(
+        select(*_columns(Setlist, SetlistResponse))
+        .where(Setlist.user_id == user_id)
+        .order_by(Setlist.id)
+    )
+    children = db.execute(
+        select(
+            *_columns(SetlistEntry, SetlistEntryResponse),
+            SetlistEntry.setlist_id.label("parent_id"),
+            func.coalesce(Tune.title, "").label("tune_title"),
+        )
+        .join(Setlist, SetlistEntry.setlist_id == Setlist.id)
+        .outerjoin(Tune, SetlistEntry.tune_id == Tune.id)
+        .where(Setlist.user_id == user_id)
+        .order_by(SetlistEntry.position, SetlistEntry.id)
+    )
+    return _with_entries(parents.all(), children)
@@ -0,0 +1,139 @@
+import hashlib
+import json
+import os
+import subprocess
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session
+from database import SessionLocal
+from models import Recording, Rendition, Segment, Setlist, SetlistEntry
+import media
+
+# A setlist played straight through as one file, rebuilt when what it plays changes. Each file is
+# named after a hash of its parts, so edits to the setlist or its segments make a new one.
+REHEARSAL_BITRATE = "128k"
+REHEARSAL_SAMPLE_RATE = 48000
+REHEARSAL_VERSION = 1   # bump when the output changes, so cached files are rebuilt
+COPY_CODECS = {"aac"}   # stitched into MP4 without decoding when every part shares codec and format
+
+
+def rehearsal_dir(upload_dir: str) -> str:
+    return os.path.join(upload_dir, "rehearsals")
+
+def rehearsal_path(upload_dir: str, setlist_id: int, key: str) -> str:
+    return os.path.join(rehearsal_dir(upload_dir), f"{setlist_id}.{key}.m4a")
+
+def plan(db: Session, setlist_id: int, upload_dir: str) -> list[dict]:
+    # The file and time range each entry plays, in setlist order. Entries with nothing on disk to play are left out.
+    entries = db.execute(
+        select(SetlistEntry.tune_id, SetlistEntry.recording_id, Segment.recording_id, Segment.start_time, Segment.end_time)
+        .outerjoin(Segment, SetlistEntry.segment_id == Segment.id)
+        .where(SetlistEntry.setlist_id == setlist_id)
+        .order_by(SetlistEntry.position, SetlistEntry.id)
+    ).all()
+    latest = dict(db.execute(
+        select(Recording.tune_id, func.max(Recording.id))
+        .where(Recording.tune_id.in_({e.tune_id for e in entries}))
+        .group_by(Recording.tune_id)
+    ).all()) if entries else {}
+    chosen = [segment_recording or recording_id or latest.get(tune_id) for tune_id, recording_id, segment_recording, _, _ in entries]
+
+    ids = {r for r in chosen if r is not None}
+    filenames = dict(db.execute(select(Recording.id, Recording.filename).where(Recording.id.in_(ids))).all()) if ids else {}
+    # The AAC renditions share one encoder setting, so parts taken from them can usually be stream copied
+    renditions = dict(db.execute(
+        select(Rendition.recording_id, Rendition.filename).where(Rendition.recording_id.in_(ids), Rendition.profile == "aac")
+    ).all()) if ids else {}
+
+    items = []
+    for (_, _, _, start, end), recording_id in zip(entries, chosen):
+        if recording_id not in filenames:
+            continue
+        source = os.path.join(upload_dir, filenames[recording_id])
+        if recording_id in renditions and os.path.exists(media.rendition_path(upload_dir, renditions[recording_id])):
+            source = media.rendition_path(upload_dir, renditions[recording_id])
+        elif not os.path.exists(source):
+            continue
+        items.append({"source": source, "start": start, "end": end})
+    return items
+
+def cache_key(items: list[dict]) -> str:
+    parts = [REHEARSAL_VERSION, [(os.path.basename(i["source"]), i["start"], i["end"]) for i in items]]
+    return hashlib.sha256(json.dumps(parts).encode()).hexdigest()[:32]
+
+def _quote(path: str) -> str:
+    return "'" + path.replace("'", "'\\''") + "'"
+
+def _stitch(items: list[dict], target: str):
+    # Same codec and format throughout: the concat demuxer copies packets, cutting segments at
+    # the nearest frame. Anything else is decoded, resampled to a common format and encoded once.
+    formats = {media.probe_audio(i["source"]) for i in items}
+    fmt = next(iter(formats)) if len(formats) == 1 else None
+    if fmt is not None and fmt[0] in COPY_CODECS:
+        listing = target + ".txt"
+        with open(listing, "w") as f:
+            f.write("ffconcat version 1.0\n")
+            for item in items:
+                f.write(f"file {_quote(os.path.abspath(item['source']))}\n")
+                if item["start"] is not None:
+                    f.write(f"inpoint {item['start']}\noutpoint {item['end']}\n")
+        try:
+            subprocess.run(
+                [
+                    media.FFMPEG, "-nostdin", "-v", "error", "-y", "-f", "concat", "-safe", "0", "-i", listing,
+                    "-vn", "-map_metadata", "-1", "-c:a", "copy", "-movflags", "+faststart", "-f", "mp4", target,
+                ],
+                check=True, capture_output=True,
+            )
+        finally:
+            os.remove(listing)
+        return
+
+    inputs, labels = [], []
+    for n, item in enumerate(items):
+        if item["start"] is not None:
+            inputs += ["-ss", str(item["start"]), "-to", str(item["end"])]
+        inputs += ["-i", item["source"]]
+        labels.append(f"[{n}:a:0]aformat=sample_fmts=fltp:sample_rates={REHEARSAL_SAMPLE_RATE}:channel_layouts=stereo[a{n}]")
+    graph = ";".join(labels) + ";" + "".join(f"[a{n}]" for n in range(len(items))) + f"concat=n={len(items)}:v=0:a=1[out]"
+    subprocess.run(
+        [
+            media.FFMPEG, "-nostdin", "-v", "error", "-y", *inputs,
+            "-filter_complex", graph, "-map", "[out]", "-map_metadata", "-1",
+            "-c:a", "aac", "-b:a", REHEARSAL_BITRATE, "-movflags", "+faststart", "-f", "mp4", target,
+        ],
+        check=True, capture_output=True,
+    )
+
+def build_rehearsal(setlist_id: int, upload_dir: str):
+    # Job handler
+    db = SessionLocal()
+    try:
+        if db.get(Setlist, setlist_id) is None:
+            return
+        items = plan(db, setlist_id, upload_dir)
+    finally:
+        db.close()
+    if not items:
+        return
+    target = rehearsal_path(upload_dir, setlist_id, cache_key(items))
+    if not os.path.exists(target):
+        os.makedirs(rehearsal_dir(upload_dir), exist_ok=True)
+        tmp = f"{target}.{os.getpid()}.part"
+        try:
+            _stitch(items, tmp)
+            os.replace(tmp, target)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+    delete_rehearsals(upload_dir, setlist_id, keep=target)
+
+def delete_rehearsals(upload_dir: str, setlist_id: int, keep: str | None = None):
+    prefix = f"{setlist_id}."
+    try:
+        with os.scandir(rehearsal_dir(upload_dir)) as it:
+            for entry in it:
+                if entry.name.startswith(prefix) and entry.name.endswith(".m4a") and entry.path != keep:
+                    os.remove(entry.path)
+    except OSError:
+        pass
@@ -0,0 +1,252 @@
+from collections import defaultdict
+from datetime import date
+from sqlalchemy import event, select, update, insert, delete, func, inspect, exists, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from database import SessionLocal
+from models import (
+    User, Tune, Recording, Segment, PracticeSession, PracticeEntry, Performance, Setlist, SetlistEntry, PracticePriority
+)
+
+RATING_INTERVALS = {1: 1, 2: 2, 3: 4, 4: 7, 5: 14}   # days until an item is due again, by its last rating
+UNRATED_INTERVAL = 2
+MAX_OVERDUE = 3.0           # beyond three intervals overdue, everything is equally urgent
+TEMPO_WEIGHT = 1.0
+PERFORMANCE_WEIGHT = 2.0
+PERFORMANCE_HORIZON_DAYS = 30
+# Retired tunes aren't scheduled
+STATUS_WEIGHTS = {"learning": 1.0, "transcribing": 1.0, "playable": 0.8, "polished": 0.5}
+RESCORE_PASSES = 3          # a job rescores again for tunes changed while it ran, this many times at most
+
+
+def score_item(today: date, history: list[tuple], target_tempo: int | None, performance_date: date | None, weight: float):
+    # history: (date, rating, tempo_practiced) oldest first
+    reasons = []
+    if history:
+        last_date, last_rating = history[-1][0], history[-1][1]
+        interval = RATING_INTERVALS.get(last_rating, UNRATED_INTERVAL)
+        days = (today - last_date).days
+        overdue = min(days / interval, MAX_OVERDUE)
+        if days >= interval:
+            reasons.append(f"last practiced {days} days ago")
+    else:
+        overdue = 1.0
+        reasons.append("never practiced")
+
+    tempos = [tempo for _, _, tempo in history if tempo]
+    gap = 0.0
+    if target_tempo and tempos and max(tempos) < target_tempo:
+        gap = 1 - max(tempos) / target_tempo
+        reasons.append(f"{max(tempos)} of {target_tempo} BPM")
+
+    urgency = 0.0
+    if performance_date is not None:
+        days_left = (performance_date - today).days
+        if days_left < PERFORMANCE_HORIZON_DAYS:
+            urgency = 1 - days_left / PERFORMANCE_HORIZON_DAYS
+            reasons.append("performance today" if days_left == 0 else f"performance in {days_left} days")
+
+    score = weight * (overdue + TEMPO_WEIGHT * gap) + PERFORMANCE_WEIGHT * urgency
+    return round(score, 4), reasons
+
+def score_tunes(db: Session, user_id: int, today: date, tune_ids: set[int] | None = None) -> list[dict]:
+    # Rows for the given tunes (all of the user's when None) and their segments
+    def only(column, query):
+        return query if tune_ids is None else query.where(column.in_(tune_ids))
+
+    tunes = db.execute(only(Tune.id, select(Tune.id, Tune.tempo, Tune.status).where(Tune.user_id == user_id))).all()
+    segments = db.execute(only(Recording.tune_id, (
+        select(Segment.id, Recording.tune_id)
+        .join(Recording, Segment.recording_id == Recording.id)
+        .where(Segment.user_id == user_id)
+    ))).all()
+    entries = db.execute(only(PracticeEntry.tune_id, (
+        select(PracticeEntry.tune_id, PracticeEntry.segment_id, PracticeSession.date, PracticeEntry.rating, PracticeEntry.tempo_practiced)
+        .join(PracticeSession, PracticeEntry.session_id == PracticeSession.id)
+        .where(PracticeSession.user_id == user_id)
+        .order_by(PracticeSession.date, PracticeEntry.id)
+    ))).all()
+    performances = dict(db.execute(only(SetlistEntry.tune_id, (
+        select(SetlistEntry.tune_id, func.min(Performance.date))
+        .join(Setlist, SetlistEntry.setlist_id == Setlist.id)
+        .join(Performance, Setlist.performance_id == Performance.id)
+        .where(Setlist.user_id == user_id, Performance.date >= today)
+        .group_by(SetlistEntry.tune_id)
+    ))).all())
+
+    tune_history = defaultdict(list)
+    segment_history = defaultdict(list)
+    for tune_id, segment_id, day, rating, tempo in entries:
+        tune_history[tune_id].append((day, rating, tempo))
+        if segment_id is not None:
+            segment_history[segment_id].append((day, rating, tempo))
+    segments_by_tune = defaultdict(list)
+    for segment_id, tune_id in segments:
+        segments_by_tune[tune_id].append(segment_id)
+
+    rows = []
+    for tune_id, tempo, status in tunes:
+        weight = STATUS_WEIGHTS.get(status)
+        if weight is None:
+            continue
+        performance_date = performances.get(tune_id)
+        for segment_id in [None, *segments_by_tune[tune_id]]:
+            history = tune_history[tune_id] if segment_id is None else segment_history[segment_id]
+            score, reasons = score_item(today, history, tempo, performance_date, weight)
+            rows.append({
+                "user_id": user_id, "tune_id": tune_id, "segment_id": segment_id,
+                "score": score, "reasons": reasons, "scored_on": today, "stale": False,
+            })
+    return rows
+
+def score_priorities(owner_id: int, upload_dir: str):
+    # Job: rescores the user's stale tunes. Scores also drift with the date, so the first run of a
+    # day (see enqueue_daily) rescores everything. /api/practice/next only reads the result.
+    today = date.today()
+    db = SessionLocal()
+    try:
+        for _ in range(RESCORE_PASSES):
+            scored_on = db.scalar(select(User.priorities_scored_on).where(User.id == owner_id))
+            if scored_on != today:
+                tune_ids = None
+            else:
+                tune_ids = set(db.scalars(select(PracticePriority.tune_id).where(
+                    PracticePriority.user_id == owner_id, PracticePriority.stale
+                ).distinct()))
+                if not tune_ids:
+                    return
+
+            rows = score_tunes(db, owner_id, today, tune_ids)
+            scope = PracticePriority.user_id == owner_id
+            if tune_ids is not None:
+                scope &= PracticePriority.tune_id.in_(tune_ids)
+            try:
+                db.execute(delete(PracticePriority).where(scope))
+                if rows:
+                    db.execute(insert(PracticePriority), rows)
+                if tune_ids is None:
+                    db.execute(update(User).where(User.id == owner_id).values(priorities_scored_on=today))
+                db.commit()
+            except IntegrityError:
+                db.rollback()   # placeholders for a new tune arrived meanwhile, the next pass includes them
+    finally:
+        db.close()
+
+def enqueue_daily():
+    # Worker maintenance: users with tunes whose scores are from an earlier day get a full rescore
+    import jobs   # jobs imports this module for its handler
+    today = date.today()
+    db = SessionLocal()
+    try:
+        user_ids = db.scalars(select(User.id).where(
+            or_(User.priorities_scored_on.is_(None), User.priorities_scored_on < today),
+            exists().where(Tune.user_id == User.id),
+        )).all()
+        for user_id in user_ids:
+            jobs.enqueue(db, "score_priorities", user_id=user_id, owner_id=user_id)
+        db.commit()
+    finally:
+        db.close()
+
+
+# --- Invalidation ---
+
+# What the priorities are computed from. Flushes without any of these (jobs, events) are skipped.
+SCORED_MODELS = (Tune, Recording, Segment, PracticeSession, PracticeEntry, Performance, Setlist, SetlistEntry)
+
+@event.listens_for(Session, "after_flush")
+def mark_stale(session, flush_context):
+    # Runs inside the flush, so the stale flags commit or roll back with the change itself
+    changed = [obj for obj in (*session.new, *session.dirty, *session.deleted) if isinstance(obj, SCORED_MODELS)]
+    if not changed:
+        return
+    stale = defaultdict(set)    # user id -> tune ids
+    everything = set()          # user ids whose scores all depend on the change
+    deleted = set()             # tune ids
+    placeholders = []
+
+    for obj in changed:
+        if isinstance(obj, PracticeEntry):
+            parent = obj.session or session.get(PracticeSession, obj.session_id)
+            if parent is not None:
+                # An entry moved to another tune changes both
+                stale[parent.user_id].update({obj.tune_id, *inspect(obj).attrs.tune_id.history.deleted})
+        elif isinstance(obj, SetlistEntry):
+            parent = obj.setlist or session.get(Setlist, obj.setlist_id)
+            if parent is not None:
+                stale[parent.user_id].update({obj.tune_id, *inspect(obj).attrs.tune_id.history.deleted})
+        elif isinstance(obj, Tune):
+            if obj in session.deleted:
+                deleted.add(obj.id)
+            elif obj in session.new or session.is_modified(obj):
+                stale[obj.user_id].add(obj.id)
+        elif isinstance(obj, Recording):
+            # Only which tune its segments belong to matters, not what the analysis jobs fill in
+            if obj in session.deleted:
+                stale[obj.user_id].add(obj.tune_id)
+            elif obj not in session.new:
+                moved_from = inspect(obj).attrs.tune_id.history.deleted
+                if moved_from:
+                    stale[obj.user_id].update({obj.tune_id, *moved_from})
+        elif isinstance(obj, Segment):
+            recording = session.get(Recording, obj.recording_id) if obj.recording_id else obj.recording
+            if recording is None:
+                continue
+            if obj in session.new:
+                placeholders.append({"user_id": obj.user_id, "tune_id": recording.tune_id, "segment_id": obj.id})
+            elif obj in session.deleted:
+                stale[obj.user_id].add(recording.tune_id)
+            else:
+                moved_from = [session.get(Recording, r) for r in inspect(obj).attrs.recording_id.history.deleted if r]
+                if moved_from:
+                    stale[obj.user_id].update({recording.tune_id, *(r.tune_id for r in moved_from if r is not None)})
+        elif isinstance(obj, (PracticeSession, Performance, Setlist)) and obj in session.dirty:
+            if session.is_modified(obj):
+                everything.add(obj.user_id)
+
+    invalidate(session, stale, everything, deleted, placeholders)
+
+def invalidate(session: Session, stale: dict[int, set], everything: set = frozenset(), deleted: set = frozenset(), placeholders: list = ()):
+    # Flags the priorities of changed tunes (stale: user id -> tune ids) for rescoring, which a
+    # score_priorities job does once the change commits. Writes made with Core statements, like
+    # imports, call this themselves since mark_stale can't see them.
+    conn = session.connection()
+    placeholders = list(placeholders)
+    rescore = session.info.setdefault("rescore", set())
+    rescore.update(everything, (p["user_id"] for p in placeholders))
+    if deleted:
+        conn.execute(delete(PracticePriority).where(PracticePriority.tune_id.in_(deleted)))
+    for user_id in everything:
+        conn.execute(update(PracticePriority).where(PracticePriority.user_id == user_id).values(stale=True))
+    for user_id, tune_ids in stale.items():
+        tune_ids = set(tune_ids) - deleted
+        if not tune_ids:
+            continue
+        rescore.add(user_id)
+        if user_id not in everything:
+            conn.execute(
+                update(PracticePriority)
+                .where(PracticePriority.user_id == user_id, PracticePriority.tune_id.in_(tune_ids))
+                .values(stale=True)
+            )
+        # New tunes, and retired ones coming back, have no rows to flag yet
+        scored = set(conn.scalars(select(PracticePriority.tune_id).where(
+            PracticePriority.user_id == user_id, PracticePriority.tune_id.in_(tune_ids)
+        )))
+        placeholders += [{"user_id": user_id, "tune_id": t, "segment_id": None} for t in tune_ids - scored]
+    if placeholders:
+        conn.execute(insert(PracticePriority), [{**p, "score": 0, "stale": True} for p in placeholders])
+
+@event.listens_for(Session, "before_commit")
+def enqueue_rescore(session):
+    session.flush()   # the commit's own flush comes after this hook, what it marks stale is needed now
+    user_ids = session.info.pop("rescore", None)
+    if not user_ids:
+        return
+    import jobs   # jobs imports this module for its handler
+    for user_id in sorted(user_ids):
+        jobs.enqueue(session, "score_priorities", user_id=user_id, priority=jobs.PRIORITY_ON_DEMAND, owner_id=user_id)
+
+@event.listens_for(Session, "after_rollback")
+def discard_rescore(session):
+    session.info.pop("rescore", None)
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, field_validator
+from pydantic import BaseModel, Field, field_validator
 from datetime import datetime, date
 
 
@@ -38,6 +38,10 @@ class TokenResponse(BaseModel):
     access_token: str
     token_type: str = "bearer"
 
+class StorageUsage(BaseModel):
+    used_bytes: int
+    quota_bytes: int | None   # null when uploads are unlimited
+
 
 # --- Tunes ---
 
@@ -80,6 +84,7 @@ class TuneResponse(BaseModel):
     status: str
     notes: str | None
     created_at: datetime
+    updated_at: datetime | None = None
     recording_count: int = 0
 
     class Config:
@@ -88,6 +93,15 @@ class TuneResponse(BaseModel):
 
 # --- Recordings ---
 
+class RenditionResponse(BaseModel):
+    profile: str
+    bitrate: str | None
+    duration: float | None
+    file_size: int | None
+
+    class Config:
+        from_attributes = True
+
 class RecordingResponse(BaseModel):
     id: int
     tune_id: int
@@ -98,7 +112,33 @@ class RecordingResponse(BaseModel):
     description: str | None
     duration: float | None
     file_size: int | None
+    tempo_bpm: float | None = None
+    loudness_lufs: float | None = None
+    peak_db: float | None = None
+    gain_db: float | None = None    # apply on playback to even out levels between recordings
+    hls_ready: bool = False
+    created_at: datetime
+    updated_at: datetime | None = None
+    renditions: list[RenditionResponse] = []
+
+    class Config:
+        from_attributes = True
+
+
+# --- Jobs ---
+
+class JobResponse(BaseModel):
+    id: int
+    kind: str
+    status: str
+    priority: int
+    attempts: int
+    max_attempts: int
+    last_error: str | None
+    run_at: datetime
     created_at: datetime
+    started_at: datetime | None
+    finished_at: datetime | None
 
     class Config:
         from_attributes = True
@@ -128,12 +168,42 @@ class SegmentResponse(BaseModel):
     end_time: float
     color: str | None
     notes: str | None
+    tempo_bpm: float | None = None
+    loudness_lufs: float | None = None
+    peak_db: float | None = None
+    gain_db: float | None = None
     created_at: datetime
+    updated_at: datetime | None = None
 
     class Config:
         from_attributes = True
 
 
+class RecordingDetailResponse(RecordingResponse):
+    segments: list[SegmentResponse] = []
+
+class TuneDetailResponse(TuneResponse):
+    recordings: list[RecordingDetailResponse] = []
+
+
+class SegmentSuggestion(BaseModel):
+    label: str          # section letter, repeated sections share a letter
+    start_time: float
+    end_time: float
+    confidence: float   # boundary novelty, 0-1
+
+
+class RecordingMatch(BaseModel):
+    recording_id: int
+    tune_id: int
+    tune_title: str
+    original_name: str
+    offset_seconds: float   # this recording's start lines up with this point in the matched one (may be negative)
+    matching_hashes: int
+    coverage: float         # share of this recording's fingerprints found in the other, 0-1
+    duplicate: bool
+
+
 # --- Practice Sessions ---
 
 class PracticeEntryValidators(BaseModel):
@@ -195,12 +265,70 @@ class PracticeSessionResponse(BaseModel):
     duration_minutes: int | None
     notes: str | None
     created_at: datetime
+    updated_at: datetime | None = None
     entries: list[PracticeEntryResponse] = []
     
     class Config:
         from_attributes = True
 
 
+# --- Playback events ---
+
+class PlaybackEventCreate(BaseModel):
+    kind: str
+    recording_id: int
+    segment_id: int | None = None   # the segment being looped, if any
+    position: float = Field(ge=0, le=86400, allow_inf_nan=False)   # seconds into the recording
+    speed: float = Field(1.0, gt=0, le=4, allow_inf_nan=False)     # playbackRate, the players offer 0.25 to 2
+    played_seconds: float = 0       # playback time since this player's previous event
+    occurred_at: datetime           # with the player's UTC offset, which decides the rollup date
+
+    @field_validator("kind")
+    @classmethod
+    def validate_kind(cls, v):
+        allowed = { "play", "pause", "seek", "loop", "speed", "ramp", "ended" }
+        if v not in allowed:
+            raise ValueError(f"Kind must be one of: {', '.join(allowed)}")
+        return v
+
+    @field_validator("played_seconds")
+    @classmethod
+    def validate_played_seconds(cls, v):
+        if not 0 <= v <= 3600:
+            raise ValueError("played_seconds must be between 0 and 3600")
+        return v
+
+class PlaybackEventBatch(BaseModel):
+    events: list[PlaybackEventCreate]
+
+    @field_validator("events")
+    @classmethod
+    def batch_size(cls, v):
+        if len(v) > 1000:
+            raise ValueError("At most 1000 events per batch")
+        return v
+
+class PracticeRollupResponse(BaseModel):
+    date: date
+    recording_id: int
+    segment_id: int | None
+    seconds: float
+    loops: int
+    max_speed: float
+
+    class Config:
+        from_attributes = True
+
+
+class PracticeSuggestion(BaseModel):
+    tune_id: int
+    tune_title: str
+    segment_id: int | None
+    segment_label: str | None
+    score: float
+    reasons: list[str]
+
+
 # --- Performances ---
 
 class PerformanceCreate(BaseModel):
@@ -225,6 +353,7 @@ class PerformanceResponse(BaseModel):
     venue: str | None
     notes: str | None
     created_at: datetime
+    updated_at: datetime | None = None
 
     class Config:
         from_attributes = True
@@ -235,11 +364,15 @@ class PerformanceResponse(BaseModel):
 class SetlistEntryCreate(BaseModel):
     tune_id: int
     position: int
+    recording_id: int | None = None   # what the rehearsal plays, see models.SetlistEntry
+    segment_id: int | None = None
 
 class SetlistEntryResponse(BaseModel):
     id: int
     tune_id: int
     position: int
+    recording_id: int | None = None
+    segment_id: int | None = None
     tune_title: str = ""
 
     class Config:
@@ -262,7 +395,28 @@ class SetlistResponse(BaseModel):
     performance_id: int | None
     notes: str | None
     created_at: datetime
+    updated_at: datetime | None = None
     entries: list[SetlistEntryResponse] = []
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+
+# --- Sync ---
+
+class DeletedRow(BaseModel):
+    entity: str     # tune, recording, segment, session, performance, setlist
+    id: int
+
+class ChangeBatch(BaseModel):
+    tunes: list[TuneResponse] = []
+    recordings: list[RecordingResponse] = []
+    segments: list[SegmentResponse] = []
+    sessions: list[PracticeSessionResponse] = []
+    performances: list[PerformanceResponse] = []
+    setlists: list[SetlistResponse] = []
+    deleted: list[DeletedRow] = []
+
+class SyncResponse(ChangeBatch):
+    cursor: datetime    # pass back as ?since= on the next sync
+    reset: bool         # true when this is a full snapshot and the local replica should be replaced
@@ -0,0 +1,149 @@
+import logging
+import math
+import os
+import subprocess
+import sys
+import threading
+import time
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
+import uvicorn
+
+load_dotenv()
+
+# Production launcher: `python serve.py`. For development keep using `uvicorn main:app --reload`.
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", 8000))
+BACKLOG = int(os.getenv("BACKLOG", 2048))
+KEEPALIVE_SECONDS = int(os.getenv("KEEPALIVE_SECONDS", 75))   # longer than typical load balancer idle timeouts
+GRACEFUL_SHUTDOWN_SECONDS = int(os.getenv("GRACEFUL_SHUTDOWN_SECONDS", 30))
+# Workers restart after this many requests (plus jitter so they don't all restart together)
+MAX_REQUESTS = int(os.getenv("MAX_REQUESTS", 10000))
+MAX_REQUESTS_JITTER = int(os.getenv("MAX_REQUESTS_JITTER", 1000))
+DB_RESERVED_CONNECTIONS = int(os.getenv("DB_RESERVED_CONNECTIONS", 5))   # left for psql, migrations, other services
+THREADPOOL_SIZE = 40   # anyio's default, sync routes can't use more connections than this per worker
+JOB_WORKER_RESTART_MAX_SECONDS = 60   # backoff ceiling for a job worker that keeps exiting
+JOB_WORKER_HEALTHY_SECONDS = 60       # one that ran this long restarts without delay
+
+log = logging.getLogger("woodshed.serve")
+
+
+def available_cpus() -> int:
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    # Containers are usually limited by a cgroup quota rather than affinity
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+def max_connections() -> int | None:
+    url = os.getenv("DATABASE_URL", "")
+    if not url.startswith("postgresql"):
+        return None
+    try:
+        engine = create_engine(url, poolclass=NullPool)
+        with engine.connect() as conn:
+            total = int(conn.execute(text("SHOW max_connections")).scalar())
+            reserved = int(conn.execute(text("SHOW superuser_reserved_connections")).scalar())
+        engine.dispose()
+        return total - reserved
+    except Exception:
+        return None   # database not reachable yet, keep the per-process defaults
+
+def configure(workers: int, job_workers: int):
+    # Children inherit the environment, so this is how settings reach every worker
+    os.environ["JOB_WORKERS"] = str(job_workers)   # the job process pool the budget below assumes
+    limit = max_connections()
+    if limit is not None and "DB_POOL_SIZE" not in os.environ:
+        # The job worker holds one connection plus one per job process, each API worker
+        # one more for the change feed listener. The rest is split between API workers.
+        budget = limit - DB_RESERVED_CONNECTIONS - (job_workers + 1) - workers
+        per_worker = max(2, min(budget // workers, THREADPOOL_SIZE))
+        os.environ["DB_POOL_SIZE"] = str(max(1, per_worker // 2))
+        os.environ["DB_MAX_OVERFLOW"] = str(per_worker - per_worker // 2)
+    if workers > 1 and "CHANGEFEED_BROKER" not in os.environ and limit is not None:
+        os.environ["CHANGEFEED_BROKER"] = "postgres"   # a device's stream may be served by another worker
+
+
+class JobWorker:
+    # Keeps `python worker.py` running next to the server, restarting it whenever it exits
+    def __init__(self):
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._process = None
+        self._thread = threading.Thread(target=self._supervise, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            self._stop.set()
+            process = self._process
+        if process is not None:
+            process.terminate()   # SIGTERM: the worker finishes in-flight jobs before exiting
+            process.wait()
+        self._thread.join()
+
+    def _supervise(self):
+        delay = 1
+        while True:
+            with self._lock:
+                if self._stop.is_set():
+                    return
+                self._process = subprocess.Popen([sys.executable, "worker.py"])
+                started = time.monotonic()
+            code = self._process.wait()
+            if self._stop.is_set():
+                return
+            if time.monotonic() - started > JOB_WORKER_HEALTHY_SECONDS:
+                delay = 1
+            log.warning("Job worker exited with code %s, restarting in %ss", code, delay)
+            if self._stop.wait(delay):
+                return
+            delay = min(delay * 2, JOB_WORKER_RESTART_MAX_SECONDS)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    # SQLite installs get one API worker running jobs itself by default: there is no broker to carry
+    # the change feed between processes
+    sqlite = os.getenv("DATABASE_URL", "").startswith("sqlite")
+    workers = int(os.getenv("WEB_CONCURRENCY", 1 if sqlite else available_cpus()))
+    job_workers = int(os.getenv("JOB_WORKERS", max(1, available_cpus() // 2)))
+    configure(workers, job_workers)
+
+    # Once, before anything else connects, instead of in every worker as it starts
+    from database import engine, migrate   # after configure, which sets the pool size the engine is built with
+    migrate()
+    engine.dispose()
+    os.environ["SCHEMA_MIGRATION"] = "external"
+
+    # Unless told otherwise, jobs run in one worker process next to the server rather than inside every API worker
+    job_worker = None
+    if "JOB_WORKER" not in os.environ and not sqlite:
+        os.environ["JOB_WORKER"] = "external"
+        job_worker = JobWorker()
+        job_worker.start()
+    try:
+        uvicorn.run(
+            "main:app",
+            host=HOST,
+            port=PORT,
+            workers=workers,
+            loop="auto",    # uvloop and httptools when installed (see requirements.txt)
+            http="auto",
+            backlog=BACKLOG,
+            timeout_keep_alive=KEEPALIVE_SECONDS,
+            timeout_graceful_shutdown=GRACEFUL_SHUTDOWN_SECONDS,
+            limit_max_requests=MAX_REQUESTS or None,
+            limit_max_requests_jitter=MAX_REQUESTS_JITTER,
+        )
+    finally:
+        if job_worker:
+            job_worker.stop()
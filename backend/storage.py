@@ -0,0 +1,137 @@
+import os
+import re
+import shutil
+import time
+from sqlalchemy import select, update, or_
+from sqlalchemy.orm import Session
+from database import SessionLocal
+from models import User, Recording, Rendition, Setlist
+import analysis
+import media
+import pcm
+import rehearsal
+
+USER_QUOTA_MB = int(os.getenv("USER_QUOTA_MB", 0))   # 0 for no limit
+ORPHAN_GRACE_SECONDS = int(os.getenv("ORPHAN_GRACE_SECONDS", 6 * 3600))   # uploads and jobs still writing are younger than this
+RECONCILE_BATCH = 500
+DERIVED_DIRS = ("hls", "features", "pcm")   # entries named after the stem of the original's filename
+# What the app writes: uploads are stored as uuid4().hex plus the extension, and everything derived
+# from one starts with the same stem. The reconciler leaves anything else in UPLOAD_DIR alone.
+STORED_NAME = re.compile(r"[0-9a-f]{32}(\.[\w-]+)*")
+REHEARSAL_NAME = re.compile(r"\d+\.[0-9a-f]{32}\.m4a(\.\d+\.part)?")
+
+
+def quota_bytes() -> int | None:
+    return USER_QUOTA_MB * 1024 * 1024 if USER_QUOTA_MB else None
+
+def charge(db: Session, user_id: int, nbytes: int) -> bool:
+    # Adds to the user's usage in the caller's transaction. False, with nothing changed, when it
+    # would go over the quota; checking in the UPDATE keeps concurrent uploads from both fitting.
+    query = update(User).where(User.id == user_id)
+    if quota_bytes() is not None:
+        query = query.where(User.storage_bytes + nbytes <= quota_bytes())
+    result = db.execute(
+        query.values(storage_bytes=User.storage_bytes + nbytes).execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+def delete_recording_files(db: Session, recordings: list[Recording], upload_dir: str):
+    # Call before deleting the rows. Files a duplicate upload outside `recordings` still uses are
+    # kept, the rest are removed and their owners' usage goes down in the same transaction.
+    if not recordings:
+        return
+    still_used = set(db.scalars(select(Recording.filename).where(
+        Recording.filename.in_({r.filename for r in recordings}),
+        Recording.id.not_in([r.id for r in recordings]),
+    )))
+    released = set()
+    for recording in recordings:
+        if recording.filename in still_used or recording.filename in released:
+            continue
+        released.add(recording.filename)
+        filepath = os.path.join(upload_dir, recording.filename)
+        if os.path.exists(filepath):
+            os.remove(filepath)
+        media.delete_derived_files(recording, upload_dir)
+        analysis.delete_features(upload_dir, recording)
+        pcm.delete_pcm(upload_dir, recording)
+        db.execute(
+            update(User).where(User.id == recording.user_id)
+            .values(storage_bytes=User.storage_bytes - (recording.file_size or 0))
+            .execution_options(synchronize_session=False)
+        )
+
+
+# --- Reconciler ---
+
+def _stem(name: str) -> str:
+    return name.split(".", 1)[0]
+
+def _batches(directory: str, pattern: re.Pattern = STORED_NAME, files_only: bool = False):
+    # Streams the directory, yielding entries the app created and old enough to judge in batches
+    cutoff = time.time() - ORPHAN_GRACE_SECONDS
+    batch = []
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                if not pattern.fullmatch(entry.name):
+                    continue
+                try:
+                    if files_only and not entry.is_file(follow_symlinks=False):
+                        continue
+                    if entry.stat(follow_symlinks=False).st_mtime > cutoff:
+                        continue
+                except OSError:
+                    continue   # removed meanwhile
+                batch.append(entry)
+                if len(batch) >= RECONCILE_BATCH:
+                    yield batch
+                    batch = []
+    except FileNotFoundError:
+        return
+    if batch:
+        yield batch
+
+def _remove(entries) -> int:
+    removed = 0
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path)
+            else:
+                os.remove(entry.path)
+            removed += 1
+        except OSError:
+            pass
+    return removed
+
+def reconcile(upload_dir: str) -> int:
+    # Removes files no recording refers to: originals of deleted recordings, partial uploads,
+    # renditions, HLS chunks, caches and rehearsals left behind, and temporary files of interrupted jobs.
+    removed = 0
+    db = SessionLocal()
+    try:
+        for batch in _batches(upload_dir, files_only=True):
+            known = set(db.scalars(select(Recording.filename).where(Recording.filename.in_([e.name for e in batch]))))
+            removed += _remove(e for e in batch if e.name not in known)
+
+        for batch in _batches(media.rendition_dir(upload_dir)):
+            known = set(db.scalars(select(Rendition.filename).where(Rendition.filename.in_([e.name for e in batch]))))
+            removed += _remove(e for e in batch if e.name not in known)
+
+        for name in DERIVED_DIRS:
+            for batch in _batches(os.path.join(upload_dir, name)):
+                stems = {_stem(e.name) for e in batch}
+                known = {_stem(filename) for filename in db.scalars(select(Recording.filename).where(or_(
+                    Recording.filename.in_(stems),
+                    *(Recording.filename.startswith(f"{stem}.", autoescape=True) for stem in stems),
+                )))}
+                removed += _remove(e for e in batch if _stem(e.name) not in known or ".part" in e.name)
+
+        for batch in _batches(rehearsal.rehearsal_dir(upload_dir), REHEARSAL_NAME):
+            ids = {int(_stem(e.name)) for e in batch}
+            known = {str(i) for i in db.scalars(select(Setlist.id).where(Setlist.id.in_(ids)))}
+            removed += _remove(e for e in batch if _stem(e.name) not in known or ".part" in e.name)
+    finally:
+        db.close()
+    return removed
@@ -0,0 +1,164 @@
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import event, select, func, delete, true, update
+from sqlalchemy.orm import Session, selectinload
+from database import SessionLocal, statement_now
+from models import (
+    Tune, Recording, Segment, PracticeSession, PracticeEntry, Performance, Setlist, SetlistEntry, Tombstone
+)
+
+# Cursors are handed out this far behind the database clock, so a change stamped before a sync but committed
+# after it is sent next time. Clients apply rows idempotently. restamp_changes keeps commits within this bound.
+SYNC_OVERLAP_SECONDS = 5
+SYNC_RESTAMP_SECONDS = 1   # synced rows written longer than this before their commit are stamped again
+TOMBSTONE_RETENTION_DAYS = int(os.getenv("TOMBSTONE_RETENTION_DAYS", 90))
+
+SYNCED_MODELS = {
+    Tune: "tune",
+    Recording: "recording",
+    Segment: "segment",
+    PracticeSession: "session",
+    Performance: "performance",
+    Setlist: "setlist",
+}
+
+
+def owner_id(obj) -> int | None:
+    # Every synced model carries user_id, recordings and segments copy it from their tune
+    return obj.user_id
+
+@event.listens_for(Session, "before_flush")
+def track_changes(session, flush_context, instances):
+    # Deletes, including ORM cascades, leave a tombstone so delta syncs can remove the row
+    for obj in session.deleted:
+        entity = SYNCED_MODELS.get(type(obj))
+        if entity:
+            session.add(Tombstone(user_id=owner_id(obj), entity=entity, entity_id=obj.id))
+
+    # Entries are synced as part of their session or setlist, and tunes carry a recording count,
+    # so those changes bump the parent
+    for obj in [*session.new, *session.dirty, *session.deleted]:
+        if isinstance(obj, PracticeEntry):
+            parent = obj.session or session.get(PracticeSession, obj.session_id)
+        elif isinstance(obj, SetlistEntry):
+            parent = obj.setlist or session.get(Setlist, obj.setlist_id)
+        elif isinstance(obj, Recording) and obj not in session.dirty:
+            parent = obj.tune or session.get(Tune, obj.tune_id)
+        else:
+            continue
+        if parent is not None and parent not in session.deleted:
+            parent.updated_at = statement_now()
+
+@event.listens_for(Session, "after_flush")
+def collect_written(session, flush_context):
+    # ORM writes only: Core writes (library imports) commit straight after their statements
+    written = session.info.setdefault("sync_written", {})
+    for obj in [*session.new, *session.dirty]:
+        if type(obj) in SYNCED_MODELS or type(obj) is Tombstone:
+            written.setdefault(type(obj), set()).add(obj.id)
+    if written:
+        session.info.setdefault("sync_written_at", time.monotonic())
+
+@event.listens_for(Session, "before_commit")
+def restamp_changes(session):
+    # A change stamped long before its commit, say by a job holding its session open while ffmpeg
+    # runs, would already be behind the cursor of a sync made meanwhile. Stamping it again at commit
+    # bounds the gap, so SYNC_OVERLAP_SECONDS covers it.
+    session.flush()   # the commit's own flush comes after this hook
+    written = session.info.pop("sync_written", None)
+    written_at = session.info.pop("sync_written_at", None)
+    if not written or time.monotonic() - written_at < SYNC_RESTAMP_SECONDS:
+        return
+    for model, ids in written.items():
+        column = "deleted_at" if model is Tombstone else "updated_at"
+        session.execute(
+            update(model).where(model.id.in_(ids)).values({column: statement_now()}),
+            execution_options={"synchronize_session": False},
+        )
+
+@event.listens_for(Session, "after_rollback")
+def discard_written(session):
+    session.info.pop("sync_written", None)
+    session.info.pop("sync_written_at", None)
+
+def _entry_response(entry) -> dict:
+    return {**entry.__dict__, "tune_title": entry.tune.title if entry.tune else ""}
+
+def _collect(db: Session, user_id: int, filters: dict) -> dict:
+    # filters maps each synced model to a WHERE clause selecting the rows to send
+    def rows(model, query):
+        if model not in filters:
+            return []
+        return db.scalars(query.where(filters[model])).all()
+
+    tunes = rows(Tune, select(Tune).where(Tune.user_id == user_id).options(selectinload(Tune.recordings)))
+    recordings = rows(Recording, (
+        select(Recording).where(Recording.user_id == user_id).options(selectinload(Recording.renditions))
+    ))
+    segments = rows(Segment, select(Segment).where(Segment.user_id == user_id))
+    sessions = rows(PracticeSession, (
+        select(PracticeSession).where(PracticeSession.user_id == user_id)
+        .options(selectinload(PracticeSession.entries).selectinload(PracticeEntry.tune))
+    ))
+    performances = rows(Performance, select(Performance).where(Performance.user_id == user_id))
+    setlists = rows(Setlist, (
+        select(Setlist).where(Setlist.user_id == user_id)
+        .options(selectinload(Setlist.entries).selectinload(SetlistEntry.tune))
+    ))
+    return {
+        "tunes": [{**t.__dict__, "recording_count": len(t.recordings)} for t in tunes],
+        "recordings": recordings,
+        "segments": segments,
+        "sessions": [
+            {**s.__dict__, "entries": [_entry_response(e) for e in s.entries]} for s in sessions
+        ],
+        "performances": performances,
+        "setlists": [
+            {**s.__dict__, "entries": [_entry_response(e) for e in s.entries]} for s in setlists
+        ],
+    }
+
+def changes_since(db: Session, user_id: int, since: datetime | None) -> dict:
+    cursor = db.scalar(select(func.now()))
+    if cursor.tzinfo is None:
+        cursor = cursor.replace(tzinfo=timezone.utc)   # SQLite reports naive UTC
+    if since is not None:
+        since = since.replace(tzinfo=timezone.utc) if since.tzinfo is None else since.astimezone(timezone.utc)
+    # A cursor older than the tombstone retention could miss deletes, so the client gets a full snapshot
+    reset = since is None or since < cursor - timedelta(days=TOMBSTONE_RETENTION_DAYS)
+
+    filters = {model: true() if reset else model.updated_at > since for model in SYNCED_MODELS}
+    deleted = [] if reset else db.execute(
+        select(Tombstone.entity, Tombstone.entity_id)
+        .where(Tombstone.user_id == user_id, Tombstone.deleted_at > since)
+        .order_by(Tombstone.id)
+    ).all()
+    return {
+        "cursor": cursor - timedelta(seconds=SYNC_OVERLAP_SECONDS),
+        "reset": reset,
+        **_collect(db, user_id, filters),
+        "deleted": [{"entity": entity, "id": entity_id} for entity, entity_id in deleted],
+    }
+
+def load_changes(db: Session, user_id: int, changes: list[dict]) -> dict:
+    # Hydrates change notifications ({"entity", "id", "op"}) into the /api/sync payload shape
+    models = {entity: model for model, entity in SYNCED_MODELS.items()}
+    upserted = {}
+    deleted = []
+    for change in changes:
+        if change["op"] == "delete":
+            deleted.append({"entity": change["entity"], "id": change["id"]})
+        else:
+            upserted.setdefault(models[change["entity"]], set()).add(change["id"])
+    filters = {model: model.id.in_(ids) for model, ids in upserted.items()}
+    return {**_collect(db, user_id, filters), "deleted": deleted}
+
+def prune_tombstones():
+    db = SessionLocal()
+    try:
+        cutoff = datetime.now(timezone.utc) - timedelta(days=TOMBSTONE_RETENTION_DAYS)
+        db.execute(delete(Tombstone).where(Tombstone.deleted_at < cutoff))
+        db.commit()
+    finally:
+        db.close()
@@ -0,0 +1,42 @@
+import os
+import sys
+import tempfile
+import uuid
+import pytest
+
+# The app reads its settings at import, so the database and upload directory are set up first.
+# TEST_DATABASE_URL runs the suite against another database, e.g. a scratch Postgres.
+_tmp = tempfile.mkdtemp(prefix="woodshed-tests-")
+os.environ["DATABASE_URL"] = os.getenv("TEST_DATABASE_URL", f"sqlite:///{_tmp}/woodshed.db")
+os.environ["UPLOAD_DIR"] = os.path.join(_tmp, "uploads")
+os.environ["JOB_WORKER"] = "external"   # tests run the jobs they need themselves
+os.environ["SCHEMA_MIGRATION"] = "external"
+os.environ["SECRET_KEY"] = "woodshed-test-secret-key-of-32-bytes"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+import database
+
+database.migrate()
+
+import main
+from auth import decode_access_token
+
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(main.app) as c:
+        yield c
+
+@pytest.fixture
+def user(client):
+    # A fresh account per test: {"id", "token", "headers"}
+    username = f"user-{uuid.uuid4().hex[:12]}"
+    response = client.post("/api/register", json={"username": username, "password": "password1"})
+    assert response.status_code == 201, response.text
+    token = client.post("/api/login", json={"username": username, "password": "password1"}).json()["access_token"]
+    return {"id": decode_access_token(token), "token": token, "headers": {"Authorization": f"Bearer {token}"}}
+
+@pytest.fixture(scope="session")
+def upload_dir():
+    return main.UPLOAD_DIR
@@ -0,0 +1,19 @@
+import admission
+
+ORIGIN = "http://localhost:5173"
+
+
+def test_shed_request_has_cors_headers(client, user, monkeypatch):
+    full = admission.Gate("full", limit=1, queue=0)
+    full.running = 1
+    monkeypatch.setattr(admission, "gates", {name: full for name in admission.gates})
+
+    response = client.get("/api/tunes", headers={**user["headers"], "Origin": ORIGIN})
+    assert response.status_code == 503
+    assert response.headers["access-control-allow-origin"] == ORIGIN
+    assert response.headers["retry-after"] == str(admission.ADMISSION_RETRY_AFTER)
+
+    # Preflights are answered before admission
+    preflight = client.options("/api/tunes", headers={"Origin": ORIGIN, "Access-Control-Request-Method": "GET"})
+    assert preflight.status_code == 200
+    assert full.shed == 1
@@ -0,0 +1,157 @@
+import uuid
+import numpy as np
+import pytest
+from database import SessionLocal
+from models import Recording, Tune
+import analysis
+
+SAMPLE_RATE = analysis.ANALYSIS_SAMPLE_RATE
+
+
+def _clicks(bpm: float, seconds: float = 30) -> np.ndarray:
+    # 10 ms windowed 1 kHz blips on every beat
+    samples = np.zeros(int(seconds * SAMPLE_RATE), np.float32)
+    n = int(0.01 * SAMPLE_RATE)
+    click = np.sin(2 * np.pi * 1000 * np.arange(n) / SAMPLE_RATE) * np.hanning(n)
+    for beat in np.arange(0, seconds - 0.02, 60 / bpm):
+        start = int(beat * SAMPLE_RATE)
+        samples[start:start + n] += click
+    return samples
+
+
+@pytest.mark.parametrize("bpm", [100, 132, 75])
+def test_tempo_of_a_click_track(bpm):
+    assert analysis.estimate_tempo(analysis.onset_envelope(_clicks(bpm))) == pytest.approx(bpm, abs=1)
+
+def test_tempo_needs_enough_to_go_on():
+    assert analysis.estimate_tempo(analysis.onset_envelope(_clicks(120, seconds=3))) is None
+    assert analysis.estimate_tempo(analysis.onset_envelope(np.zeros(10 * SAMPLE_RATE, np.float32))) is None
+    assert len(analysis.onset_envelope(np.zeros(100, np.float32))) == 0   # shorter than one STFT frame
+
+def test_onset_envelope_does_not_depend_on_block_boundaries(monkeypatch):
+    samples = _clicks(100, seconds=10)
+    whole = analysis.onset_envelope(samples)
+    monkeypatch.setattr(analysis, "BLOCK_FRAMES", 37)
+    np.testing.assert_allclose(analysis.onset_envelope(samples), whole, rtol=1e-5, atol=1e-4)
+
+def _chord(frequencies: list[float], seconds: float) -> np.ndarray:
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    return (0.3 * sum(np.sin(2 * np.pi * f * t) for f in frequencies) / len(frequencies)).astype(np.float32)
+
+def _aaba() -> dict:
+    # 20 s sections, C major for the A sections and F# major for the bridge
+    a, b = _chord([261.63, 329.63, 392.0], 20), _chord([185.0, 233.08, 277.18], 20)
+    return analysis.extract_features(np.concatenate([a, a, b, a]))
+
+
+def test_self_similarity_and_novelty_of_a_section_change():
+    features = _aaba()
+    frame_seconds = features["frame_seconds"]
+    similarity = analysis.self_similarity(features)
+    assert similarity.shape == (len(features["chroma"]),) * 2
+    np.testing.assert_allclose(np.diag(similarity), 1, atol=1e-5)
+    frame = lambda seconds: int(seconds / frame_seconds)
+    assert similarity[frame(10), frame(70)] > 0.9 > similarity[frame(10), frame(50)]   # the head returns, the bridge differs
+
+    novelty = analysis.novelty_curve(similarity, int(round(analysis.NOVELTY_KERNEL_SECONDS / frame_seconds)))
+    strongest = sorted(np.argsort(-novelty)[:2] * frame_seconds)
+    assert strongest == pytest.approx([40, 60], abs=1)
+    assert novelty[frame(20)] < 0.1 * novelty.max()   # a repeated section is not a boundary
+
+def test_suggested_sections_letter_a_returning_head():
+    suggestions = analysis.suggest_segments(_aaba())
+    assert [s["label"] for s in suggestions] == ["A", "B", "A"]
+    assert [s["start_time"] for s in suggestions] == pytest.approx([0, 40, 60], abs=1)
+    assert suggestions[-1]["end_time"] == pytest.approx(80, abs=1)
+
+def test_suggested_sections_respect_the_minimum_length():
+    suggestions = analysis.suggest_segments(_aaba(), min_length=30)
+    assert [s["start_time"] for s in suggestions] == pytest.approx([0, 40], abs=1)
+    assert analysis.suggest_segments(analysis.extract_features(_chord([440], 1))) == []
+
+def _sine(dbfs: float, seconds: float, frequency: float = 1000) -> np.ndarray:
+    # The same tone in both channels, at the loudness measurement rate
+    t = np.arange(int(seconds * analysis.LOUDNESS_SAMPLE_RATE)) / analysis.LOUDNESS_SAMPLE_RATE
+    tone = 10 ** (dbfs / 20) * np.sin(2 * np.pi * frequency * t)
+    return np.stack([tone, tone], axis=1).astype(np.float32)
+
+class _Measured:
+    pass
+
+
+def test_loudness_of_a_stereo_sine():
+    # BS.1770 calibration: a 1 kHz sine at -20 dBFS in both channels reads -20 LUFS
+    steps = analysis.loudness_steps(_sine(-20, 10))
+    measured = _Measured()
+    analysis.measure_loudness(measured, steps)
+    assert measured.loudness_lufs == pytest.approx(-19.99, abs=0.05)
+    assert measured.peak_db == pytest.approx(-20, abs=0.01)
+    assert measured.gain_db == pytest.approx(analysis.LOUDNESS_TARGET_LUFS + 20, abs=0.05)
+
+def test_loudness_gates_quiet_passages():
+    steps = analysis.loudness_steps(np.concatenate([_sine(-20, 10), _sine(-50, 10)]))
+    assert analysis.integrated_loudness(steps["power"]) == pytest.approx(-20, abs=0.1)
+    segment = _Measured()
+    analysis.measure_loudness(segment, steps, start=12, end=18)   # only the quiet half
+    assert segment.loudness_lufs == pytest.approx(-50, abs=0.1)
+    assert analysis.integrated_loudness(analysis.loudness_steps(np.zeros((48000, 2), np.float32))["power"]) is None
+
+def test_gain_stops_below_the_peak_ceiling():
+    frames = _sine(-30, 10)
+    frames[len(frames) // 2] = 1.0   # one full-scale click
+    measured = _Measured()
+    analysis.measure_loudness(measured, analysis.loudness_steps(frames))
+    assert measured.peak_db == 0
+    assert measured.gain_db == analysis.PEAK_CEILING_DB
+
+def _melody(seed: int, seconds: float = 40) -> np.ndarray:
+    # A random tune of quarter-second notes with a second harmonic, at the analysis rate
+    rng = np.random.default_rng(seed)
+    n = int(0.25 * SAMPLE_RATE)
+    t, envelope = np.arange(n) / SAMPLE_RATE, np.hanning(n)
+    notes = []
+    for _ in range(int(seconds / 0.25)):
+        f = 220 * 2 ** (rng.integers(0, 36) / 12)
+        notes.append(envelope * (np.sin(2 * np.pi * f * t) + 0.5 * np.sin(4 * np.pi * f * t)))
+    return (0.3 * np.concatenate(notes)).astype(np.float32)
+
+def _noisy(samples: np.ndarray, seed: int) -> np.ndarray:
+    return (samples + 0.01 * np.random.default_rng(seed).standard_normal(len(samples))).astype(np.float32)
+
+
+def test_landmark_hashes_pack_both_bins_and_the_gap():
+    peaks = np.array([[0, 10], [3, 20], [70, 30], [71, 511]])
+    hashes, anchors = analysis.landmark_hashes(peaks)
+    pairs = {(int(h) >> 15, (int(h) >> 6) & 0x1FF, int(h) & 0x3F, int(a)) for h, a in zip(hashes, anchors)}
+    # 3 -> 70 is further apart than MAX_PAIR_FRAMES, so only neighbours within it pair up
+    assert pairs == {(10, 20, 3, 0), (30, 511, 1, 70)}
+
+def test_fingerprints_find_shared_material(user, monkeypatch):
+    tune = _melody(1)
+    samples = {
+        "take.wav": tune,
+        "excerpt.wav": _noisy(tune[5 * SAMPLE_RATE:25 * SAMPLE_RATE], 2),   # the same take from 5 s in
+        "copy.wav": 0.5 * tune,   # 6 dB quieter
+        "other.wav": _melody(4),
+    }
+    monkeypatch.setattr(analysis, "analysis_samples", lambda upload_dir, recording: samples[recording.original_name])
+    with SessionLocal() as db:
+        song = Tune(user_id=user["id"], title="Fingerprinted")
+        db.add(song)
+        db.flush()
+        recordings = {
+            name: Recording(user_id=user["id"], tune_id=song.id, filename=f"{uuid.uuid4().hex}.wav", original_name=name, content_hash=name)
+            for name in samples
+        }
+        db.add_all(recordings.values())
+        db.commit()
+        ids = {name: r.id for name, r in recordings.items()}
+    for recording_id in ids.values():
+        analysis.fingerprint_recording(recording_id, "unused")
+
+    with SessionLocal() as db:
+        matches = {m["recording_id"]: m for m in analysis.find_matches(db, db.get(Recording, ids["take.wav"]))}
+    assert set(matches) == {ids["copy.wav"], ids["excerpt.wav"]}
+    copy, excerpt = matches[ids["copy.wav"]], matches[ids["excerpt.wav"]]
+    assert copy["duplicate"] and copy["offset_seconds"] == pytest.approx(0, abs=0.05)
+    assert not excerpt["duplicate"] and excerpt["offset_seconds"] == pytest.approx(-5, abs=0.05)
@@ -0,0 +1,87 @@
+import json
+from datetime import date
+import pytest
+from sqlalchemy import select
+from database import SessionLocal
+from models import PracticeSession, Tune
+import changefeed
+import jobs
+
+
+@pytest.fixture
+def published(monkeypatch):
+    recorder = changefeed.Recorder()
+    monkeypatch.setattr(changefeed, "broker", recorder)
+    return recorder.published
+
+def _changes(published, user_id: int) -> set[tuple]:
+    return {(c["entity"], c["op"]) for owner, changes in published if owner == user_id for c in changes}
+
+
+def test_import_publishes_changes(client, user, published):
+    with SessionLocal() as db:
+        db.add(PracticeSession(user_id=user["id"], date=date(2026, 1, 1)))
+        db.commit()
+        existing = db.scalar(select(PracticeSession.id).where(PracticeSession.user_id == user["id"]))
+    body = "\n".join(json.dumps(r) for r in [
+        {"type": "tune", "id": 1, "title": "Imported"},
+        {"type": "entry", "session_id": existing, "tune_id": 1},
+    ])
+    published.clear()
+    response = client.post("/api/import", content=body, headers=user["headers"])
+    assert response.status_code == 200, response.text
+    assert response.json()["imported"]["entry"] == 1
+    tune_id = client.get("/api/tunes", headers=user["headers"]).json()[0]["id"]
+    changes = [c for owner, batch in published if owner == user["id"] for c in batch]
+    assert {"entity": "tune", "id": tune_id, "op": "upsert"} in changes
+    assert {"entity": "session", "id": existing, "op": "upsert"} in changes
+
+def test_job_changes_are_returned_for_the_worker_to_publish(user, published, monkeypatch):
+    with SessionLocal() as db:
+        tune = Tune(user_id=user["id"], title="Before")
+        db.add(tune)
+        db.commit()
+        tune_id = tune.id
+
+    def rename(tune_id: int, upload_dir: str):
+        with SessionLocal() as db:
+            db.get(Tune, tune_id).title = "After"
+            db.commit()
+
+    monkeypatch.setitem(jobs.HANDLERS, "rename", rename)
+    published.clear()
+    recorded = jobs.run("rename", {"tune_id": tune_id}, "uploads")
+    assert not published
+    assert recorded == [(user["id"], [{"entity": "tune", "id": tune_id, "op": "upsert"}])]
+    changefeed.publish_recorded(recorded)
+    assert _changes(published, user["id"]) == {("tune", "upsert")}
+
+class NotifyingBroker(changefeed.Recorder):
+    # Records what a transactional broker is asked to send, and whether the commit was still open
+    transactional = True
+
+    def notify(self, conn, user_id: int, changes: list[dict]):
+        self.published.append((user_id, changes))
+        self.in_transaction = conn.in_transaction()
+
+def test_transactional_broker_notifies_on_the_committing_connection(user, monkeypatch):
+    broker = NotifyingBroker()
+    monkeypatch.setattr(changefeed, "broker", broker)
+    with SessionLocal() as db:
+        db.add(Tune(user_id=user["id"], title="Unflushed"))   # flushed by the commit itself
+        db.commit()
+        tune_id = db.scalar(select(Tune.id).where(Tune.user_id == user["id"]))
+        assert broker.published == [(user["id"], [{"entity": "tune", "id": tune_id, "op": "upsert"}])]
+        assert broker.in_transaction
+
+    # Jobs send their own notifications, nothing is left for the worker
+    broker.published.clear()
+
+    def rename(tune_id: int, upload_dir: str):
+        with SessionLocal() as db:
+            db.get(Tune, tune_id).title = "Renamed"
+            db.commit()
+
+    monkeypatch.setitem(jobs.HANDLERS, "rename", rename)
+    assert jobs.run("rename", {"tune_id": tune_id}, "uploads") == []
+    assert _changes(broker.published, user["id"]) == {("tune", "upsert")}
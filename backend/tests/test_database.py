@@ -0,0 +1,31 @@
+import pytest
+from sqlalchemy import text
+import database
+
+
+@pytest.mark.parametrize("statement, verb", [
+    ("SELECT 1", "SELECT"),
+    ("  select id FROM tunes", "SELECT"),
+    ("-- why\n/* how */ INSERT INTO tunes VALUES (1)", "INSERT"),
+    ("(SELECT 1) UNION (SELECT 2)", "SELECT"),
+    ("WITH recent AS (SELECT id FROM tunes WHERE title = 'DELETE') SELECT * FROM recent", "SELECT"),
+    ("WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n) SELECT x FROM n", "SELECT"),
+    ('WITH "update" AS MATERIALIZED (SELECT 1), b AS (SELECT 2) DELETE FROM tunes', "DELETE"),
+    ("WITH gone AS (SELECT id FROM tunes) UPDATE tunes SET status = 'x' WHERE id IN gone", "UPDATE"),
+    ("CREATE TABLE t (x)", "CREATE"),
+    ("", None),
+    ("   \n", None),
+    ("-- nothing but a comment", None),
+])
+def test_sql_verb(statement, verb):
+    assert database._sql_verb(statement) == verb
+
+@pytest.mark.skipif(database.engine.dialect.name != "sqlite", reason="SQLite's write lock")
+def test_only_writes_take_the_sqlite_write_lock():
+    with database.engine.connect() as conn:
+        dbapi_connection = conn.connection.driver_connection
+        conn.execute(text("WITH one AS (SELECT 1 AS x) SELECT x FROM one"))
+        assert not dbapi_connection.in_transaction   # a read, on its own snapshot
+        conn.execute(text("WITH one AS (SELECT 1 AS x) UPDATE users SET username = username WHERE id IN (SELECT x FROM one)"))
+        assert dbapi_connection.in_transaction
+        conn.rollback()
@@ -0,0 +1,58 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+import pytest
+from pydantic import ValidationError
+from sqlalchemy import insert, text
+from database import engine, SessionLocal
+from models import PlaybackEvent, Recording, Tune
+from schemas import PlaybackEventCreate
+import events
+
+
+def test_events_outside_the_accepted_range_are_rejected(client, user):
+    with SessionLocal() as db:
+        tune = Tune(user_id=user["id"], title="Reel")
+        db.add(tune)
+        db.flush()
+        recording = Recording(user_id=user["id"], tune_id=tune.id, filename=f"{uuid.uuid4().hex}.mp3", original_name="take.mp3")
+        db.add(recording)
+        db.commit()
+        recording_id = recording.id
+    now = datetime.now(timezone.utc)
+    late = now - timedelta(days=events.EVENT_RETENTION_DAYS + 1)
+    for occurred_at, status in ((now, 202), (now.replace(tzinfo=None), 202), (now + timedelta(days=30), 422), (late, 422)):
+        event = {"kind": "play", "recording_id": recording_id, "position": 0, "occurred_at": occurred_at.isoformat()}
+        response = client.post("/api/events", json={"events": [event]}, headers=user["headers"])
+        assert response.status_code == status, (occurred_at, response.text)
+
+@pytest.mark.skipif(engine.dialect.name != "postgresql", reason="event partitions are Postgres only")
+def test_partition_takes_over_rows_from_the_default():
+    table = PlaybackEvent.__tablename__
+    start = events._month(datetime.now(timezone.utc).date(), events.EVENT_PARTITION_MONTHS_AHEAD)
+    name = f"{table}_{start:%Y_%m}"
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {name}"))
+        conn.execute(insert(PlaybackEvent.__table__), [{
+            "user_id": 0, "recording_id": 0, "kind": "play", "position": 0, "speed": 1, "played_seconds": 0,
+            "occurred_at": datetime(start.year, start.month, 2, tzinfo=timezone.utc),
+        }])
+    events.maintain_partitions()
+    with engine.connect() as conn:
+        assert conn.execute(text(f"SELECT count(*) FROM {name}")).scalar() == 1
+        assert conn.execute(text(f"SELECT count(*) FROM {table}_default WHERE user_id = 0")).scalar() == 0
+
+@pytest.mark.parametrize("fields, valid", [
+    ({"position": 0, "speed": 0.25}, True),
+    ({"position": 5400.5, "speed": 2}, True),
+    ({"position": -1}, False),
+    ({"position": 10 ** 9}, False),
+    ({"position": 0, "speed": 0}, False),
+    ({"position": 0, "speed": 16}, False),
+])
+def test_event_speed_and_position_are_bounded(fields, valid):
+    event = {"kind": "loop", "recording_id": 1, "occurred_at": datetime.now(timezone.utc).isoformat(), **fields}
+    if valid:
+        PlaybackEventCreate.model_validate(event)
+    else:
+        with pytest.raises(ValidationError):
+            PlaybackEventCreate.model_validate(event)
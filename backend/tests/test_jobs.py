@@ -0,0 +1,114 @@
+import threading
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+import pytest
+from sqlalchemy import delete, insert
+from sqlalchemy.exc import IntegrityError
+from database import SessionLocal
+from models import Job
+import jobs
+import worker
+
+
+@pytest.fixture(autouse=True)
+def empty_queue():
+    with SessionLocal() as db:
+        db.execute(delete(Job))
+        db.commit()
+
+
+def test_enqueue_dedupes_active_jobs():
+    with SessionLocal() as db:
+        first = jobs.enqueue(db, "package_hls", recording_id=1)
+        second = jobs.enqueue(db, "package_hls", priority=jobs.PRIORITY_ON_DEMAND, recording_id=1)
+        db.commit()
+        assert second.id == first.id
+        assert first.priority == jobs.PRIORITY_ON_DEMAND
+
+def test_active_dedupe_key_is_unique():
+    # A concurrent enqueue that missed the first job's row still can't insert a second one
+    row = {"kind": "package_hls", "payload": {}, "dedupe_key": "package_hls:{}", "status": "queued"}
+    with SessionLocal() as db:
+        db.execute(insert(Job), [row, {**row, "status": "succeeded"}])
+        db.commit()
+        with pytest.raises(IntegrityError):
+            db.execute(insert(Job), [{**row, "status": "running"}])
+        db.rollback()
+
+def test_enqueue_recovers_from_a_concurrent_insert(monkeypatch):
+    with SessionLocal() as db:
+        other = jobs.enqueue(db, "package_hls", recording_id=2)
+        db.commit()
+        # the first lookup misses, as if the other job was inserted right after it
+        lookups = []
+        real_active = jobs._active
+        monkeypatch.setattr(jobs, "_active", lambda db, key: real_active(db, key) if lookups.append(key) or len(lookups) > 1 else None)
+        assert jobs.enqueue(db, "package_hls", recording_id=2).id == other.id
+        assert len(lookups) == 2
+        db.commit()
+
+def test_requeue_stale_fails_jobs_out_of_attempts():
+    started = jobs._now() - timedelta(seconds=jobs.JOB_TIMEOUT_SECONDS + 60)
+    with SessionLocal() as db:
+        retry, spent = (
+            Job(kind="package_hls", payload={"recording_id": n}, status="running", attempts=attempts, max_attempts=3, started_at=started)
+            for n, attempts in ((1, 1), (2, 3))
+        )
+        db.add_all([retry, spent])
+        db.commit()
+        jobs.requeue_stale()
+        db.refresh(retry)
+        db.refresh(spent)
+        assert retry.status == "queued"
+        assert spent.status == "failed" and spent.finished_at is not None
+
+
+class FakePool:
+    # Runs jobs inline; the first pool breaks on its first submit like a pool whose process was killed
+    created = 0
+
+    def __init__(self):
+        FakePool.created += 1
+        self.broken = FakePool.created == 1
+
+    def submit(self, fn, *args):
+        if self.broken:
+            raise BrokenProcessPool("A process in the process pool was terminated abruptly")
+        future = Future()
+        future.set_result(None)
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+def test_worker_survives_errors_and_rebuilds_a_broken_pool(monkeypatch):
+    FakePool.created = 0
+    stop = threading.Event()
+    calls = {"claim": 0}
+    monkeypatch.setattr(worker, "JOB_POLL_SECONDS", 0.001)
+    monkeypatch.setattr(worker, "_new_pool", lambda max_workers: FakePool())
+    monkeypatch.setattr(worker.events, "maintain_partitions", lambda: 1 / 0)
+    with SessionLocal() as db:
+        job_id = jobs.enqueue(db, "package_hls", recording_id=3).id
+        db.commit()
+    real_claim = jobs.claim
+
+    def claim(worker_id):
+        calls["claim"] += 1
+        if calls["claim"] == 1:
+            raise ConnectionError("database went away")
+        if calls["claim"] > 20:
+            stop.set()
+        return real_claim(worker_id)
+
+    monkeypatch.setattr(jobs, "claim", claim)
+    monkeypatch.setattr(jobs, "JOB_RETRY_BASE_SECONDS", 0)
+    thread = threading.Thread(target=worker.run_worker, args=(stop, 1, "uploads"))
+    thread.start()
+    thread.join(10)
+    assert not thread.is_alive()
+    assert FakePool.created == 2
+    with SessionLocal() as db:
+        job = db.get(Job, job_id)
+        assert job.status == "succeeded" and job.attempts == 2
@@ -0,0 +1,86 @@
+import io
+import json
+import os
+import uuid
+import zipfile
+from sqlalchemy import select
+from database import SessionLocal
+from models import Recording, Segment, SetlistEntry, Tune
+import library
+
+
+def _library(user_id: int, upload_dir: str) -> dict:
+    # Two tunes, the first with a recording and a segment. The recording's file was uploaded twice.
+    os.makedirs(upload_dir, exist_ok=True)
+    filename = f"{uuid.uuid4().hex}.mp3"
+    with open(os.path.join(upload_dir, filename), "wb") as f:
+        f.write(b"audio")
+    with SessionLocal() as db:
+        first, second = Tune(user_id=user_id, title="First"), Tune(user_id=user_id, title="Second")
+        db.add_all([first, second])
+        db.flush()
+        recordings = [
+            Recording(user_id=user_id, tune_id=first.id, filename=filename, original_name=f"take{n}.mp3") for n in range(2)
+        ]
+        db.add_all(recordings)
+        db.flush()
+        segment = Segment(user_id=user_id, recording_id=recordings[0].id, label="A", start_time=0, end_time=5)
+        db.add(segment)
+        db.commit()
+        return {"tunes": [first.id, second.id], "recording": recordings[0].id, "segment": segment.id, "filename": filename}
+
+def _import(client, user, records: list[dict]):
+    body = "\n".join(json.dumps(r) for r in records)
+    return client.post("/api/import", content=body, headers=user["headers"])
+
+
+def test_export_zip_writes_shared_files_once(client, user, upload_dir):
+    stored = _library(user["id"], upload_dir)
+    response = client.get("/api/export?format=zip", headers=user["headers"])
+    assert response.status_code == 200
+    names = zipfile.ZipFile(io.BytesIO(response.content)).namelist()
+    assert names.count(f"audio/{stored['filename']}") == 1
+
+def test_import_rejects_invalid_utf8(client, user):
+    body = json.dumps({"type": "tune", "title": "Fine"}).encode() + b"\n" + b'{"type": "tune", "title": "\xff"}\n'
+    response = client.post("/api/import", content=body, headers=user["headers"])
+    assert response.status_code == 400
+    assert "Line 2" in response.json()["detail"]
+    with SessionLocal() as db:
+        assert db.scalars(select(Tune.title).where(Tune.user_id == user["id"])).all() == ["Fine"]
+
+def test_import_checks_setlist_entry_sources_belong_to_the_tune(client, user, upload_dir):
+    stored = _library(user["id"], upload_dir)
+    first, second = stored["tunes"]
+    response = _import(client, user, [
+        {"type": "setlist", "id": 1, "title": "Gig"},
+        {"type": "setlist_entry", "setlist_id": 1, "position": 0, "tune_id": first, "segment_id": stored["segment"]},
+        {"type": "setlist_entry", "setlist_id": 1, "position": 0, "tune_id": first, "recording_id": stored["recording"]},
+        {"type": "setlist_entry", "setlist_id": 1, "position": 0, "tune_id": second, "segment_id": stored["segment"]},
+        {"type": "setlist_entry", "setlist_id": 1, "position": 0, "tune_id": second, "recording_id": stored["recording"]},
+    ])
+    assert response.status_code == 200, response.text
+    summary = response.json()
+    assert summary["imported"]["setlist_entry"] == 2
+    assert [e["line"] for e in summary["errors"]] == [4, 5]
+    with SessionLocal() as db:
+        assert set(db.scalars(select(SetlistEntry.tune_id).where(SetlistEntry.tune_id.in_(stored["tunes"])))) == {first}
+
+def test_import_streams_progress_per_batch(client, user, monkeypatch):
+    monkeypatch.setattr(library, "IMPORT_BATCH_SIZE", 2)
+    body = "\n".join(json.dumps({"type": "tune", "title": f"Tune {n}"}) for n in range(5))
+    headers = {**user["headers"], "Accept": "application/x-ndjson"}
+    response = client.post("/api/import", content=body, headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [(line["status"], line["imported"]["tune"]) for line in lines] == [("importing", 2), ("importing", 4), ("done", 5)]
+    assert lines[-1]["errors"] == [] and "errors" not in lines[0]
+
+def test_import_stream_ends_with_the_encoding_error(client, user):
+    body = json.dumps({"type": "tune", "title": "Fine"}).encode() + b"\n" + b'{"type": "tune", "title": "\xff"}\n'
+    headers = {**user["headers"], "Accept": "application/x-ndjson"}
+    response = client.post("/api/import", content=body, headers=headers)
+    last = json.loads(response.text.splitlines()[-1])
+    assert last["status"] == "failed" and "Line 2" in last["detail"]
+    assert last["imported"]["tune"] == 1
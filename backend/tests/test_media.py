@@ -0,0 +1,103 @@
+import os
+import subprocess
+import time
+import uuid
+import pytest
+from database import SessionLocal
+from models import Recording, Rendition, Tune
+import media
+
+
+def _recording(user_id: int, upload_dir: str, duration: float | None = 1.0) -> int:
+    os.makedirs(upload_dir, exist_ok=True)
+    filename = f"{uuid.uuid4().hex}.mp3"
+    with open(os.path.join(upload_dir, filename), "wb") as f:
+        f.write(b"audio")
+    with SessionLocal() as db:
+        tune = Tune(user_id=user_id, title="Reel")
+        db.add(tune)
+        db.flush()
+        recording = Recording(user_id=user_id, tune_id=tune.id, filename=filename, original_name="take.mp3", duration=duration)
+        db.add(recording)
+        db.commit()
+        return recording.id
+
+def _ffmpeg_fails(*args, **kwargs):
+    raise subprocess.CalledProcessError(1, "ffmpeg", stderr=b"header\nUnknown encoder 'libopus'\n")
+
+
+def test_transcode_fails_when_no_rendition_could_be_made(user, upload_dir, monkeypatch, caplog):
+    recording_id = _recording(user["id"], upload_dir)
+    monkeypatch.setattr(media, "encode_rendition", _ffmpeg_fails)
+    with pytest.raises(RuntimeError, match="Unknown encoder 'libopus'"):
+        media.transcode_recording(recording_id, upload_dir)
+    assert "Could not encode the aac rendition" in caplog.text
+
+def test_transcode_keeps_the_renditions_that_worked(user, upload_dir, monkeypatch, caplog):
+    recording_id = _recording(user["id"], upload_dir)
+
+    def encode(source: str, target: str, profile: str):
+        if profile == "opus":
+            _ffmpeg_fails()
+        with open(target, "wb") as f:
+            f.write(b"aac")
+
+    monkeypatch.setattr(media, "encode_rendition", encode)
+    media.transcode_recording(recording_id, upload_dir)   # the AAC one is enough to serve
+    assert "Could not encode the opus rendition" in caplog.text
+    with SessionLocal() as db:
+        assert [r.profile for r in db.query(Rendition).filter(Rendition.recording_id == recording_id)] == ["aac"]
+
+def _hls_ffmpeg(args: list, **kwargs):
+    # Writes what ffmpeg's HLS muxer would, into the directory the playlist goes to
+    playlist = args[-1]
+    with open(playlist, "w") as f:
+        f.write("#EXTM3U\n#EXT-X-MAP:URI=\"init.mp4\"\nchunk_00000.m4s\n#EXT-X-ENDLIST\n")
+    for name in ("init.mp4", "chunk_00000.m4s"):
+        with open(os.path.join(os.path.dirname(playlist), name), "wb") as f:
+            f.write(b"chunk")
+
+def _lock(upload_dir: str, recording_id: int, age: float) -> str:
+    with SessionLocal() as db:
+        tmp = media.hls_dir(upload_dir, db.get(Recording, recording_id)) + ".part"
+    os.makedirs(tmp)
+    stamp = time.time() - age
+    os.utime(tmp, (stamp, stamp))
+    return tmp
+
+def _hls_ready(recording_id: int) -> bool:
+    with SessionLocal() as db:
+        return db.get(Recording, recording_id).hls_ready
+
+
+def test_package_hls_is_retried_while_another_job_holds_the_lock(user, upload_dir, monkeypatch):
+    recording_id = _recording(user["id"], upload_dir, duration=3600)
+    tmp = _lock(upload_dir, recording_id, age=60)
+    monkeypatch.setattr(media.subprocess, "run", _hls_ffmpeg)
+    with pytest.raises(media.PackagingInProgress):
+        media.package_hls(recording_id, upload_dir)
+    assert os.path.isdir(tmp)   # the other job's work is left alone
+    assert not _hls_ready(recording_id)
+
+def test_package_hls_replaces_a_stale_lock(user, upload_dir, monkeypatch):
+    recording_id = _recording(user["id"], upload_dir, duration=3600)
+    tmp = _lock(upload_dir, recording_id, age=media.HLS_STALE_SECONDS + 60)
+    monkeypatch.setattr(media.subprocess, "run", _hls_ffmpeg)
+    media.package_hls(recording_id, upload_dir)
+    assert not os.path.exists(tmp)
+    assert os.path.exists(os.path.join(tmp.removesuffix(".part"), media.HLS_PLAYLIST))
+    assert _hls_ready(recording_id)
+
+def test_package_hls_reuses_chunks_packaged_for_the_same_file(user, upload_dir, monkeypatch):
+    recording_id = _recording(user["id"], upload_dir, duration=3600)
+    monkeypatch.setattr(media.subprocess, "run", _hls_ffmpeg)
+    media.package_hls(recording_id, upload_dir)
+    with SessionLocal() as db:
+        first = db.get(Recording, recording_id)
+        duplicate = Recording(user_id=first.user_id, tune_id=first.tune_id, filename=first.filename, original_name="copy.mp3", duration=3600)
+        db.add(duplicate)
+        db.commit()
+        duplicate_id = duplicate.id
+    monkeypatch.setattr(media.subprocess, "run", pytest.fail)
+    media.package_hls(duplicate_id, upload_dir)
+    assert _hls_ready(duplicate_id)
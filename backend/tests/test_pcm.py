@@ -0,0 +1,94 @@
+import os
+import uuid
+import numpy as np
+import pytest
+from models import Recording
+import pcm
+
+
+def _recording() -> Recording:
+    return Recording(filename=f"{uuid.uuid4().hex}.mp3")
+
+def _decoded(monkeypatch, frames: int, channels: int = 1) -> np.ndarray:
+    # Stands in for ffmpeg, handing out the same ramp in uneven blocks
+    samples = np.linspace(-1.2, 1.2, frames * channels, dtype=np.float32).reshape(frames, channels)
+
+    def iter_pcm(source: str, sample_rate: int, channels: int, block_frames: int):
+        for start in range(0, frames, 1000):
+            yield samples[start:start + 1000]
+
+    monkeypatch.setattr(pcm.media, "iter_pcm", iter_pcm)
+    return samples
+
+def _cached(upload_dir: str, size: int, age: float) -> str:
+    os.makedirs(pcm.pcm_dir(upload_dir), exist_ok=True)
+    path = os.path.join(pcm.pcm_dir(upload_dir), f"{uuid.uuid4().hex}.11025x1.float32.pcm")
+    with open(path, "wb") as f:
+        f.truncate(size)
+    os.utime(path, (os.path.getmtime(path) - age,) * 2)
+    return path
+
+
+def test_header_round_trip(tmp_path, monkeypatch):
+    samples = _decoded(monkeypatch, frames=4321, channels=2)
+    recording = _recording()
+    mapped = pcm.open_pcm(str(tmp_path), recording, 48000, 2)
+    path = pcm.pcm_path(str(tmp_path), recording, 48000, 2, "float32")
+    with open(path, "rb") as f:
+        header = f.read(pcm.PCM_HEADER_SIZE)
+    assert pcm.PCM_HEADER.unpack(header[:pcm.PCM_HEADER.size]) == (pcm.PCM_MAGIC, 48000, 2, 4321, b"float32\0")
+    assert header[pcm.PCM_HEADER.size:] == b"\0" * (pcm.PCM_HEADER_SIZE - pcm.PCM_HEADER.size)
+    assert os.path.getsize(path) == pcm.PCM_HEADER_SIZE + samples.nbytes
+    np.testing.assert_array_equal(mapped, samples)
+    assert not [name for name in os.listdir(pcm.pcm_dir(str(tmp_path))) if name.endswith(".part")]
+
+    # Anything but the format asked for, or a file cut short, is decoded again
+    assert pcm._map(path, 44100, 2, "float32") is None
+    assert pcm._map(path, 48000, 1, "float32") is None
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 4)
+    assert pcm._map(path, 48000, 2, "float32") is None
+
+def test_int16_is_clipped_and_scaled(tmp_path, monkeypatch):
+    samples = _decoded(monkeypatch, frames=2000)
+    mapped = pcm.open_pcm(str(tmp_path), _recording(), 11025, 1, "int16")
+    assert mapped.dtype == np.int16
+    assert (mapped[0, 0], mapped[-1, 0]) == (-32767, 32767)
+    np.testing.assert_allclose(mapped / 32767, np.clip(samples, -1, 1), atol=1 / 32767)
+
+def test_empty_decode_maps_to_no_frames(tmp_path, monkeypatch):
+    _decoded(monkeypatch, frames=0)
+    assert pcm.open_pcm(str(tmp_path), _recording(), 11025).shape == (0, 1)
+
+@pytest.mark.parametrize("start, duration, expected", [
+    (None, None, (0, 100)),
+    (0, 1, (0, 10)),
+    (2.5, 3, (25, 55)),
+    (9, 5, (90, 100)),      # runs past the end
+    (-1, 2, (0, 10)),       # starts before the beginning
+    (12, 1, (100, 100)),    # entirely past the end
+    (3, 0, (30, 30)),
+])
+def test_window_at_file_edges(start, duration, expected):
+    samples = np.arange(100).reshape(100, 1)
+    window = pcm.window(samples, 10, start, duration)
+    first, last = expected
+    np.testing.assert_array_equal(window, samples[first:last])
+
+def test_least_recently_used_files_are_evicted_on_open(tmp_path, monkeypatch):
+    upload_dir = str(tmp_path)
+    monkeypatch.setattr(pcm, "PCM_CACHE_MB", 1)
+    _decoded(monkeypatch, frames=1000)
+    recording = _recording()
+    pcm.open_pcm(upload_dir, recording, 11025)
+    opened = pcm.pcm_path(upload_dir, recording, 11025, 1, "float32")
+    os.utime(opened, (os.path.getmtime(opened) - 400,) * 2)
+    oldest, older, newer = (_cached(upload_dir, 400 * 1024, age) for age in (300, 200, 100))
+
+    pcm.open_pcm(upload_dir, recording, 11025)   # a cache hit, and now the most recently used
+    assert os.path.getmtime(opened) > os.path.getmtime(newer)
+    assert not os.path.exists(oldest)
+    assert os.path.exists(older) and os.path.exists(newer)
+
+    pcm.evict(upload_dir)
+    assert os.path.exists(opened)   # 1 MB holds what is left
@@ -0,0 +1,84 @@
+import threading
+import time
+import anyio
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+import profiler
+
+
+def _spin(seconds: float):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+def _sampled_threads(profile: profiler.Profile) -> set:
+    return {thread_id for _, thread_id, _ in profile.samples}
+
+
+def test_threadpool_call_is_attributed_to_the_request_that_made_it():
+    worker = {}
+
+    def work():
+        worker["id"] = threading.get_ident()
+        _spin(0.1)
+
+    async def request(profile: profiler.Profile):
+        token = profiler._current.set(profile)
+        try:
+            with profile:
+                await anyio.to_thread.run_sync(profiler.attributed(work))
+                assert worker["id"] not in profiler._threads
+        finally:
+            profiler._current.reset(token)
+
+    profile = profiler.Profile("request")
+    anyio.run(request, profile)
+    assert worker["id"] in _sampled_threads(profile)
+    assert not profiler._threads
+
+def test_event_loop_is_only_sampled_while_the_request_runs():
+    profiles = {}
+
+    async def request(name: str, busy: float, idle: float):
+        profile = profiles[name] = profiler.Profile(name)
+        token = profiler._current.set(profile)
+        try:
+            with profile:
+                _spin(busy)
+                await anyio.sleep(idle)
+        finally:
+            profiler._current.reset(token)
+
+    async def main():
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(request, "waiting", 0, 0.3)
+            await anyio.sleep(0.01)
+            tg.start_soon(request, "spinning", 0.2, 0)
+
+    anyio.run(main)
+    loop_thread = threading.get_ident()
+    assert loop_thread in _sampled_threads(profiles["spinning"])
+    assert loop_thread not in _sampled_threads(profiles["waiting"])
+
+def test_profiled_routes_attribute_their_thread(monkeypatch):
+    monkeypatch.setattr(profiler, "PROFILE_SECRET", "test-secret")
+    monkeypatch.setattr(profiler.Profile, "save", lambda self, filename: saved.append(self))
+    saved, seen = [], {}
+    app = FastAPI()
+    app.router.route_class = profiler.ProfiledRoute
+    app.add_middleware(profiler.RequestProfiler)
+
+    @app.get("/work")
+    def work(seconds: float):
+        seen["thread"] = threading.get_ident()
+        seen["claimed"] = profiler._threads.get(seen["thread"])
+        _spin(seconds)
+        return {"ok": True}
+
+    token = profiler.sign(int(time.time()) + 60)
+    with TestClient(app) as client:
+        response = client.get("/work?seconds=0.1", headers={"X-Profile": token})
+    assert response.json() == {"ok": True}   # parameters still reach the endpoint
+    assert seen["claimed"] is saved[0]
+    assert seen["thread"] in _sampled_threads(saved[0])
+    assert seen["thread"] not in profiler._threads
@@ -0,0 +1,135 @@
+import os
+import re
+from datetime import date, timedelta
+import pytest
+from sqlalchemy import event, insert, select, text
+from database import engine, SessionLocal
+from models import (
+    User, Tune, Recording, Segment, PracticeSession, PracticeEntry, Performance, Setlist, SetlistEntry, PracticeRollup
+)
+
+# Runs each list and detail route against a seeded database and fails when one of its queries
+# reads a whole large table instead of going through an index.
+OTHER_USERS = 20
+TUNES_PER_USER = 200
+SESSIONS_PER_USER = 100
+SETLISTS_PER_USER = 10
+LARGE_TABLES = {
+    "tunes", "recordings", "segments", "practice_sessions", "practice_entries",
+    "performances", "setlists", "setlist_entries", "practice_rollups",
+}
+
+
+def _seed(db, user_id: int):
+    tune_ids = db.scalars(insert(Tune).returning(Tune.id), [
+        {"user_id": user_id, "title": f"Tune {n}", "status": "learning", "tempo": 120} for n in range(TUNES_PER_USER)
+    ]).all()
+    recording_ids = db.scalars(insert(Recording).returning(Recording.id), [
+        {"user_id": user_id, "tune_id": t, "filename": f"{user_id}-{t}.mp3", "original_name": "take.mp3"} for t in tune_ids
+    ]).all()
+    segment_ids = db.scalars(insert(Segment).returning(Segment.id), [
+        {"user_id": user_id, "recording_id": r, "label": label, "start_time": start, "end_time": start + 10}
+        for r in recording_ids for label, start in (("A", 0), ("B", 10))
+    ]).all()
+    session_ids = db.scalars(insert(PracticeSession).returning(PracticeSession.id), [
+        {"user_id": user_id, "date": date(2026, 1, 1) + timedelta(days=n)} for n in range(SESSIONS_PER_USER)
+    ]).all()
+    db.execute(insert(PracticeEntry), [
+        {"session_id": s, "tune_id": tune_ids[(n * 3 + k) % len(tune_ids)], "segment_id": segment_ids[n], "rating": 3}
+        for n, s in enumerate(session_ids) for k in range(3)
+    ])
+    performance_ids = db.scalars(insert(Performance).returning(Performance.id), [
+        {"user_id": user_id, "title": f"Gig {n}", "date": date(2026, 6, 1) + timedelta(days=n)} for n in range(SETLISTS_PER_USER)
+    ]).all()
+    setlist_ids = db.scalars(insert(Setlist).returning(Setlist.id), [
+        {"user_id": user_id, "title": f"Set {n}", "performance_id": p} for n, p in enumerate(performance_ids)
+    ]).all()
+    db.execute(insert(SetlistEntry), [
+        {"setlist_id": s, "tune_id": tune_ids[n * 10 + k], "position": k} for n, s in enumerate(setlist_ids) for k in range(10)
+    ])
+    db.execute(insert(PracticeRollup), [
+        {"user_id": user_id, "date": date(2026, 1, 1) + timedelta(days=n), "recording_id": recording_ids[n], "segment_id": None,
+         "seconds": 60, "loops": 1, "max_speed": 1.0}
+        for n in range(SESSIONS_PER_USER)
+    ])
+    return tune_ids[0], recording_ids[0], segment_ids[0], setlist_ids[0]
+
+@pytest.fixture(scope="module")
+def seeded(client, upload_dir):
+    username = "query-plans"
+    client.post("/api/register", json={"username": username, "password": "password1"})
+    token = client.post("/api/login", json={"username": username, "password": "password1"}).json()["access_token"]
+    with SessionLocal() as db:
+        user_id = db.scalar(select(User.id).where(User.username == username))
+        ids = _seed(db, user_id)
+        # the rehearsal route only plans entries whose audio is on disk
+        os.makedirs(upload_dir, exist_ok=True)
+        for filename in db.scalars(select(Recording.filename).where(Recording.user_id == user_id)):
+            open(os.path.join(upload_dir, filename), "wb").close()
+        others = db.scalars(insert(User).returning(User.id), [
+            {"username": f"query-plans-{n}", "password_hash": "x"} for n in range(OTHER_USERS)
+        ]).all()
+        for other in others:
+            _seed(db, other)
+        db.commit()
+    with engine.begin() as conn:
+        conn.execute(text("ANALYZE"))
+    return {"Authorization": f"Bearer {token}"}, token, ids
+
+def _capture(client, method: str, url: str, **kwargs) -> list[tuple]:
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT") and not executemany:
+            statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        response = client.request(method, url, **kwargs)
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    assert response.status_code < 300, response.text
+    return statements
+
+def _full_scans(statement: str, parameters) -> set[str]:
+    with engine.connect() as conn:
+        if engine.dialect.name == "postgresql":
+            plan = conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {statement}", parameters).scalar()
+            scans, nodes = set(), [plan[0]["Plan"]]
+            while nodes:
+                node = nodes.pop()
+                if node["Node Type"] == "Seq Scan":
+                    scans.add(node["Relation Name"])
+                nodes += node.get("Plans", [])
+            return scans
+        # SQLite reports a table read without an index as "SCAN <table or alias>", with "USING ... INDEX" otherwise
+        aliases = dict((alias, table) for table, alias in re.findall(r"(?:FROM|JOIN) (\w+) AS (\w+)", statement))
+        details = [row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)]
+        return {aliases.get(m.group(1), m.group(1)) for d in details if (m := re.fullmatch(r"SCAN (\w+)", d))}
+
+ROUTES = [
+    ("GET", "/api/tunes"),
+    ("GET", "/api/tunes/{tune_id}"),
+    ("GET", "/api/tunes/{tune_id}/full"),
+    ("GET", "/api/tunes/{tune_id}/recordings"),
+    ("GET", "/api/recordings/{recording_id}/segments"),
+    ("PATCH", "/api/segments/{segment_id}"),
+    ("GET", "/api/sessions"),
+    ("GET", "/api/performances"),
+    ("GET", "/api/setlists"),
+    ("GET", "/api/practice/rollups"),
+    ("GET", "/api/practice/next"),
+    ("GET", "/api/sync"),
+    ("GET", "/api/setlists/{setlist_id}/rehearsal?token={token}"),
+]
+
+@pytest.mark.parametrize("method,route", ROUTES)
+def test_route_queries_use_indexes(client, seeded, method, route):
+    headers, token, (tune_id, recording_id, segment_id, setlist_id) = seeded
+    url = route.format(tune_id=tune_id, recording_id=recording_id, segment_id=segment_id, setlist_id=setlist_id, token=token)
+    kwargs = {"json": {"notes": "plan check"}} if method == "PATCH" else {}
+    statements = _capture(client, method, url, headers=headers, **kwargs)
+    assert statements
+    for statement, parameters in statements:
+        scans = _full_scans(statement, parameters) & LARGE_TABLES
+        assert not scans, f"{method} {route} reads all of {scans}:\n{statement}"
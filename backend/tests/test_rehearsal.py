@@ -0,0 +1,152 @@
+import os
+import shutil
+import subprocess
+import uuid
+import pytest
+from database import SessionLocal
+from models import Recording, Rendition, Segment, Setlist, SetlistEntry, Tune
+import media
+import rehearsal
+
+
+def _file(directory: str, ext: str = ".mp3") -> str:
+    os.makedirs(directory, exist_ok=True)
+    filename = f"{uuid.uuid4().hex}{ext}"
+    with open(os.path.join(directory, filename), "wb") as f:
+        f.write(b"audio")
+    return filename
+
+def _setlist(db, user_id: int, entries: list[dict]) -> int:
+    setlist = Setlist(user_id=user_id, title="Gig")
+    db.add(setlist)
+    db.flush()
+    for position, entry in enumerate(entries):
+        db.add(SetlistEntry(setlist_id=setlist.id, position=position, **entry))
+    db.commit()
+    return setlist.id
+
+
+def test_plan_resolves_entries_in_order(user, upload_dir):
+    with SessionLocal() as db:
+        tunes = [Tune(user_id=user["id"], title=title) for title in ("Latest", "Chosen", "Segment", "Missing", "Empty")]
+        db.add_all(tunes)
+        db.flush()
+        latest, chosen, segmented, missing, empty = tunes
+        older = Recording(user_id=user["id"], tune_id=latest.id, filename=_file(upload_dir), original_name="old.mp3")
+        newer = Recording(user_id=user["id"], tune_id=latest.id, filename=_file(upload_dir), original_name="new.mp3")
+        picked = Recording(user_id=user["id"], tune_id=chosen.id, filename=_file(upload_dir), original_name="picked.mp3")
+        cut = Recording(user_id=user["id"], tune_id=segmented.id, filename=_file(upload_dir), original_name="cut.mp3")
+        gone = Recording(user_id=user["id"], tune_id=missing.id, filename="not-on-disk.mp3", original_name="gone.mp3")
+        db.add_all([older, newer, picked, cut, gone])
+        db.flush()
+        segment = Segment(recording_id=cut.id, user_id=user["id"], label="B part", start_time=12.5, end_time=40.0)
+        db.add(segment)
+        db.flush()
+        setlist_id = _setlist(db, user["id"], [
+            {"tune_id": segmented.id, "segment_id": segment.id},
+            {"tune_id": missing.id},
+            {"tune_id": latest.id},
+            {"tune_id": chosen.id, "recording_id": picked.id},
+            {"tune_id": empty.id},
+        ])
+        filenames = [cut.filename, newer.filename, picked.filename]
+
+        items = rehearsal.plan(db, setlist_id, upload_dir)
+    assert items == [
+        {"source": os.path.join(upload_dir, filenames[0]), "start": 12.5, "end": 40.0},
+        {"source": os.path.join(upload_dir, filenames[1]), "start": None, "end": None},
+        {"source": os.path.join(upload_dir, filenames[2]), "start": None, "end": None},
+    ]
+
+def test_plan_prefers_the_aac_rendition_on_disk(user, upload_dir):
+    renditions = media.rendition_dir(upload_dir)
+    with SessionLocal() as db:
+        tunes = [Tune(user_id=user["id"], title=title) for title in ("Encoded", "Opus only", "Rendition lost")]
+        db.add_all(tunes)
+        db.flush()
+        recordings = [
+            Recording(user_id=user["id"], tune_id=tune.id, filename=_file(upload_dir), original_name="take.mp3")
+            for tune in tunes
+        ]
+        db.add_all(recordings)
+        db.flush()
+        aac = _file(renditions, ".aac.m4a")
+        db.add_all([
+            Rendition(recording_id=recordings[0].id, profile="aac", filename=aac),
+            Rendition(recording_id=recordings[1].id, profile="opus", filename=_file(renditions, ".opus.opus")),
+            Rendition(recording_id=recordings[2].id, profile="aac", filename="deleted.aac.m4a"),
+        ])
+        setlist_id = _setlist(db, user["id"], [{"tune_id": tune.id} for tune in tunes])
+        originals = [r.filename for r in recordings]
+
+        sources = [item["source"] for item in rehearsal.plan(db, setlist_id, upload_dir)]
+    assert sources == [
+        media.rendition_path(upload_dir, aac),
+        os.path.join(upload_dir, originals[1]),
+        os.path.join(upload_dir, originals[2]),
+    ]
+
+def test_cache_key_changes_with_what_is_played():
+    items = [
+        {"source": "/uploads/a.m4a", "start": None, "end": None},
+        {"source": "/uploads/b.m4a", "start": 1.0, "end": 2.5},
+    ]
+    key = rehearsal.cache_key(items)
+    assert len(key) == 32
+    # Only the file names count, so moving UPLOAD_DIR keeps the cache
+    assert rehearsal.cache_key([{**i, "source": i["source"].replace("/uploads", "/srv")} for i in items]) == key
+    assert rehearsal.cache_key(items[::-1]) != key
+    assert rehearsal.cache_key([items[0], {**items[1], "end": 2.6}]) != key
+    assert rehearsal.cache_key([items[0], {**items[1], "source": "/uploads/c.m4a"}]) != key
+
+def test_cache_key_changes_with_the_version(monkeypatch):
+    items = [{"source": "a.m4a", "start": None, "end": None}]
+    key = rehearsal.cache_key(items)
+    monkeypatch.setattr(rehearsal, "REHEARSAL_VERSION", rehearsal.REHEARSAL_VERSION + 1)
+    assert rehearsal.cache_key(items) != key
+
+def _tone(path: str, seconds: float, frequency: int):
+    subprocess.run(
+        [
+            media.FFMPEG, "-nostdin", "-v", "error", "-y", "-f", "lavfi", "-i", f"sine=frequency={frequency}:duration={seconds}",
+            "-ac", "2", "-ar", "48000", "-c:a", "aac", "-b:a", "96k", "-movflags", "+faststart", path,
+        ],
+        check=True, capture_output=True,
+    )
+
+def _duration(path: str) -> float:
+    result = subprocess.run(
+        [media.FFPROBE, "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", path],
+        check=True, capture_output=True, text=True,
+    )
+    return float(result.stdout)
+
+@pytest.mark.skipif(shutil.which(media.FFMPEG) is None, reason="needs ffmpeg")
+def test_build_rehearsal_copies_aac_parts_between_inpoint_and_outpoint(user, upload_dir, monkeypatch):
+    stitched, run = [], subprocess.run
+    monkeypatch.setattr(subprocess, "run", lambda args, **kwargs: stitched.append(args) or run(args, **kwargs))
+    with SessionLocal() as db:
+        tune = Tune(user_id=user["id"], title="Tones")
+        db.add(tune)
+        db.flush()
+        recordings = []
+        for seconds, frequency in ((4, 440), (6, 660)):
+            filename = f"{uuid.uuid4().hex}.m4a"
+            _tone(os.path.join(upload_dir, filename), seconds, frequency)
+            recordings.append(Recording(user_id=user["id"], tune_id=tune.id, filename=filename, original_name="tone.m4a"))
+        db.add_all(recordings)
+        db.flush()
+        segment = Segment(recording_id=recordings[1].id, user_id=user["id"], label="Middle", start_time=1.5, end_time=4.0)
+        db.add(segment)
+        db.flush()
+        setlist_id = _setlist(db, user["id"], [
+            {"tune_id": tune.id, "recording_id": recordings[0].id},
+            {"tune_id": tune.id, "segment_id": segment.id},
+        ])
+        items = rehearsal.plan(db, setlist_id, upload_dir)
+
+    rehearsal.build_rehearsal(setlist_id, upload_dir)
+    target = rehearsal.rehearsal_path(upload_dir, setlist_id, rehearsal.cache_key(items))
+    assert any("concat" in args and "copy" in args for args in stitched)   # the stream copy path, not a re-encode
+    assert _duration(target) == pytest.approx(4 + 2.5, abs=0.1)   # cut at the nearest AAC frame
+    assert not [name for name in os.listdir(rehearsal.rehearsal_dir(upload_dir)) if name.endswith((".part", ".txt"))]
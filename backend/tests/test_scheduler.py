@@ -0,0 +1,114 @@
+import json
+from datetime import date, timedelta
+from sqlalchemy import select, update
+from database import SessionLocal
+from models import Job, PracticePriority, Recording, Segment, Tune, User
+import scheduler
+
+
+def _next(client, user) -> dict:
+    response = client.get("/api/practice/next", headers=user["headers"])
+    assert response.status_code == 200, response.text
+    return {item["tune_id"]: item for item in response.json()}
+
+def _queued(user_id: int) -> list[Job]:
+    with SessionLocal() as db:
+        return db.scalars(select(Job).where(Job.kind == "score_priorities", Job.user_id == user_id, Job.status == "queued")).all()
+
+def _rescore(user_id: int):
+    # The worker's part, run inline
+    jobs = _queued(user_id)
+    with SessionLocal() as db:
+        db.execute(update(Job).where(Job.id.in_([j.id for j in jobs])).values(status="succeeded"))
+        db.commit()
+    for job in jobs:
+        scheduler.score_priorities(**job.payload, upload_dir="uploads")
+
+def _stale(user_id: int) -> set[int]:
+    with SessionLocal() as db:
+        return set(db.scalars(select(PracticePriority.tune_id).where(PracticePriority.user_id == user_id, PracticePriority.stale)))
+
+
+def test_import_updates_practice_priorities(client, user):
+    first = client.post("/api/tunes", json={"title": "Already here"}, headers=user["headers"]).json()
+    _rescore(user["id"])
+    assert set(_next(client, user)) == {first["id"]}   # scored today, nothing stale
+
+    yesterday = (date.today() - timedelta(days=1)).isoformat()
+    body = "\n".join(json.dumps(r) for r in [
+        {"type": "tune", "id": 999999999, "title": "Imported"},   # not an id the entry could mean
+        {"type": "session", "id": 1, "date": yesterday},
+        {"type": "entry", "session_id": 1, "tune_id": first["id"], "rating": 5},
+    ])
+    response = client.post("/api/import", content=body, headers=user["headers"])
+    assert response.status_code == 200, response.text
+    assert len(_queued(user["id"])) == 1
+
+    _rescore(user["id"])
+    scored = _next(client, user)
+    assert len(scored) == 2   # the imported tune was picked up without waiting for tomorrow
+    assert "never practiced" not in scored[first["id"]]["reasons"]   # and the imported entry rescored the old one
+
+def test_practice_next_only_reads(client, user):
+    tune = client.post("/api/tunes", json={"title": "Reel"}, headers=user["headers"]).json()
+    assert len(_queued(user["id"])) == 1   # the write asked for the rescore
+    assert _next(client, user)[tune["id"]]["score"] == 0   # placeholder until the job has run
+    assert _stale(user["id"]) == {tune["id"]}
+    _rescore(user["id"])
+    assert _next(client, user)[tune["id"]]["score"] > 0
+    assert not _stale(user["id"])
+
+def test_daily_rescore_is_enqueued_for_earlier_scores(client, user):
+    client.post("/api/tunes", json={"title": "Reel"}, headers=user["headers"])
+    _rescore(user["id"])
+    scheduler.enqueue_daily()
+    assert not _queued(user["id"])   # scored today
+    with SessionLocal() as db:
+        db.execute(update(User).where(User.id == user["id"]).values(priorities_scored_on=date.today() - timedelta(days=1)))
+        db.commit()
+    scheduler.enqueue_daily()
+    assert len(_queued(user["id"])) == 1
+
+def test_segment_and_recording_edits_mark_their_tunes_stale(client, user):
+    with SessionLocal() as db:
+        first, second, third = (Tune(user_id=user["id"], title=title) for title in ("First", "Second", "Third"))
+        db.add_all([first, second, third])
+        db.flush()
+        on_first, on_second = (
+            Recording(user_id=user["id"], tune_id=tune.id, filename=f"{tune.id}.mp3", original_name="take.mp3")
+            for tune in (first, second)
+        )
+        db.add_all([on_first, on_second])
+        db.flush()
+        segment = Segment(user_id=user["id"], recording_id=on_first.id, label="A", start_time=0, end_time=5)
+        db.add(segment)
+        db.commit()
+        ids = {"first": first.id, "second": second.id, "third": third.id, "on_second": on_second.id, "segment": segment.id}
+    _rescore(user["id"])
+    assert not _stale(user["id"])
+
+    # Renaming changes nothing the scores depend on
+    response = client.patch(f"/api/segments/{ids['segment']}", json={"label": "B"}, headers=user["headers"])
+    assert response.status_code == 200, response.text
+    assert not _stale(user["id"])
+
+    # A segment moved to another tune's recording changes both tunes
+    with SessionLocal() as db:
+        db.get(Segment, ids["segment"]).recording_id = ids["on_second"]
+        db.commit()
+    assert _stale(user["id"]) == {ids["first"], ids["second"]}
+    _rescore(user["id"])
+    assert not _stale(user["id"])
+
+    # So does a recording moved to another tune, with its segments
+    with SessionLocal() as db:
+        db.get(Recording, ids["on_second"]).tune_id = ids["third"]
+        db.commit()
+    assert _stale(user["id"]) == {ids["second"], ids["third"]}
+    _rescore(user["id"])
+
+    # Analysis filling in a recording's details doesn't
+    with SessionLocal() as db:
+        db.get(Recording, ids["on_second"]).tempo_bpm = 120
+        db.commit()
+    assert not _stale(user["id"])
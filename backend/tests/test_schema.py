@@ -0,0 +1,55 @@
+import os
+import sqlite3
+import subprocess
+import sys
+
+# The tables as the first release created them, before any column sync_schema adds
+BASELINE_SCHEMA = """
+CREATE TABLE users (id INTEGER PRIMARY KEY, username VARCHAR(50) NOT NULL UNIQUE, password_hash VARCHAR(255) NOT NULL,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP);
+CREATE TABLE tunes (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL REFERENCES users (id), title VARCHAR NOT NULL,
+    composer VARCHAR, "key" VARCHAR, tempo INTEGER, form VARCHAR, status VARCHAR, notes TEXT, created_at DATETIME DEFAULT CURRENT_TIMESTAMP);
+CREATE TABLE practice_sessions (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL REFERENCES users (id), date DATE NOT NULL,
+    duration_minutes INTEGER, notes TEXT, created_at DATETIME DEFAULT CURRENT_TIMESTAMP);
+CREATE TABLE performances (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL REFERENCES users (id), title VARCHAR NOT NULL,
+    date DATE NOT NULL, time VARCHAR, venue VARCHAR, notes TEXT, created_at DATETIME DEFAULT CURRENT_TIMESTAMP);
+CREATE TABLE recordings (id INTEGER PRIMARY KEY, tune_id INTEGER NOT NULL REFERENCES tunes (id), filename VARCHAR NOT NULL,
+    original_name VARCHAR NOT NULL, artist VARCHAR, "key" VARCHAR, description TEXT, duration FLOAT, file_size INTEGER,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP);
+CREATE TABLE setlists (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL REFERENCES users (id), title VARCHAR NOT NULL,
+    performance_id INTEGER REFERENCES performances (id) ON DELETE SET NULL, notes TEXT, created_at DATETIME DEFAULT CURRENT_TIMESTAMP);
+CREATE TABLE segments (id INTEGER PRIMARY KEY, recording_id INTEGER NOT NULL REFERENCES recordings (id), label VARCHAR NOT NULL,
+    start_time FLOAT NOT NULL, end_time FLOAT NOT NULL, color VARCHAR, notes TEXT, created_at DATETIME DEFAULT CURRENT_TIMESTAMP);
+CREATE TABLE setlist_entries (id INTEGER PRIMARY KEY, setlist_id INTEGER NOT NULL REFERENCES setlists (id),
+    tune_id INTEGER NOT NULL REFERENCES tunes (id), position INTEGER NOT NULL);
+CREATE TABLE practice_entries (id INTEGER PRIMARY KEY, session_id INTEGER NOT NULL REFERENCES practice_sessions (id),
+    tune_id INTEGER NOT NULL REFERENCES tunes (id), segment_id INTEGER REFERENCES segments (id) ON DELETE SET NULL,
+    focus VARCHAR, tempo_practiced INTEGER, notes TEXT, rating INTEGER, duration_minutes INTEGER,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP);
+
+INSERT INTO users (id, username, password_hash) VALUES (1, 'ann', 'x'), (2, 'bob', 'x');
+INSERT INTO tunes (id, user_id, title) VALUES (1, 1, 'Reel'), (2, 2, 'Jig');
+-- Ann uploaded the same file twice, it is stored and counted once
+INSERT INTO recordings (id, tune_id, filename, original_name, file_size) VALUES
+    (1, 1, 'a.mp3', 'a.mp3', 100), (2, 1, 'a.mp3', 'a.mp3', 100), (3, 1, 'b.mp3', 'b.mp3', 50), (4, 2, 'c.mp3', 'c.mp3', 7);
+INSERT INTO segments (id, recording_id, label, start_time, end_time) VALUES (1, 3, 'A', 0, 10), (2, 4, 'B', 0, 10);
+"""
+
+
+def test_upgrade_from_baseline_schema(tmp_path):
+    path = tmp_path / "baseline.db"
+    with sqlite3.connect(path) as conn:
+        conn.executescript(BASELINE_SCHEMA)
+    # database.py binds its engine at import, so the upgrade runs in its own process
+    backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = {**os.environ, "DATABASE_URL": f"sqlite:///{path}"}
+    result = subprocess.run(
+        [sys.executable, "-c", "import database; database.migrate()"], cwd=backend, env=env, capture_output=True, text=True,
+    )
+    assert result.returncode == 0, result.stderr
+
+    with sqlite3.connect(path) as conn:
+        assert dict(conn.execute("SELECT id, storage_bytes FROM users")) == {1: 150, 2: 7}
+        assert dict(conn.execute("SELECT id, user_id FROM recordings")) == {1: 1, 2: 1, 3: 1, 4: 2}
+        assert dict(conn.execute("SELECT id, user_id FROM segments")) == {1: 1, 2: 2}
+        assert conn.execute("SELECT count(*) FROM tunes WHERE updated_at IS NULL").fetchone()[0] == 0
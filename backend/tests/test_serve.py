@@ -0,0 +1,51 @@
+import os
+import sys
+import time
+import serve
+
+
+def test_configure_exports_job_workers(monkeypatch):
+    monkeypatch.delenv("JOB_WORKERS", raising=False)
+    monkeypatch.setattr(serve, "max_connections", lambda: None)
+    serve.configure(workers=2, job_workers=3)
+    assert os.environ["JOB_WORKERS"] == "3"
+
+class ExitedProcess:
+    # A worker that exits as soon as it starts
+    def wait(self):
+        return 1
+
+    def terminate(self):
+        pass
+
+def test_job_worker_is_restarted(monkeypatch, caplog):
+    started = []
+
+    def popen(args):
+        started.append(args)
+        return ExitedProcess()
+
+    monkeypatch.setattr(serve.subprocess, "Popen", popen)
+    monkeypatch.setattr(serve.JobWorker, "_supervise", _fast(serve.JobWorker._supervise))
+    job_worker = serve.JobWorker()
+    job_worker.start()
+    deadline = time.monotonic() + 10
+    while len(started) < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert job_worker._thread.is_alive()   # still supervising, not crashed
+    job_worker.stop()
+    assert not job_worker._thread.is_alive()
+    assert len(started) >= 3
+    assert all(args == [sys.executable, "worker.py"] for args in started)
+    assert "Job worker exited with code 1, restarting" in caplog.text
+    count = len(started)
+    time.sleep(0.1)
+    assert len(started) == count   # nothing restarts it once stopped
+
+def _fast(supervise):
+    # Same loop without the restart delay
+    def run(self):
+        wait = self._stop.wait
+        self._stop.wait = lambda timeout=None: wait(0.001)
+        supervise(self)
+    return run
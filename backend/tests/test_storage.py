@@ -0,0 +1,39 @@
+import os
+import time
+import uuid
+import storage
+from database import SessionLocal
+from models import Recording, Tune
+
+
+def _touch(path: str, age: float):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, "wb").close()
+    old = time.time() - age
+    os.utime(path, (old, old))
+
+def test_reconcile_only_removes_what_the_app_stored(user, tmp_path):
+    upload_dir = str(tmp_path)
+    known, orphan = f"{uuid.uuid4().hex}.mp3", f"{uuid.uuid4().hex}.wav"
+    with SessionLocal() as db:
+        tune = Tune(user_id=user["id"], title="Jig")
+        db.add(tune)
+        db.flush()
+        db.add(Recording(user_id=user["id"], tune_id=tune.id, filename=known, original_name="take.mp3"))
+        db.commit()
+    old = storage.ORPHAN_GRACE_SECONDS + 60
+    for name in (known, orphan, "woodshed.db", "woodshed.db-wal", "backup-2026-01-01.sql.gz"):
+        _touch(os.path.join(upload_dir, name), old)
+    _touch(os.path.join(upload_dir, "features", f"{orphan.split('.')[0]}.npz"), old)
+    _touch(os.path.join(upload_dir, "features", "notes.txt"), old)
+    _touch(os.path.join(upload_dir, "rehearsals", f"999999999.{uuid.uuid4().hex}.m4a"), old)
+    _touch(os.path.join(upload_dir, "rehearsals", "keep.m4a"), old)
+    young = f"{uuid.uuid4().hex}.mp3"
+    _touch(os.path.join(upload_dir, young), 0)
+
+    assert storage.reconcile(upload_dir) == 3
+    assert sorted(os.listdir(upload_dir)) == sorted(
+        [known, young, "woodshed.db", "woodshed.db-wal", "backup-2026-01-01.sql.gz", "features", "rehearsals"]
+    )
+    assert os.listdir(os.path.join(upload_dir, "features")) == ["notes.txt"]
+    assert os.listdir(os.path.join(upload_dir, "rehearsals")) == ["keep.m4a"]
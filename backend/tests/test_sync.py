@@ -0,0 +1,53 @@
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import event, update
+from database import SessionLocal, engine
+from models import Tune
+
+
+def _sync(client, user, since: str | None = None) -> dict:
+    response = client.get("/api/sync", params={"since": since} if since else {}, headers=user["headers"])
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_sync_sends_changes_and_deletes_after_the_cursor(client, user):
+    tune = client.post("/api/tunes", json={"title": "Reel"}, headers=user["headers"]).json()
+    snapshot = _sync(client, user)
+    assert snapshot["reset"] and [t["id"] for t in snapshot["tunes"]] == [tune["id"]]
+
+    client.delete(f"/api/tunes/{tune['id']}", headers=user["headers"])
+    delta = _sync(client, user, snapshot["cursor"])
+    assert not delta["reset"]
+    assert delta["deleted"] == [{"entity": "tune", "id": tune["id"]}]
+    assert delta["tunes"] == []
+
+def test_sync_sees_changes_written_long_before_their_commit(client, user):
+    tune = client.post("/api/tunes", json={"title": "Jig"}, headers=user["headers"]).json()
+    with SessionLocal() as db:
+        db.get(Tune, tune["id"]).title = "Slip jig"
+        db.flush()
+        # As if the change had been written a minute ago and the transaction was still busy since
+        db.execute(
+            update(Tune).where(Tune.id == tune["id"]).values(updated_at=datetime.now(timezone.utc) - timedelta(seconds=60)),
+            execution_options={"synchronize_session": False},
+        )
+        db.info["sync_written_at"] -= 60
+        cursor = _sync(client, user)["cursor"]   # a device syncs while the write is uncommitted
+        db.commit()
+
+    assert [t["title"] for t in _sync(client, user, cursor)["tunes"]] == ["Slip jig"]
+
+def test_quick_commits_are_not_stamped_again(user):
+    statements = []
+
+    def collect(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", collect)
+    try:
+        with SessionLocal() as db:
+            db.add(Tune(user_id=user["id"], title="Hornpipe"))
+            db.commit()
+    finally:
+        event.remove(engine, "before_cursor_execute", collect)
+    assert [s for s in statements if s.startswith("UPDATE tunes")] == []
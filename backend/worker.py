@@ -0,0 +1,123 @@
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from dotenv import load_dotenv
+import changefeed
+import events
+import jobs
+import scheduler
+import storage
+import sync
+from database import migrate
+
+load_dotenv()
+
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", 1))
+MAINTENANCE_SECONDS = 60
+RECONCILE_SECONDS = int(os.getenv("RECONCILE_SECONDS", 6 * 3600))
+ERROR_BACKOFF_MAX_SECONDS = 60
+
+log = logging.getLogger("woodshed.worker")
+
+
+def _new_pool(max_workers: int) -> ProcessPoolExecutor:
+    # spawn so job processes build their own DB engine instead of inheriting pooled connections
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+
+def _maintain(task):
+    # Maintenance tasks fail on their own, one failing doesn't hold up the others or the job loop
+    try:
+        task()
+    except Exception:
+        log.exception("Worker maintenance task %s failed", task.__name__)
+
+def _finish_done(running: dict, done) -> bool:
+    # Records each result, a job stays in running until its result is stored. True if the pool broke.
+    broken = False
+    for future in done:
+        error = future.exception()
+        jobs.finish(running[future], error)
+        del running[future]
+        if error is None:
+            changefeed.publish_recorded(future.result())
+        broken = broken or isinstance(error, BrokenProcessPool)
+    return broken
+
+def run_worker(stop: threading.Event, max_workers: int = JOB_WORKERS, upload_dir: str = UPLOAD_DIR):
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    pool = _new_pool(max_workers)
+    running = {}   # future -> job id
+    last_maintenance = 0.0
+    last_reconcile = time.monotonic()   # not on startup, a rolling restart would run it on every worker at once
+    errors = 0
+    try:
+        while not stop.is_set():
+            try:
+                if time.monotonic() - last_maintenance > MAINTENANCE_SECONDS:
+                    for task in (jobs.requeue_stale, sync.prune_tombstones, events.maintain_partitions, scheduler.enqueue_daily):
+                        _maintain(task)
+                    last_maintenance = time.monotonic()
+                if time.monotonic() - last_reconcile > RECONCILE_SECONDS:
+                    _maintain(lambda: storage.reconcile(upload_dir))
+                    last_reconcile = time.monotonic()
+
+                # Only claim as many jobs as there are free processes, the rest stay queued for other workers
+                broken = False
+                while len(running) < max_workers and not stop.is_set():
+                    job = jobs.claim(worker_id)
+                    if job is None:
+                        break
+                    job_id, kind, payload = job
+                    try:
+                        running[pool.submit(jobs.run, kind, payload, upload_dir)] = job_id
+                    except BrokenProcessPool as e:
+                        jobs.finish(job_id, e)   # back in the queue for a retry
+                        broken = True
+                        break
+
+                if running:
+                    done, _ = wait(running, timeout=JOB_POLL_SECONDS, return_when=FIRST_COMPLETED)
+                    broken = _finish_done(running, done) or broken
+                elif not broken:
+                    stop.wait(JOB_POLL_SECONDS)
+
+                if broken:
+                    # A job process died (e.g. killed for memory) and took the pool with it. Every
+                    # job in it has failed, record them and start a fresh pool.
+                    log.error("Job process pool broke, restarting it")
+                    _finish_done(running, wait(running).done)
+                    pool.shutdown(wait=False)
+                    pool = _new_pool(max_workers)
+                errors = 0
+            except Exception:
+                # Usually the database going away for a moment. Back off and carry on, jobs that
+                # finished in the meantime are recorded once it's back.
+                errors += 1
+                delay = min(JOB_POLL_SECONDS * 2 ** errors, ERROR_BACKOFF_MAX_SECONDS)
+                log.exception("Job worker error, retrying in %.0fs", delay)
+                stop.wait(delay)
+    finally:
+        # Graceful shutdown: nothing new is claimed, in-flight jobs finish and record their result
+        try:
+            _finish_done(running, wait(running).done)
+        except Exception:
+            log.exception("Could not record the results of in-flight jobs, they are requeued once stale")
+        pool.shutdown()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    if os.getenv("SCHEMA_MIGRATION", "startup") == "startup":
+        migrate()
+    stop = threading.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, lambda *_: stop.set())
+    run_worker(stop)
@@ -1,4 +1,5 @@
 import { useState, useEffect, useRef, useCallback } from 'react'
+import usePlaybackEvents from '../usePlaybackEvents'
 
 const SPEED_PRESETS = [
   { label: '50%', value: 0.5 },
@@ -14,7 +15,13 @@ function formatTime(seconds) {
   return `${mins}:${secs.toString().padStart(2, '0')}`
 }
 
-function AudioPlayer({ recordingId, segments = [], onTimeUpdate }) {
+// Loudness normalization from the recording's gain_db. <audio> volume can't go above 1,
+// so recordings quieter than the target play as they are.
+function gainToVolume(gainDb) {
+  return gainDb == null ? 1 : Math.min(1, Math.pow(10, gainDb / 20))
+}
+
+function AudioPlayer({ recordingId, gainDb, segments = [], onTimeUpdate }) {
   const audioRef = useRef(null)
   const progressRef = useRef(null)
   const animFrameRef = useRef(null)
@@ -38,6 +45,11 @@ function AudioPlayer({ recordingId, segments = [], onTimeUpdate }) {
 
   const audioUrl = `/api/recordings/${recordingId}/stream?token=${localStorage.getItem('token')}`
 
+  const reportEvent = usePlaybackEvents(recordingId)
+  function report(kind) {
+    if (audioRef.current) reportEvent(kind, audioRef.current, loopSegment)
+  }
+
   // Auto-ramp effect: when enabled, gradually increase speed by rampStep each loop until reaching rampEnd
 
   function applyRamp(audio) {
@@ -55,6 +67,7 @@ function AudioPlayer({ recordingId, segments = [], onTimeUpdate }) {
     setSpeed(rounded)
     speedRef.current = rounded
     audio.playbackRate = rounded
+    report('ramp')
     if (rounded >= ramp.end) setRampReachedMax(true)
   }
 
@@ -69,6 +82,7 @@ function AudioPlayer({ recordingId, segments = [], onTimeUpdate }) {
 
       // Loop enforcement — if we're looping a segment and we've passed the end, jump back
       if (loopSegment && audio.currentTime >= loopSegment.end_time) {
+        report('loop')
         applyRamp(audio)
         audio.currentTime = loopSegment.start_time
       }
@@ -92,6 +106,7 @@ function AudioPlayer({ recordingId, segments = [], onTimeUpdate }) {
     const audio = audioRef.current
     if (audio) {
       setDuration(audio.duration)
+      audio.volume = gainToVolume(gainDb)
       setError('')
     }
   }
@@ -100,9 +115,11 @@ function AudioPlayer({ recordingId, segments = [], onTimeUpdate }) {
     // If looping a segment, restart it; otherwise stop
     if (loopSegment) {
       const audio = audioRef.current
+      report('loop')
       audio.currentTime = loopSegment.start_time
       audio.play()
     } else {
+      report('ended')
       setIsPlaying(false)
       setCurrentTime(0)
     }
@@ -148,6 +165,7 @@ function AudioPlayer({ recordingId, segments = [], onTimeUpdate }) {
     speedRef.current = rounded
     if (audioRef.current) {
       audioRef.current.playbackRate = rounded
+      report('speed')
     }
   }
 
@@ -168,6 +186,7 @@ function AudioPlayer({ recordingId, segments = [], onTimeUpdate }) {
     const newTime = fraction * duration
     audio.currentTime = newTime
     setCurrentTime(newTime)
+    report('seek')
   }
 
   // --- Segment looping ---
@@ -209,7 +228,10 @@ function AudioPlayer({ recordingId, segments = [], onTimeUpdate }) {
     return () => {
       const audio = audioRef.current
       if (audio) {
-        audio.pause()
+        if (!audio.paused) {
+          audio.pause()
+          report('pause')   // the element is detached by now, so onPause won't fire
+        }
         audio.src = ''
       }
     }
@@ -255,6 +277,8 @@ function AudioPlayer({ recordingId, segments = [], onTimeUpdate }) {
         preload="auto"
         onLoadedMetadata={handleLoadedMetadata}
         onEnded={handleEnded}
+        onPlay={() => report('play')}
+        onPause={() => report('pause')}
         onError={handleError}
       />
 
@@ -1,10 +1,32 @@
 import { useState, useEffect, useRef, useCallback } from 'react'
-import api from '../api'
 import { useToast } from './Toast'
 import MobileTuneEditForm from './MobileTuneEditForm'
 import MobileSegmentEditForm from './MobileSegmentEditForm'
 import MobileQuickMark from './MobileQuickMark'
 import RecordingUpload from './RecordingUpload'
+import usePlaybackEvents from '../usePlaybackEvents'
+
+// Ask for the smaller Opus rendition where the browser can play it. The server
+// falls back to the original until the renditions have been transcoded.
+const STREAM_RENDITION = new Audio().canPlayType('audio/ogg; codecs="opus"') ? 'opus' : 'aac'
+
+// Long recordings are also packaged as HLS chunks. Where the browser plays HLS
+// natively it only fetches the chunks around the playhead, which keeps seeking
+// and segment loops responsive on a weak connection.
+const NATIVE_HLS = !!new Audio().canPlayType('application/vnd.apple.mpegurl')
+
+function streamUrl(recording) {
+  const token = localStorage.getItem('token')
+  if (NATIVE_HLS && recording.hls_ready) {
+    return `/api/recordings/${recording.id}/hls/playlist.m3u8?token=${token}`
+  }
+  return `/api/recordings/${recording.id}/stream?token=${token}&rendition=${STREAM_RENDITION}`
+}
+
+// <audio> volume can't go above 1, so only recordings louder than the target are evened out
+function gainToVolume(gainDb) {
+  return gainDb == null ? 1 : Math.min(1, Math.pow(10, gainDb / 20))
+}
 
 function formatTime(seconds) {
   const s = Math.round(seconds)
@@ -48,40 +70,45 @@ function MobileTuneDetail({ tune, recordings, onBack, onRecordingsChanged, onTun
   const [showUpload, setShowUpload] = useState(false)
   const longPressTimer = useRef(null)
 
-  // Auto-select first recording
+  const reportEvent = usePlaybackEvents(selectedRecording?.id)
+  function report(kind) {
+    if (audioRef.current) reportEvent(kind, audioRef.current, loopSegment)
+  }
+  const reportRef = useRef(report)
+  reportRef.current = report   // for the unmount cleanup, which would otherwise see the first render's recording
+
+  // Recordings arrive with their segments. Keep the selection in step when they are
+  // reloaded, or auto-select the first recording.
   useEffect(() => {
-    if (recordings.length > 0 && !selectedRecording) {
+    const current = selectedRecording && recordings.find(r => r.id === selectedRecording.id)
+    if (current) {
+      setSelectedRecording(current)
+      setSegments(current.segments || [])
+    } else if (recordings.length > 0 && !selectedRecording) {
       selectRecording(recordings[0])
     }
   }, [recordings])
 
-  async function selectRecording(rec) {
+  function selectRecording(rec) {
     stopPlayback()
     setSelectedRecording(rec)
     setLoopSegment(null)
     setMarking(false)
-    try {
-      const res = await api.get(`/recordings/${rec.id}/segments`)
-      setSegments(res.data)
-    } catch (err) {
-      console.error('Failed to fetch segments:', err)
-    }
+    setSegments(rec.segments || [])
   }
 
-  async function fetchSegments() {
-    if (!selectedRecording) return
-    try {
-      const res = await api.get(`/recordings/${selectedRecording.id}/segments`)
-      setSegments(res.data)
-    } catch (err) {
-      console.error('Failed to fetch segments:', err)
-    }
+  // Segments are part of the tune detail, so refreshing them reloads it in one request
+  function fetchSegments() {
+    onRecordingsChanged()
   }
 
   function stopPlayback() {
     const audio = audioRef.current
     if (audio) {
-      audio.pause()
+      if (!audio.paused) {
+        audio.pause()
+        report('pause')   // now, onPause only fires once the next recording is selected
+      }
       audio.currentTime = 0
     }
     setIsPlaying(false)
@@ -105,6 +132,7 @@ function MobileTuneDetail({ tune, recordings, onBack, onRecordingsChanged, onTun
     setSpeed(rounded)
     speedRef.current = rounded
     audio.playbackRate = rounded
+    report('ramp')
     if (rounded >= ramp.end) setRampReachedMax(true)
   }
 
@@ -116,6 +144,7 @@ function MobileTuneDetail({ tune, recordings, onBack, onRecordingsChanged, onTun
     setCurrentTime(time)
 
     if (loopSegment && audio.currentTime >= loopSegment.end_time) {
+        report('loop')
         applyRamp(audio)
         audio.currentTime = loopSegment.start_time
         setCurrentTime(loopSegment.start_time)
@@ -142,6 +171,7 @@ function MobileTuneDetail({ tune, recordings, onBack, onRecordingsChanged, onTun
 
     function handleTimeUpdate() {
       if (loopSegment && audio.currentTime >= loopSegment.end_time) {
+        report('loop')
         applyRamp(audio)
         audio.currentTime = loopSegment.start_time
         setCurrentTime(loopSegment.start_time)
@@ -180,7 +210,10 @@ function MobileTuneDetail({ tune, recordings, onBack, onRecordingsChanged, onTun
     const clamped = Math.round(newSpeed * 100) / 100
     setSpeed(clamped)
     speedRef.current = clamped
-    if (audioRef.current) audioRef.current.playbackRate = clamped
+    if (audioRef.current) {
+      audioRef.current.playbackRate = clamped
+      report('speed')
+    }
   }
 
   // Keep ramp ref in sync
@@ -218,13 +251,20 @@ function MobileTuneDetail({ tune, recordings, onBack, onRecordingsChanged, onTun
     const fraction = Math.max(0, Math.min(1, (e.clientX - rect.left) / rect.width))
     audio.currentTime = fraction * duration
     setCurrentTime(fraction * duration)
+    report('seek')
   }
 
   // Cleanup
   useEffect(() => {
     return () => {
       const audio = audioRef.current
-      if (audio) { audio.pause(); audio.src = '' }
+      if (audio) {
+        if (!audio.paused) {
+          audio.pause()
+          reportRef.current('pause')   // the element is detached by now, so onPause won't fire
+        }
+        audio.src = ''
+      }
     }
   }, [])
 
@@ -296,22 +336,27 @@ function MobileTuneDetail({ tune, recordings, onBack, onRecordingsChanged, onTun
         <>
           <audio
             ref={audioRef}
-            src={`/api/recordings/${selectedRecording.id}/stream?token=${localStorage.getItem('token')}`}
+            src={streamUrl(selectedRecording)}
             preload="auto"
             onLoadedMetadata={() => {
               if (audioRef.current) {
                 setDuration(audioRef.current.duration)
                 audioRef.current.playbackRate = speed
+                audioRef.current.volume = gainToVolume(selectedRecording.gain_db)
               }
             }}
             onEnded={() => {
               if (loopSegment) {
+                report('loop')
                 audioRef.current.currentTime = loopSegment.start_time
                 audioRef.current.play()
               } else {
+                report('ended')
                 setIsPlaying(false)
               }
             }}
+            onPlay={() => report('play')}
+            onPause={() => report('pause')}
           />
 
           {/* Timeline */}
@@ -14,6 +14,7 @@ function RecordingUpload({ tuneId, onUploaded }) {
   const [uploading, setUploading] = useState(false)
   const [dragover, setDragover] = useState(false)
   const [error, setError] = useState('')
+  const [duplicateOf, setDuplicateOf] = useState(null)
   const fileInputRef = useRef(null)
 
   function handleFileSelect(selectedFile) {
@@ -55,7 +56,7 @@ function RecordingUpload({ tuneId, onUploaded }) {
     setDragover(false)
   }
 
-  async function handleUpload() {
+  async function handleUpload(duplicate = false) {
     if (!file) return
 
     // All-or-nothing key validation
@@ -66,6 +67,7 @@ function RecordingUpload({ tuneId, onUploaded }) {
 
     setUploading(true)
     setError('')
+    setDuplicateOf(null)
 
     try {
       const formData = new FormData()
@@ -74,6 +76,7 @@ function RecordingUpload({ tuneId, onUploaded }) {
       if (description.trim()) formData.append('description', description.trim())
       const key = buildKey(keyTonic, keyQuality)
       if (key) formData.append('key', key)
+      if (duplicate) formData.append('duplicate', 'true')
 
       await api.post(`/tunes/${tuneId}/recordings`, formData, {
         headers: { 'Content-Type': 'multipart/form-data' },
@@ -90,7 +93,9 @@ function RecordingUpload({ tuneId, onUploaded }) {
       toast('Recording uploaded')
       onUploaded()
     } catch (err) {
-      setError(err.response?.data?.detail || 'Upload failed')
+      // Same file uploaded before: the server keeps one copy if the user goes ahead
+      if (err.response?.status === 409) setDuplicateOf(err.response.data.detail)
+      else setError(err.response?.data?.detail || 'Upload failed')
     } finally {
       setUploading(false)
     }
@@ -99,12 +104,21 @@ function RecordingUpload({ tuneId, onUploaded }) {
   function handleClearFile() {
     setFile(null)
     setError('')
+    setDuplicateOf(null)
     if (fileInputRef.current) fileInputRef.current.value = ''
   }
 
   return (
     <div style={{ marginBottom: 'var(--space-lg)' }}>
       {error && <div className="login-error mb-md">{error}</div>}
+      {duplicateOf && (
+        <div className="login-error mb-md">
+          This file is already uploaded under "{duplicateOf.tune_title}".{' '}
+          <button className="btn-ghost btn-sm" onClick={() => handleUpload(true)} disabled={uploading}>
+            Add it here too
+          </button>
+        </div>
+      )}
 
       {!file ? (
         <div
@@ -165,7 +179,7 @@ function RecordingUpload({ tuneId, onUploaded }) {
             <div style={{ display: 'flex', gap: 'var(--space-sm)' }}>
               <button
                 className="btn-primary"
-                onClick={handleUpload}
+                onClick={() => handleUpload()}
                 disabled={uploading}
               >
                 {uploading ? 'Uploading...' : 'Upload Recording'}
@@ -14,10 +14,10 @@ function formatTime(seconds) {
   return `${mins}:${secs.toString().padStart(2, '0')}`
 }
 
-function SegmentList({ recordingId, onChanged, playbackTime = 0 }) {
+function SegmentList({ recordingId, initialSegments, onChanged, playbackTime = 0 }) {
   const toast = useToast()
-  const [segments, setSegments] = useState([])
-  const [loading, setLoading] = useState(true)
+  const [segments, setSegments] = useState(initialSegments || [])
+  const [loading, setLoading] = useState(!initialSegments)
   const [showForm, setShowForm] = useState(false)
   const [editingId, setEditingId] = useState(null)
 
@@ -30,7 +30,13 @@ function SegmentList({ recordingId, onChanged, playbackTime = 0 }) {
   const [saving, setSaving] = useState(false)
 
   useEffect(() => {
-    fetchSegments()
+    // Tune pages pass the segments that came with the tune detail
+    if (initialSegments) {
+      setSegments(initialSegments)
+      setLoading(false)
+    } else {
+      fetchSegments()
+    }
   }, [recordingId])
 
   async function fetchSegments() {
@@ -11,12 +11,14 @@ function SetlistManager({onSelectTune}) {
   const [showForm, setShowForm] = useState(false)
   const [editingId, setEditingId] = useState(null)
   const [expandedSetlist, setExpandedSetlist] = useState(null)
+  const [tuneDetails, setTuneDetails] = useState({}) // tune id -> recordings with segments, for choosing what to rehearse
+  const [rehearsal, setRehearsal] = useState(null) // { setlistId, url } once built, { setlistId } while building
 
   // Form state
   const [title, setTitle] = useState('')
   const [performanceId, setPerformanceId] = useState('')
   const [notes, setNotes] = useState('')
-  const [items, setItems] = useState([]) // { localId, tune_id }
+  const [items, setItems] = useState([]) // { localId, tune_id, source } where source is '', 'r:<recording id>' or 's:<segment id>'
   const [saving, setSaving] = useState(false)
   const [error, setError] = useState('')
 
@@ -55,6 +57,16 @@ function SetlistManager({onSelectTune}) {
     }
   }
 
+  async function fetchTuneDetail(tuneId) {
+    if (!tuneId || tuneDetails[tuneId]) return
+    try {
+      const res = await api.get(`/tunes/${tuneId}/full`)
+      setTuneDetails(prev => ({ ...prev, [tuneId]: res.data }))
+    } catch (err) {
+      console.error('Failed to fetch tune:', err)
+    }
+  }
+
   function resetForm() {
     setTitle('')
     setPerformanceId('')
@@ -63,14 +75,20 @@ function SetlistManager({onSelectTune}) {
     setEditingId(null)
     setShowForm(false)
     setError('')
+    setRehearsal(null) // the next rehearsal request picks up any changes
   }
 
   function addItem() {
-    setItems(prev => [...prev, { localId: Date.now(), tune_id: '' }])
+    setItems(prev => [...prev, { localId: Date.now(), tune_id: '', source: '' }])
   }
 
   function updateItem(localId, field, value) {
-    setItems(prev => prev.map(i => i.localId === localId ? { ...i, [field]: value } : i))
+    setItems(prev => prev.map(i => {
+      if (i.localId !== localId) return i
+      // A different tune can't keep the previous tune's recording
+      return field === 'tune_id' ? { ...i, tune_id: value, source: '' } : { ...i, [field]: value }
+    }))
+    if (field === 'tune_id') fetchTuneDetail(value)
   }
 
   function removeItem(localId) {
@@ -96,7 +114,9 @@ function SetlistManager({onSelectTune}) {
     setItems(setlist.entries.map((entry, idx) => ({
       localId: Date.now() + idx,
       tune_id: entry.tune_id.toString(),
+      source: entry.segment_id ? `s:${entry.segment_id}` : entry.recording_id ? `r:${entry.recording_id}` : '',
     })))
+    setlist.entries.forEach(entry => fetchTuneDetail(entry.tune_id.toString()))
     setEditingId(setlist.id)
     setShowForm(true)
     setExpandedSetlist(null)
@@ -124,10 +144,15 @@ function SetlistManager({onSelectTune}) {
 
     setSaving(true)
     try {
-      const entriesPayload = items.map((item, idx) => ({
-        tune_id: parseInt(item.tune_id, 10),
-        position: idx,
-      }))
+      const entriesPayload = items.map((item, idx) => {
+        const [kind, id] = item.source.split(':')
+        return {
+          tune_id: parseInt(item.tune_id, 10),
+          position: idx,
+          recording_id: kind === 'r' ? parseInt(id, 10) : null,
+          segment_id: kind === 's' ? parseInt(id, 10) : null,
+        }
+      })
 
       if (editingId) {
         // Update metadata
@@ -169,6 +194,31 @@ function SetlistManager({onSelectTune}) {
     }
   }
 
+  // The rehearsal track is built by a background job; ask for one byte until it's ready
+  async function handleRehearse(setlistId) {
+    const url = `/api/setlists/${setlistId}/rehearsal?token=${localStorage.getItem('token')}`
+    setRehearsal({ setlistId })
+    try {
+      while (true) {
+        const res = await fetch(url, { headers: { Range: 'bytes=0-0' } })
+        if (res.status === 202) {
+          const wait = parseInt(res.headers.get('Retry-After') || '10', 10)
+          await new Promise(resolve => setTimeout(resolve, wait * 1000))
+          continue
+        }
+        if (!res.ok) {
+          const body = await res.json().catch(() => ({}))
+          throw new Error(body.detail || 'Failed to build rehearsal')
+        }
+        setRehearsal(current => current?.setlistId === setlistId ? { setlistId, url } : current)
+        return
+      }
+    } catch (err) {
+      setRehearsal(null)
+      toast(err.message)
+    }
+  }
+
   function formatDate(dateStr) {
     return new Date(dateStr + 'T12:00:00').toLocaleDateString('en-US', {
       month: 'short',
@@ -280,6 +330,21 @@ function SetlistManager({onSelectTune}) {
                       <option key={t.id} value={t.id}>{tuneLabel(t)}</option>
                     ))}
                   </select>
+                  {tuneDetails[item.tune_id]?.recordings.length > 0 && (
+                    <select
+                      value={item.source}
+                      onChange={e => updateItem(item.localId, 'source', e.target.value)}
+                      title="What the rehearsal track plays for this tune"
+                    >
+                      <option value="">Latest recording</option>
+                      {tuneDetails[item.tune_id].recordings.map(r => [
+                        <option key={`r${r.id}`} value={`r:${r.id}`}>{r.original_name}</option>,
+                        ...r.segments.map(seg => (
+                          <option key={`s${seg.id}`} value={`s:${seg.id}`}>&nbsp;&nbsp;{seg.label}</option>
+                        )),
+                      ])}
+                    </select>
+                  )}
                 </div>
                 <div className="setlist-item-actions">
                   <button
@@ -381,6 +446,19 @@ function SetlistManager({onSelectTune}) {
 
                 {isExpanded && setlist.entries.length > 0 && (
                   <div className="session-entries fade-in">
+                    <div className="mb-md">
+                      {rehearsal?.setlistId === setlist.id && rehearsal.url ? (
+                        <audio controls autoPlay src={rehearsal.url} style={{ width: '100%' }} />
+                      ) : (
+                        <button
+                          className="btn-ghost btn-sm"
+                          disabled={rehearsal?.setlistId === setlist.id}
+                          onClick={e => { e.stopPropagation(); handleRehearse(setlist.id) }}
+                        >
+                          {rehearsal?.setlistId === setlist.id ? 'Preparing rehearsal...' : '▶ Rehearse'}
+                        </button>
+                      )}
+                    </div>
                     {setlist.entries.map((entry, idx) => (
                       <div key={entry.id} className="setlist-display-item">
                         <span className="setlist-display-number">{idx + 1}</span>
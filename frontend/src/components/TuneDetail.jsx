@@ -26,8 +26,7 @@ function TuneDetail({ tuneId, onBack }) {
   const [showUpload, setShowUpload] = useState(false)
 
   useEffect(() => {
-    fetchTune()
-    fetchRecordings()
+    fetchTuneDetail()
   }, [tuneId])
 
   useEffect(() => {
@@ -49,20 +48,24 @@ function TuneDetail({ tuneId, onBack }) {
     fetchSegments(recordingId)
   }
 
-  async function fetchTune() {
+  // Tune, recordings and their segments in one request
+  async function fetchTuneDetail() {
     try {
-      const res = await api.get(`/tunes/${tuneId}`)
-      setTune(res.data)
-      const parsed = parseKey(res.data.key)
+      const res = await api.get(`/tunes/${tuneId}/full`)
+      const { recordings: tuneRecordings, ...tuneData } = res.data
+      setTune(tuneData)
+      setRecordings(tuneRecordings)
+      setRecordingSegments(Object.fromEntries(tuneRecordings.map(r => [r.id, r.segments])))
+      const parsed = parseKey(tuneData.key)
       setEditForm({
-        title: res.data.title || '',
-        composer: res.data.composer || '',
+        title: tuneData.title || '',
+        composer: tuneData.composer || '',
         keyTonic: parsed.tonic,
         keyQuality: parsed.quality,
-        tempo: res.data.tempo || '',
-        form: res.data.form || '',
-        status: res.data.status || 'learning',
-        notes: res.data.notes || '',
+        tempo: tuneData.tempo || '',
+        form: tuneData.form || '',
+        status: tuneData.status || 'learning',
+        notes: tuneData.notes || '',
       })
     } catch (err) {
       console.error('Failed to fetch tune:', err)
@@ -71,15 +74,6 @@ function TuneDetail({ tuneId, onBack }) {
     }
   }
 
-  async function fetchRecordings() {
-    try {
-      const res = await api.get(`/tunes/${tuneId}/recordings`)
-      setRecordings(res.data)
-    } catch (err) {
-      console.error('Failed to fetch recordings:', err)
-    }
-  }
-
   async function handleSaveEdit(e) {
     e.preventDefault()
 
@@ -169,8 +163,8 @@ function TuneDetail({ tuneId, onBack }) {
         tune={tune}
         recordings={recordings}
         onBack={onBack}
-        onRecordingsChanged={fetchRecordings}
-        onTuneChanged={fetchTune}
+        onRecordingsChanged={fetchTuneDetail}
+        onTuneChanged={fetchTuneDetail}
         onTuneDeleted={onBack}
       />
     )
@@ -321,7 +315,7 @@ function TuneDetail({ tuneId, onBack }) {
 
       {recordings.length === 0 ? (
         <div style={{ marginBottom: 'var(--space-md)' }}>
-          <RecordingUpload tuneId={tuneId} onUploaded={fetchRecordings} />
+          <RecordingUpload tuneId={tuneId} onUploaded={fetchTuneDetail} />
         </div>
       ) : (
         <div className="recording-list">
@@ -372,11 +366,13 @@ function TuneDetail({ tuneId, onBack }) {
                   <div className="recording-expanded fade-in">
                     <AudioPlayer
                       recordingId={rec.id}
+                      gainDb={rec.gain_db}
                       segments={segments}
                       onTimeUpdate={setPlaybackTime}
                     />
                     <SegmentList
                       recordingId={rec.id}
+                      initialSegments={recordingSegments[rec.id]}
                       onChanged={() => handleSegmentsChanged(rec.id)}
                       playbackTime={playbackTime}
                     />
@@ -392,7 +388,7 @@ function TuneDetail({ tuneId, onBack }) {
       {recordings.length > 0 && (
         showUpload ? (
           <div className="mt-md">
-            <RecordingUpload tuneId={tuneId} onUploaded={() => { fetchRecordings(); setShowUpload(false) }} />
+            <RecordingUpload tuneId={tuneId} onUploaded={() => { fetchTuneDetail(); setShowUpload(false) }} />
             <button
               className="btn-ghost btn-sm mt-sm"
               onClick={() => setShowUpload(false)}
@@ -0,0 +1,54 @@
+import { useEffect, useRef, useCallback } from 'react'
+import api from './api'
+
+const FLUSH_INTERVAL_MS = 10000
+const MAX_BATCH = 200
+
+// ISO timestamp with the local UTC offset, the server uses it to pick the practice day
+function localTimestamp() {
+  const now = new Date()
+  const offset = -now.getTimezoneOffset()
+  const pad = (n) => String(Math.floor(Math.abs(n))).padStart(2, '0')
+  const local = new Date(now.getTime() + offset * 60000).toISOString().slice(0, -1)
+  return `${local}${offset >= 0 ? '+' : '-'}${pad(offset / 60)}:${pad(offset % 60)}`
+}
+
+// Collects playback events for a recording and posts them to /api/events in batches.
+// Each event carries the wall-clock time played since the previous one, which the
+// server rolls up into practice time per segment.
+export default function usePlaybackEvents(recordingId) {
+  const queue = useRef([])
+  const playingSince = useRef(null)
+
+  const flush = useCallback(() => {
+    if (queue.current.length === 0) return
+    const events = queue.current.splice(0)
+    api.post('/events', { events }).catch(() => {})   // practice stats are best effort
+  }, [])
+
+  useEffect(() => {
+    const timer = setInterval(flush, FLUSH_INTERVAL_MS)
+    window.addEventListener('pagehide', flush)
+    return () => {
+      clearInterval(timer)
+      window.removeEventListener('pagehide', flush)
+      setTimeout(flush, 0)   // after the player's own cleanup has reported its last pause
+    }
+  }, [flush])
+
+  return useCallback((kind, audio, segment) => {
+    const now = performance.now()
+    const played = playingSince.current == null ? 0 : (now - playingSince.current) / 1000
+    playingSince.current = audio.paused ? null : now
+    queue.current.push({
+      kind,
+      recording_id: recordingId,
+      segment_id: segment ? segment.id : null,
+      position: audio.currentTime || 0,
+      speed: audio.playbackRate,
+      played_seconds: Math.min(played, 3600),
+      occurred_at: localTimestamp(),
+    })
+    if (queue.current.length >= MAX_BATCH) flush()
+  }, [recordingId, flush])
+}